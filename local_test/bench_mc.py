@@ -0,0 +1,1305 @@
+import os
+import io
+import re
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import socket
+import struct
+import zlib
+import pathlib
+import tempfile
+import logging
+import threading
+import datetime
+import contextlib
+import collections
+import subprocess
+import http.server
+import urllib.parse
+import unittest.mock
+
+# paramiko
+import paramiko
+
+SCRIPT_DIR = pathlib.Path(__file__).parent.resolve()
+sys.path.insert(0, str(SCRIPT_DIR.parent))
+import mc_ctl
+
+USAGE = '''
+Usage: {0} [suite|rcon|importtime|autoscale|pregen|regions|compact|pack|daemon|help] [arguments...]
+    suite: Measure create, do_commands, backup (cold and hot), migrate and destroy against local stand-ins of DigitalOcean, droplets and GitHub
+        {0} suite [runs] [regions] [history_depth] [save|check]
+        ex: {0} suite 5 16 8 save
+        ex: {0} suite 5 16 8 check
+        The synthetic world has [regions] region files and [history_depth] commits.
+        save stores the result as the baseline of that world size in {1},
+        check exits with 1 when latency or bytes moved regressed from it.
+    rcon: Measure rcon throughput against a local fake RCON server
+        {0} rcon [commands] [rtt_ms] [exec_ms]
+        ex: {0} rcon 500 50 1
+    importtime: Measure mc_ctl.py startup per action with python -X importtime
+        {0} importtime [action[,...]] [runs]
+        ex: {0} importtime help,list,rcon 5
+        DigitalOcean and the droplets are not reachable from the benchmark, so actions stop at their first network call.
+    autoscale: Replay synthetic metric streams through the autoscaler against local stand-ins of DigitalOcean and a droplet
+        {0} autoscale [interval_seconds]
+        ex: {0} autoscale 60
+        Samples are [interval_seconds] apart on the clock of the streams; exits with 1 when the resizes differ from the expected ones.
+    pregen: Simulate the pregen throttle against fixed windows, then run a resumed pregen against a fake droplet
+        {0} pregen [simulated_seconds]
+        ex: {0} pregen 600
+    regions: Measure the region analyzer on a synthetic world against decompressing every chunk, then prune it
+        {0} regions [region_files] [chunks_per_region]
+        ex: {0} regions 200 512
+    compact: Compact a synthetic backup history of [days] with [backups_per_day] while its world runs, then back it up again
+        {0} compact [days] [backups_per_day]
+        ex: {0} compact 365 12
+    pack: Pack [worlds] small worlds onto shared droplets, address one of them, then destroy them all
+        {0} pack [worlds]
+        ex: {0} pack 7
+    daemon: Pack [worlds] at once through invocations of mc_ctl.py served by a daemon, measure rcon through it against cold ones, and check the ordering of its queue
+        {0} daemon [requests] [worlds]
+        ex: {0} daemon 20 3
+        A cold invocation is measured as the startup of mc_ctl.py with its libraries plus an rcon with no client, key or lookup cached.
+    help: Show this
+        {0} help
+'''.format(__file__, 'local_test/bench_baseline.json').strip()
+
+SUITE_OPERATIONS = [ 'create', 'do_commands', 'backup', 'hot_backup', 'migrate', 'destroy' ]
+SUITE_WORLD = 'bench/world'
+SUITE_VERSION = '1.16.5'
+BASELINE_PATH = SCRIPT_DIR / 'bench_baseline.json'
+# a result is a regression when it exceeds the baseline by this fraction plus the margin of its metric
+REGRESSION_TOLERANCE = 0.2
+REGRESSION_MARGINS = { 'p50': 0.05, 'api_bytes': 4096, 'ssh_bytes': 4096, 'git_bytes': 65536 }
+# added to every request of the fake DigitalOcean API
+FAKE_API_RTT = 0.05
+# phases of synthetic samples: name, number of samples and metrics of every sample (a list alternates)
+AUTOSCALE_PHASES = [
+    ('quiet evening', 10, [ { 'players_online': 3, 'mspt': 25.0 } ]),
+    ('weekend rush', 8, [ { 'players_online': 20, 'mspt': 60.0, 'tps': 16.5 } ]),
+    ('busy after resize', 10, [ { 'players_online': 20, 'mspt': 50.0 } ]),
+    ('flapping', 40, [ { 'players_online': 0, 'mspt': 10.0 }, { 'players_online': 0, 'mspt': 50.0 } ]),
+    ('night', 40, [ { 'players_online': 0, 'mspt': 5.0, 'container_memory_bytes': 300, 'container_memory_limit_bytes': 1000 } ])
+]
+AUTOSCALE_EXPECTED = [ ('weekend rush', '2gb', '4gb'), ('night', '4gb', '2gb') ]
+# simulated server of pregen: milliseconds per tick when idle, added by each square being generated, and noise
+PREGEN_SIMULATED_TICK = (18, 6, 4)
+PREGEN_FIXED_WINDOWS = [ 1, 4, 16 ]
+# share of synthetic chunks players never stayed in, and the threshold regions prune uses in the benchmark
+REGIONS_UNVISITED = 0.7
+REGIONS_MIN_INHABITED = 1200
+# chunk bodies are slices of this, about as compressible as real block data
+REGIONS_FILLER = bytes(random.Random(1).choice(b'\x00\x01\x02\x03abc') for _ in range(1 << 18))
+# retention of the compact benchmark and the synthetic world it thins out, one region rewritten per backup
+COMPACT_RETENTION = 'hour:24,day:30,month:0'
+COMPACT_REGIONS = 8
+# every droplet has 2 vCPUs and this memory, of which each container takes PACK_CONTAINER_MEMORY; a packed world reserves PACK_WORLD_MEMORY
+PACK_HOST_MEMORY = 2084569088
+PACK_CONTAINER_MEMORY = 400 * 1048576
+PACK_WORLD_MEMORY = 512 * 1048576
+# containers of a droplet are kept in $HOME/containers.json: docker inspect gives the address _FakeDroplet forwards
+# to its RCON server, docker info tells a 2gb droplet and docker stats an eighth of a vCPU and PACK_CONTAINER_MEMORY for every container
+DOCKER_STUB = '''#!{0}
+import os, sys, json
+path = os.path.join(os.environ['HOME'], 'containers.json')
+containers = json.load(open(path)) if os.path.exists(path) else {{}}
+args = sys.argv[1:]
+if args[:1] == [ 'inspect' ]:
+    print('127.0.0.1')
+elif args[:1] == [ 'info' ]:
+    print('2 {1}')
+elif args[:1] == [ 'stats' ]:
+    for name in containers:
+        print('12.50% {2}MiB / 768MiB')
+elif args[:1] == [ 'ps' ]:
+    for c in containers.values():
+        if 'mcctl.world' in c['labels']:
+            print('%s\\t%s' % (c['labels']['mcctl.world'], c['labels']['mcctl.port']))
+elif args[:1] == [ 'run' ]:
+    c = {{ 'labels': {{}} }}
+    for option, value in zip(args, args[1:]):
+        if option == '--name':
+            name = value
+        elif option == '-p':
+            c['port'] = value.split(':')[0]
+        elif option == '--label':
+            c['labels'][value.split('=', 1)[0]] = value.split('=', 1)[1]
+    if name in containers or any(o['port'] == c['port'] for o in containers.values()):
+        sys.exit('docker: conflict of %s' % name)
+    containers[name] = c
+elif args[:2] == [ 'rm', '-f' ]:
+    containers.pop(args[2], None)
+json.dump(containers, open(path, 'w'))
+'''
+# synthetic regions hold this many chunks of incompressible data, like zlib compressed chunks
+REGION_CHUNKS = 32
+RCON_FRAGMENT_BYTES = 4096
+CHUNK_BYTES = 6000
+
+
+def bench_handler(args):
+    action = args[1] if len(args) > 1 else 'help'
+    if action == 'suite':
+        return bench_suite(*args[2:6])
+    elif action == 'rcon':
+        bench_rcon(*[ int(a) for a in args[2:5] ])
+    elif action == 'importtime':
+        bench_importtime(*args[2:4])
+    elif action == 'autoscale':
+        return bench_autoscale(*args[2:3])
+    elif action == 'pregen':
+        return bench_pregen(*args[2:3])
+    elif action == 'regions':
+        return bench_regions(*args[2:4])
+    elif action == 'compact':
+        return bench_compact(*args[2:4])
+    elif action == 'pack':
+        return bench_pack(*args[2:3])
+    elif action == 'daemon':
+        return bench_daemon(*args[2:4])
+    else:
+        print(USAGE)
+    return 0
+
+def bench_suite(runs=5, regions=16, history=8, mode=''):
+    runs, regions, history = int(runs), int(regions), int(history)
+    scenario = 'regions={} history={}'.format(regions, history)
+    print('{}, {} runs of {}'.format(scenario, runs, ' -> '.join(SUITE_OPERATIONS)))
+
+    samples = collections.defaultdict(list)
+    with tempfile.TemporaryDirectory(prefix='mc_ctl_bench_') as root:
+        harness = _Harness(pathlib.Path(root))
+        try:
+            harness.make_world(SUITE_WORLD, regions, history)
+            for _ in range(runs):
+                harness.reset_world(SUITE_WORLD)
+                for operation in SUITE_OPERATIONS:
+                    if operation in [ 'backup', 'hot_backup' ]:
+                        # players changed some regions since the server started
+                        harness.play(SUITE_WORLD)
+                    samples[operation].append(harness.measure(operation, SUITE_WORLD))
+        finally:
+            harness.close()
+
+    summary = collections.OrderedDict((operation, _summarize(samples[operation])) for operation in SUITE_OPERATIONS)
+    print('  {:<12} {:>9} {:>9} {:>9} {:>10} {:>10} {:>10}'.format('operation', 'p50 ms', 'p90 ms', 'p99 ms', 'api KiB', 'ssh KiB', 'git KiB'))
+    for operation, s in summary.items():
+        print('  {:<12} {:9.1f} {:9.1f} {:9.1f} {:10.1f} {:10.1f} {:10.1f}'.format(operation,
+            s['p50'] * 1000, s['p90'] * 1000, s['p99'] * 1000, s['api_bytes'] / 1024, s['ssh_bytes'] / 1024, s['git_bytes'] / 1024))
+
+    if mode == 'save':
+        baselines = mc_ctl._load_cache(BASELINE_PATH)
+        baselines[scenario] = summary
+        mc_ctl._save_cache(BASELINE_PATH, baselines)
+        print('Saved baseline of {} to {}'.format(scenario, BASELINE_PATH))
+    elif mode == 'check':
+        return _check_baseline(scenario, summary)
+    return 0
+
+def _summarize(samples):
+    seconds = sorted(s['seconds'] for s in samples)
+    summary = { 'p{}'.format(p): _percentile(seconds, p) for p in [ 50, 90, 99 ] }
+    for key in [ 'api_bytes', 'ssh_bytes', 'git_bytes' ]:
+        summary[key] = sorted(s[key] for s in samples)[len(samples) // 2]
+    return summary
+
+def _percentile(values, p):
+    # nearest rank, so few runs report observed values instead of interpolations
+    return values[max(0, int(math.ceil(p / 100 * len(values))) - 1)]
+
+def _check_baseline(scenario, summary):
+    baseline = mc_ctl._load_cache(BASELINE_PATH).get(scenario)
+    if baseline is None:
+        print('No baseline of {} in {}, run with save first'.format(scenario, BASELINE_PATH))
+        return 1
+
+    regressions = 0
+    for operation, s in summary.items():
+        for key, margin in REGRESSION_MARGINS.items():
+            base = baseline.get(operation, {}).get(key)
+            if base is not None and s[key] > base * (1 + REGRESSION_TOLERANCE) + margin:
+                print('REGRESSION {} {}: {:.3f} -> {:.3f} ({:+.0f}%)'.format(operation, key, base, s[key], (s[key] / base - 1) * 100 if base > 0 else float('inf')))
+                regressions += 1
+    if regressions == 0:
+        print('No regression from the baseline of {}'.format(scenario))
+        return 0
+    return 1
+
+def bench_rcon(count=500, rtt_ms=50, exec_ms=1):
+    server = _FakeRconServer('password', rtt_ms / 1000, exec_ms / 1000)
+    commands = [ 'whitelist add player{}'.format(i) for i in range(count) ]
+    print('{} commands, rtt {}ms, {}ms per command on the server'.format(count, rtt_ms, exec_ms))
+
+    def reconnect_every_command():
+        # what a process per command does: connect and authenticate every time
+        for c in commands:
+            rcon_client = mc_ctl._RconClient(socket.create_connection(server.address), 'password')
+            rcon_client.command(c)
+            rcon_client.close()
+    _report('reconnect per command', count, reconnect_every_command)
+
+    for window in [ 1, 8, 32 ]:
+        def persistent():
+            rcon_client = mc_ctl._RconClient(socket.create_connection(server.address), 'password', window=window)
+            responses = rcon_client.commands(commands)
+            rcon_client.close()
+            assert responses == [ 'ok: {}'.format(c) for c in commands ]
+        _report('persistent, window {}'.format(window), count, persistent)
+
+    # responses of several packets: exactly filled ones, characters split between packets, and the empty one
+    for window in [ 1, 8 ]:
+        rcon_client = mc_ctl._RconClient(socket.create_connection(server.address), 'password', window=window)
+        cases = [ ('\u00a7a', 2048), ('a\u00a7', 3000), ('abc', 1365), ('x', 4096 * 3), ('-', 0) ] * 2
+        responses = rcon_client.commands([ 'repeat {} {}'.format(n, text) for text, n in cases ] + [ 'list' ])
+        rcon_client.close()
+        assert responses == [ text * n for text, n in cases ] + [ 'ok: list' ], 'fragmented responses of window {}'.format(window)
+    print('  {:<24} ok'.format('fragmented responses'))
+
+    server.close()
+
+def bench_autoscale(interval=60):
+    interval = float(interval)
+    resizes = []
+    round_seconds = []
+    with tempfile.TemporaryDirectory(prefix='mc_ctl_bench_') as root:
+        harness = _Harness(pathlib.Path(root))
+        try:
+            harness.make_world(SUITE_WORLD, 4, 2)
+            harness.reset_world(SUITE_WORLD)
+            with contextlib.redirect_stdout(io.StringIO()):
+                mc_ctl.create_server(SUITE_WORLD)
+
+            states = {}
+            timestamp = time.time()
+            for phase, count, metrics in AUTOSCALE_PHASES:
+                for i in range(count):
+                    timestamp += interval
+                    sample = dict(metrics[i % len(metrics)], timestamp=timestamp, world=SUITE_WORLD, up=1)
+                    started = time.time()
+                    droplets = { droplet.name: droplet for droplet in mc_ctl.list_server() }
+                    size_slug = droplets['minecraft-{}'.format(SUITE_WORLD)].size_slug
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        lines = mc_ctl._autoscale_round([ sample ], droplets, states)
+                    round_seconds.append(time.time() - started)
+                    if len(lines) > 0:
+                        new_size_slug = mc_ctl._find_droplet(SUITE_WORLD, use_index=False).size_slug
+                        resizes.append((phase, size_slug, new_size_slug))
+                        print('  {:<18} sample {:>3}: {} -> {} in {:.2f}s'.format(phase, i + 1, size_slug, new_size_slug, round_seconds[-1]))
+                        for line in lines:
+                            print('    {}'.format(line))
+        finally:
+            harness.close()
+
+    round_seconds.sort()
+    print('{} samples, {} resizes, round p50 {:.1f}ms, p99 {:.1f}ms'.format(len(round_seconds), len(resizes),
+        _percentile(round_seconds, 50) * 1000, _percentile(round_seconds, 99) * 1000))
+    if resizes != AUTOSCALE_EXPECTED:
+        print('UNEXPECTED resizes: {} (expected {})'.format(resizes, AUTOSCALE_EXPECTED))
+        return 1
+    return 0
+
+def bench_pregen(seconds=600):
+    print('{} simulated seconds, tick {}ms + {}ms per square (noise {}ms), squares held {}s'.format(seconds, *PREGEN_SIMULATED_TICK, mc_ctl.PREGEN_HOLD))
+    print('  {:<10} {:>10} {:>9} {:>9} {:>10}'.format('window', 'chunks/s', 'p50 ms', 'p99 ms', 'late %'))
+    for window in PREGEN_FIXED_WINDOWS + [ 'aimd' ]:
+        chunks, ticks = _simulate_pregen(int(seconds), window)
+        ticks.sort()
+        print('  {:<10} {:10.1f} {:9.1f} {:9.1f} {:10.1f}'.format(str(window), chunks / int(seconds),
+            _percentile(ticks, 50), _percentile(ticks, 99), sum(1 for t in ticks if t > 50) / len(ticks) * 100))
+
+    # end to end: a checkpoint as an interrupted run leaves it, resumed against a fake droplet
+    with tempfile.TemporaryDirectory(prefix='mc_ctl_bench_') as root:
+        harness = _Harness(pathlib.Path(root))
+        try:
+            harness.make_world(SUITE_WORLD, 4, 2)
+            harness.reset_world(SUITE_WORLD)
+            with contextlib.redirect_stdout(io.StringIO()):
+                mc_ctl.create_server(SUITE_WORLD)
+            harness.patch('PREGEN_HOLD', 0.2)
+            harness.patch('PREGEN_INTERVAL', 0.05)
+            mc_ctl._save_cache(mc_ctl.PREGEN_CHECKPOINT_PATH, { SUITE_WORLD: { 'radius': 512, 'center': [ 0, 0 ], 'done': 16, 'loaded': [ 16, 17 ], 'chunks': 1024 } })
+            with contextlib.redirect_stdout(io.StringIO()):
+                message = mc_ctl.pregen_world(SUITE_WORLD)
+            print(message)
+            rcon = [ h.rcon for h in harness.hosts.values() ][0]
+            added = [ c for c in rcon.log if c.startswith('forceload add') ]
+            removed = [ c for c in rcon.log if c.startswith('forceload remove') ]
+            finished = SUITE_WORLD not in mc_ctl._load_cache(mc_ctl.PREGEN_CHECKPOINT_PATH)
+        finally:
+            harness.close()
+    # the two squares left loaded are released before the job goes on with them
+    if len(added) != 64 - 16 or len(removed) != len(added) + 2 or not finished:
+        print('UNEXPECTED forceload commands: {} added, {} removed'.format(len(added), len(removed)))
+        return 1
+    return 0
+
+def bench_regions(region_files=200, chunks=512):
+    region_files, chunks = int(region_files), int(chunks)
+    with tempfile.TemporaryDirectory(prefix='mc_ctl_bench_') as root:
+        data_dir = pathlib.Path(root)
+        region_dir = data_dir / 'world' / 'region'
+        region_dir.mkdir(parents=True)
+        rand = random.Random(0)
+        for i in range(region_files):
+            _write_inhabited_region(region_dir / 'r.{}.{}.mca'.format(i % 32, i // 32), chunks, rand)
+        size = sum(f.stat().st_size for f in region_dir.iterdir())
+        print('{} region files of {} chunks, {:.1f} MiB'.format(region_files, chunks, size / 1048576))
+
+        started = time.time()
+        expected = sum(1 for path in sorted(region_dir.iterdir()) for inhabited in _decompress_inhabited(path) if inhabited < REGIONS_MIN_INHABITED)
+        naive = time.time() - started
+        print('  {:<34} {:8.2f}s'.format('decompress every chunk, 1 process', naive))
+
+        for mode in [ 'report', 'prune' ]:
+            started = time.time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = mc_ctl._analyze_regions(str(data_dir), mode, REGIONS_MIN_INHABITED)
+            elapsed = time.time() - started
+            print('  {:<34} {:8.2f}s  ({:.1f}x)'.format('_analyze_regions {}'.format(mode), elapsed, naive / elapsed))
+            if sum(r['prunable'] for r in results) != expected:
+                print('UNEXPECTED prunable chunks: {} (expected {})'.format(sum(r['prunable'] for r in results), expected))
+                return 1
+
+        left = sum(1 for path in region_dir.iterdir() for inhabited in _decompress_inhabited(path) if inhabited < REGIONS_MIN_INHABITED)
+        print('Pruned {} chunks: {:.1f} MiB -> {:.1f} MiB'.format(expected, size / 1048576, sum(f.stat().st_size for f in region_dir.iterdir()) / 1048576))
+        if left != 0:
+            print('UNEXPECTED {} chunks below the threshold after pruning'.format(left))
+            return 1
+    return 0
+
+def bench_compact(days=90, per_day=8):
+    days, per_day = int(days), int(per_day)
+    now = time.time()
+    # half an interval off the hour, so no snapshot sits on the edge of a retention window
+    times = [ int(now - 86400 / per_day * (i + 0.5)) for i in range(days * per_day) ]
+    with tempfile.TemporaryDirectory(prefix='mc_ctl_bench_') as root:
+        harness = _Harness(pathlib.Path(root))
+        try:
+            harness.make_dated_world(SUITE_WORLD, list(reversed(times)))
+            harness.reset_world(SUITE_WORLD)
+            repository = harness.root / 'github' / SUITE_WORLD
+            tree = _git_output(repository, 'rev-parse', 'master^{tree}')
+            with contextlib.redirect_stdout(io.StringIO()):
+                mc_ctl.create_server(SUITE_WORLD)
+            harness.play(SUITE_WORLD)
+
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                message = mc_ctl.compact_backups(SUITE_WORLD, COMPACT_RETENTION)
+            print(output.getvalue().strip())
+            print(message)
+            kept = int(_git_output(repository, 'rev-list', '--count', 'master'))
+            compacted_tree = _git_output(repository, 'rev-parse', 'master^{tree}')
+            with contextlib.redirect_stdout(io.StringIO()):
+                again = mc_ctl.compact_backups(SUITE_WORLD, COMPACT_RETENTION)
+                backup = mc_ctl.backup_world(SUITE_WORLD, backup_mode='cold')
+        finally:
+            harness.close()
+
+    # the newest snapshot of each hour of the last day, of each day of the last 30 days and of each month before
+    timezone = datetime.timezone(datetime.timedelta(hours=9))
+    buckets = set()
+    for t in times:
+        day = datetime.datetime.fromtimestamp(t, timezone)
+        buckets.add(day.strftime('%Y%m%d%H') if now - t < 86400 else day.strftime('%Y%m%d') if now - t < 30 * 86400 else day.strftime('%Y%m'))
+    failures = []
+    if kept != len(buckets):
+        failures.append('{} snapshots kept instead of {}'.format(kept, len(buckets)))
+    if compacted_tree != tree:
+        failures.append('the tree of master changed')
+    if 'Nothing to compact' not in again:
+        failures.append('compacting again: {}'.format(again))
+    if mc_ctl._is_failure_message(backup):
+        failures.append('backing up after compacting: {}'.format(backup))
+    for failure in failures:
+        print('UNEXPECTED {}'.format(failure))
+    return 1 if len(failures) > 0 else 0
+
+def bench_pack(worlds=7):
+    worlds = [ 'bench/small-{}'.format(i) for i in range(int(worlds)) ]
+    # a droplet takes worlds while the measured memory of those it runs and the reservation of the next fit in PACK_FILL
+    per_droplet = int((PACK_HOST_MEMORY * mc_ctl.PACK_FILL - PACK_WORLD_MEMORY) // PACK_CONTAINER_MEMORY) + 1
+    failures = []
+    with tempfile.TemporaryDirectory(prefix='mc_ctl_bench_') as root:
+        harness = _Harness(pathlib.Path(root))
+        try:
+            harness.patch('PACK_WORLD_MEMORY', PACK_WORLD_MEMORY)
+            for world in worlds:
+                harness.make_world(world, 2, 1)
+                harness.reset_world(world)
+
+            # a new shared droplet which does not come up is destroyed again
+            with unittest.mock.patch.object(mc_ctl, '_read_host_size', side_effect=Exception('no answer')), contextlib.redirect_stdout(io.StringIO()):
+                message = mc_ctl.pack_world(worlds[0])
+            if not mc_ctl._is_failure_message(message) or len(harness.droplets) != 0:
+                failures.append('failed boot of a shared droplet: {} ({} droplets left)'.format(message, len(harness.droplets)))
+
+            addresses = {}
+            for world in worlds:
+                started = time.time()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    message = mc_ctl.pack_world(world)
+                print('  {:<16} {:6.2f}s  {}'.format(world, time.time() - started, message))
+                addresses[world] = re.search(r'`([0-9.]+):([0-9]+)`', message).groups() if not mc_ctl._is_failure_message(message) else None
+            packs = [ d['name'] for d in harness.droplets.values() if d['name'].startswith(mc_ctl.PACK_DROPLET_PREFIX) ]
+            if len(packs) != math.ceil(len(worlds) / per_droplet):
+                failures.append('{} shared droplets for {} worlds of {} per droplet'.format(len(packs), len(worlds), per_droplet))
+            if None in addresses.values() or len(set(addresses.values())) != len(worlds):
+                failures.append('addresses of the worlds: {}'.format(addresses))
+            elif any(mc_ctl._server_list_ping(ip, int(port)) is None for ip, port in addresses.values()):
+                failures.append('a packed world does not answer on its port')
+
+            # the last world shares its droplet with others when there are some
+            world = worlds[-1] if len(worlds) % per_droplet != 1 else worlds[0]
+            repository = harness.root / 'github' / world
+            with contextlib.redirect_stdout(io.StringIO()):
+                for action, func in [ ('rcon', lambda: mc_ctl.rcon(world, 'list')), ('backup', lambda: mc_ctl.backup_world(world)), ('restart', lambda: mc_ctl.restart_server(world)) ]:
+                    message = func()
+                    if mc_ctl._is_failure_message(message):
+                        failures.append('{} of {}: {}'.format(action, world, message))
+            if _git_output(repository, 'rev-list', '--count', 'master') != '2':
+                failures.append('backup of {} did not push'.format(world))
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                for world in worlds:
+                    message = mc_ctl.destroy_server(world)
+                    if mc_ctl._is_failure_message(message):
+                        failures.append('destroy of {}: {}'.format(world, message))
+            if len(harness.droplets) != 0:
+                failures.append('droplets left: {}'.format([ d['name'] for d in harness.droplets.values() ]))
+        finally:
+            harness.close()
+
+    print('{} worlds on {} shared droplets ({} per droplet)'.format(len(worlds), len(packs), per_droplet))
+    for failure in failures:
+        print('UNEXPECTED {}'.format(failure))
+    return 1 if len(failures) > 0 else 0
+
+def _write_inhabited_region(path, chunks, rand):
+    # chunks of compressible NBT-like data holding InhabitedTime at a random place, packed like the server does
+    locations = [ 0 ] * 1024
+    sectors = []
+    next_sector = 2
+    for i in rand.sample(range(1024), chunks):
+        inhabited = 0 if rand.random() < REGIONS_UNVISITED else rand.randrange(REGIONS_MIN_INHABITED * 10)
+        offset = rand.randrange(len(REGIONS_FILLER) - 40000)
+        filler = REGIONS_FILLER[offset:offset + rand.randrange(20000, 40000)]
+        at = rand.randrange(len(filler))
+        nbt = b'\x0a\x00\x00' + filler[:at] + b'\x04\x00\x0dInhabitedTime' + struct.pack('>q', inhabited) + filler[at:] + b'\x00'
+        payload = zlib.compress(nbt)
+        chunk = (struct.pack('>IB', len(payload) + 1, 2) + payload)
+        count = (len(chunk) + 4095) // 4096
+        locations[i] = next_sector << 8 | count
+        next_sector += count
+        sectors.append(chunk.ljust(count * 4096, b'\0'))
+    path.write_bytes(struct.pack('>1024I', *locations) + b'\0' * 4096 + b''.join(sectors))
+
+def _decompress_inhabited(path):
+    # the straightforward way: every chunk decompressed whole
+    data = path.read_bytes()
+    for location in struct.unpack('>1024I', data[:4096]):
+        if location >> 8 < 2:
+            continue
+        start = (location >> 8) * 4096
+        length = struct.unpack('>I', data[start:start + 4])[0]
+        nbt = zlib.decompress(data[start + 5:start + 4 + length])
+        found = nbt.find(b'\x04\x00\x0dInhabitedTime')
+        yield struct.unpack('>q', nbt[found + 16:found + 24])[0]
+
+def _simulate_pregen(seconds, window):
+    # one step per second; like pregen_world, squares are added up to the window and released after PREGEN_HOLD
+    rand = random.Random(0)
+    base_ms, square_ms, noise_ms = PREGEN_SIMULATED_TICK
+    current = 1 if window == 'aimd' else window
+    in_flight = collections.deque()
+    chunks = 0
+    ticks = []
+    for now in range(seconds):
+        while len(in_flight) > 0 and now - in_flight[0] >= mc_ctl.PREGEN_HOLD:
+            in_flight.popleft()
+            chunks += mc_ctl.PREGEN_BATCH_CHUNKS ** 2
+        while len(in_flight) < current:
+            in_flight.append(now)
+        tick_ms = max(1, base_ms + square_ms * len(in_flight) + rand.gauss(0, noise_ms))
+        ticks.append(tick_ms)
+        if window == 'aimd':
+            current = mc_ctl._pregen_throttle(current, min(20, 1000 / max(50, tick_ms)), tick_ms)
+    return chunks, ticks
+
+DAEMON_QUEUE_JOB = 0.05
+
+def bench_daemon(requests=20, worlds=3):
+    worlds = [ 'bench/served-{}'.format(i) for i in range(int(worlds)) ]
+    per_droplet = int((PACK_HOST_MEMORY * mc_ctl.PACK_FILL - PACK_WORLD_MEMORY) // PACK_CONTAINER_MEMORY) + 1
+    mc_ctl_path = str(SCRIPT_DIR.parent / 'mc_ctl.py')
+    failures = []
+    with tempfile.TemporaryDirectory(prefix='mc_ctl_bench_') as root:
+        harness = _Harness(pathlib.Path(root))
+        socket_path = harness.root / 'mcctl.sock'
+        env = dict(os.environ, MCCTL_DAEMON_SOCKET=str(socket_path))
+        server = mc_ctl._DaemonServer(str(socket_path), mc_ctl._DaemonHandler)
+        server.queue = mc_ctl._KeyedQueue(mc_ctl.DAEMON_WORKERS)
+        stdout = sys.stdout
+        sys.stdout = mc_ctl._RoutedWriter(stdout)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            harness.patch('PACK_WORLD_MEMORY', PACK_WORLD_MEMORY)
+            for world in worlds:
+                harness.make_world(world, 2, 1)
+                harness.reset_world(world)
+
+            # worlds are packed at once through the daemon, each by its own invocation, so they race for ports and shared droplets
+            started = time.time()
+            procs = [ subprocess.Popen([ sys.executable, mc_ctl_path, 'pack', world ], env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT) for world in worlds ]
+            addresses = []
+            for world, proc in zip(worlds, procs):
+                output = proc.communicate(timeout=300)[0].decode('utf-8', 'replace')
+                address = re.search(r'Packed minecraft .*`([0-9.]+:[0-9]+)`', output)
+                if proc.returncode != 0 or address is None:
+                    failures.append('pack of {} exited with {}: {}'.format(world, proc.returncode, output.strip()[-500:]))
+                else:
+                    addresses.append(address.group(1))
+            if len(set(addresses)) != len(addresses):
+                failures.append('packed worlds share addresses: {}'.format(addresses))
+            packs = [ d['name'] for d in harness.droplets.values() ]
+            if len(set(packs)) != len(packs) or len(packs) != math.ceil(len(worlds) / per_droplet):
+                failures.append('shared droplets {} for {} worlds of {} per droplet'.format(packs, len(worlds), per_droplet))
+            print('  {:<32} {:8.2f}s'.format('pack {} worlds'.format(len(worlds)), time.time() - started))
+
+            def cold_rcon():
+                mc_ctl._manager = None
+                mc_ctl._ssh_keys = None
+                mc_ctl._close_ssh_clients()
+                for key in list(mc_ctl._rcon_clients.keys()):
+                    mc_ctl._close_rcon_client(key[0])
+                if mc_ctl.DROPLET_INDEX_PATH.exists():
+                    mc_ctl.DROPLET_INDEX_PATH.unlink()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    return mc_ctl.rcon(worlds[0], 'list')
+
+            cold, served = [], []
+            for _ in range(int(requests)):
+                started = time.time()
+                subprocess.run([ sys.executable, '-c', 'import mc_ctl, furl, git, digitalocean, paramiko, emoji' ], cwd=str(SCRIPT_DIR.parent), check=True)
+                message = cold_rcon()
+                cold.append(time.time() - started)
+                if mc_ctl._is_failure_message(message):
+                    failures.append('cold rcon: {}'.format(message))
+            for _ in range(int(requests)):
+                started = time.time()
+                proc = subprocess.run([ sys.executable, mc_ctl_path, 'rcon', worlds[0], 'list' ], env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                served.append(time.time() - started)
+                if proc.returncode != 0 or b'ok: list' not in proc.stdout:
+                    failures.append('served rcon exited with {}: {}'.format(proc.returncode, proc.stdout.decode('utf-8', 'replace').strip()))
+            cold.sort()
+            served.sort()
+            print('  {:<32} {:8.1f}ms p50 {:8.1f}ms p90'.format('cold rcon', _percentile(cold, 50) * 1000, _percentile(cold, 90) * 1000))
+            print('  {:<32} {:8.1f}ms p50 {:8.1f}ms p90'.format('rcon through the daemon', _percentile(served, 50) * 1000, _percentile(served, 90) * 1000))
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                for world in worlds:
+                    message = mc_ctl.destroy_server(world)
+                    if mc_ctl._is_failure_message(message):
+                        failures.append('destroy of {}: {}'.format(world, message))
+        finally:
+            server.shutdown()
+            server.server_close()
+            server.queue.shutdown()
+            sys.stdout = stdout
+            harness.close()
+
+    failures.extend(_check_keyed_queue())
+    for failure in failures:
+        print('UNEXPECTED {}'.format(failure))
+    return 1 if len(failures) > 0 else 0
+
+def _check_keyed_queue(workers=4, jobs=6):
+    # every job records when it ran; those of one key must neither overlap nor reorder, those of others must overlap
+    runs = collections.defaultdict(list)
+    lock = threading.Lock()
+    running = [ 0, 0 ]
+    def job(key, i):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        started = time.time()
+        time.sleep(DAEMON_QUEUE_JOB)
+        with lock:
+            running[0] -= 1
+            runs[key].append((i, started, time.time()))
+        return i
+
+    queue = mc_ctl._KeyedQueue(workers)
+    started = time.time()
+    futures = [ queue.submit(key, job, key, i) for i in range(jobs) for key in [ 'a', 'b', None, None ] ]
+    results = [ f.result() for f in futures ]
+    elapsed = time.time() - started
+    queue.shutdown()
+    print('  {:<32} {:8.2f}s (serial {:.2f}s, {} workers at most {})'.format('keyed queue', elapsed, len(futures) * DAEMON_QUEUE_JOB, running[1], workers))
+
+    failures = []
+    if results != [ i for i in range(jobs) for _ in range(4) ]:
+        failures.append('results of the queue: {}'.format(results))
+    for key in [ 'a', 'b' ]:
+        if [ i for i, _, _ in runs[key] ] != list(range(jobs)):
+            failures.append('order of {}: {}'.format(key, runs[key]))
+        if any(later[1] < earlier[2] for earlier, later in zip(runs[key], runs[key][1:])):
+            failures.append('jobs of {} overlapped'.format(key))
+    if not any(a[1] < b[2] and b[1] < a[2] for a in runs['a'] for b in runs['b']):
+        failures.append('jobs of different keys did not overlap')
+    if running[1] > workers:
+        failures.append('{} jobs ran at once on {} workers'.format(running[1], workers))
+    return failures
+
+IMPORTTIME_EAGER = 'import furl, git, digitalocean, paramiko, Cryptodome.PublicKey.RSA, emoji'
+
+def bench_importtime(actions='help,list,rcon', runs=5):
+    env = dict(os.environ,
+            DIGITALOCEAN_API_TOKEN='benchmark',
+            DIGITALOCEAN_END_POINT='http://127.0.0.1:9/v2/',
+            MCCTL_DROPLET_INDEX_TTL='0')
+    mc_ctl_path = str(SCRIPT_DIR.parent / 'mc_ctl.py')
+    print('{:<12} {:>10} {:>10} {:>8}  {}'.format('action', 'wall ms', 'import ms', 'modules', 'heaviest imports'))
+    cases = [ (a, [ mc_ctl_path, a, 'benchmark-world', 'list' ]) for a in actions.split(',') ]
+    cases.append(('(eager)', [ '-c', IMPORTTIME_EAGER ]))
+    for name, command in cases:
+        samples = []
+        for _ in range(int(runs)):
+            started = time.time()
+            proc = subprocess.run([ sys.executable, '-X', 'importtime' ] + command,
+                    env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=60)
+            samples.append((time.time() - started, _parse_importtime(proc.stderr.decode('utf-8', 'replace'))))
+        samples.sort(key=lambda s: s[0])
+        wall, imports = samples[len(samples) // 2]
+        top_level = sorted([ (cumulative, module) for module, (cumulative, level) in imports.items() if level == 0 ], reverse=True)
+        print('{:<12} {:10.1f} {:10.1f} {:8d}  {}'.format(name, wall * 1000,
+            sum(c for c, _ in top_level) / 1000,
+            len(imports),
+            ', '.join('{} {:.1f}'.format(m, c / 1000) for c, m in top_level[:4])))
+
+def _parse_importtime(stderr):
+    # "import time: self [us] | cumulative | imported package", nesting is indented by two spaces
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        level = (len(module) - len(module.lstrip(' ')) - 1) // 2
+        imports[module.strip()] = (int(cumulative), level)
+    return imports
+
+class _Harness:
+    # stand-ins: an HTTP server for the DigitalOcean API (and raw GitHub files), a paramiko SSH server
+    # per droplet that runs commands in a sandbox directory, and bare repositories instead of GitHub
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.api_bytes = 0
+        self.ssh_bytes = 0
+        self.droplets = collections.OrderedDict()
+        self.hosts = {}
+        self.ssh_keys = []
+        self.next_id = 1
+        self.host_key = paramiko.RSAKey.generate(2048)
+        # port probes make the server side log banner errors
+        logging.getLogger('paramiko').addHandler(logging.NullHandler())
+        self.bin_dir = root / 'bin'
+        self._write_stubs()
+
+        # every droplet gets its own loopback address, they all listen on the same port
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.ssh_port = sock.getsockname()[1]
+
+        self.api = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _FakeApiHandler)
+        self.api.harness = self
+        threading.Thread(target=self.api.serve_forever, daemon=True).start()
+        self._configure_mc_ctl()
+
+    def _write_stubs(self):
+        # tools of the droplet image called by the remote commands; the servers docker run starts are simulated by _FakeDroplet
+        self.bin_dir.mkdir()
+        for name, script in [ ('docker', DOCKER_STUB.format(sys.executable, PACK_HOST_MEMORY, PACK_CONTAINER_MEMORY // 1048576)), ('apt', '#!/bin/sh\nexit 0\n'), ('fuser', '#!/bin/sh\nexit 1\n') ]:
+            stub = self.bin_dir / name
+            stub.write_text(script)
+            stub.chmod(0o755)
+
+    def _configure_mc_ctl(self):
+        # every cache lives in the temporary root, so a run leaves the real ones of the user alone
+        api_url = 'http://127.0.0.1:{}'.format(self.api.server_port)
+        self.patchers = [ unittest.mock.patch.dict(os.environ, { 'DIGITALOCEAN_END_POINT': '{}/v2/'.format(api_url) }) ]
+        self.patchers[0].start()
+        cache = self.root / 'cache'
+        for name, value in [
+                ('DIGITALOCEAN_API_TOKEN', 'benchmark'),
+                ('GITHUB_USER', None),
+                ('GITHUB_TOKEN', None),
+                ('GITHUB_URL', (self.root / 'github').as_uri()),
+                ('GITHUB_RAW_URL', '{}/raw'.format(api_url)),
+                ('SCRIPT_DIR', self.root),
+                ('DROPLET_INDEX_PATH', cache / 'droplets.json'),
+                ('PACK_INDEX_PATH', cache / 'packs.json'),
+                ('LOG_OFFSETS_PATH', cache / 'log_offsets.json'),
+                ('AUTOSCALE_STATE_PATH', cache / 'autoscale.json'),
+                ('PREGEN_CHECKPOINT_PATH', cache / 'pregen.json'),
+                ('DAEMON_SOCKET_PATH', cache / 'mcctl.sock'),
+                ('TRACE_DIR', cache / 'traces'),
+                ('SSH_PORT', self.ssh_port),
+                ('_manager', None),
+                ('_ssh_keys', None) ]:
+            self.patch(name, value)
+        # generating the client key is not part of any operation
+        mc_ctl._get_ssh_keys()
+
+    def patch(self, name, value):
+        # set a global of mc_ctl until close
+        patcher = unittest.mock.patch.object(mc_ctl, name, value)
+        patcher.start()
+        self.patchers.append(patcher)
+
+    def close(self):
+        for droplet_id in list(self.hosts.keys()):
+            self.destroy_droplet(droplet_id, wait=True)
+        self.api.shutdown()
+        self.api.server_close()
+        # clients of the stand-ins must not be handed out after them
+        for ip_address, container in list(mc_ctl._rcon_clients.keys()):
+            mc_ctl._close_rcon_client(ip_address, { 'container': container })
+        mc_ctl._close_ssh_clients()
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+
+    def count(self, api_bytes=0, ssh_bytes=0):
+        with self.lock:
+            self.api_bytes += api_bytes
+            self.ssh_bytes += ssh_bytes
+
+    def measure(self, operation, world_name):
+        git_before = self._git_sizes()
+        api_before, ssh_before = self.api_bytes, self.ssh_bytes
+        output = io.StringIO()
+        started = time.time()
+        with contextlib.redirect_stdout(output):
+            if operation == 'create':
+                message = mc_ctl.create_server(world_name)
+            elif operation == 'do_commands':
+                message = mc_ctl.do_commands(world_name, [ 'cat /root/data/MCCTL_VERSION.txt', 'du -sh /root/data/world' ])
+            elif operation == 'backup':
+                message = mc_ctl.backup_world(world_name, backup_mode='cold')
+            elif operation == 'hot_backup':
+                message = mc_ctl.backup_world(world_name, backup_mode='hot')
+            elif operation == 'migrate':
+                message = mc_ctl.migrate_world(world_name, '4gb')
+            else:
+                message = mc_ctl.destroy_server(world_name)
+        seconds = time.time() - started
+        if mc_ctl._is_failure_message(message):
+            raise Exception('{} failed: {}\n{}'.format(operation, message, output.getvalue()))
+
+        # git bytes: growth of the object stores of both ends, i.e. what a clone or push transferred
+        git_after = self._git_sizes()
+        return {
+            'seconds': seconds,
+            'api_bytes': self.api_bytes - api_before,
+            'ssh_bytes': self.ssh_bytes - ssh_before,
+            'git_bytes': sum(max(0, size - git_before.get(path, 0)) for path, size in git_after.items())
+        }
+
+    def _git_sizes(self):
+        sizes = {}
+        for objects in list(self.root.glob('github/**/objects')) + list(self.root.glob('droplets/*/data/.git/objects')):
+            sizes[str(objects)] = sum(f.stat().st_size for f in objects.rglob('*') if f.is_file())
+        return sizes
+
+    def make_world(self, world_name, regions, history):
+        rand = random.Random(0)
+        work = self.root / 'work'
+        (work / 'world' / 'region').mkdir(parents=True)
+        (work / 'MCCTL_VERSION.txt').write_text(SUITE_VERSION)
+        (work / 'server.properties').write_text('rcon.port=25575\nrcon.password=benchmark\n')
+        (work / '.gitignore').write_text('/minecraft_server*.jar\n')
+        for i in range(regions):
+            _write_region(work / 'world' / 'region' / 'r.{}.{}.mca'.format(i % 8, i // 8))
+
+        _git(work, 'init', '-q')
+        for i in range(history):
+            if i > 0:
+                _play_regions(work / 'world' / 'region', rand)
+            _git(work, 'add', '--all')
+            _git(work, 'commit', '-q', '-m', 'world {} update {}'.format(SUITE_VERSION, i))
+        _git(self.root, 'clone', '-q', '--bare', str(work), str(self.root / 'pristine' / world_name))
+        shutil.rmtree(str(work))
+
+    def make_dated_world(self, world_name, times):
+        # a backup at each of times (oldest first) that rewrote a few chunks of one region, written by fast-import
+        rand = random.Random(0)
+        repository = self.root / 'pristine' / world_name
+        _git(self.root, 'init', '-q', '--bare', str(repository))
+        regions = [ bytearray(rand.getrandbits(8) for _ in range(8192 + REGION_CHUNKS * 4096)) for _ in range(COMPACT_REGIONS) ]
+        proc = subprocess.Popen([ 'git', 'fast-import', '--quiet' ], cwd=str(repository), stdin=subprocess.PIPE)
+        files = { 'MCCTL_VERSION.txt': SUITE_VERSION.encode(), 'server.properties': b'rcon.port=25575\nrcon.password=benchmark\n', '.gitignore': b'/minecraft_server*.jar\n' }
+        for i, t in enumerate(times):
+            if i == 0:
+                changed = list(range(COMPACT_REGIONS))
+            else:
+                changed = [ rand.randrange(COMPACT_REGIONS) ]
+                for _ in range(4):
+                    offset = 8192 + rand.randrange(REGION_CHUNKS) * 4096
+                    regions[changed[0]][offset:offset + 4096] = rand.getrandbits(8 * 4096).to_bytes(4096, 'little')
+            for r in changed:
+                files['world/region/r.{}.0.mca'.format(r)] = bytes(regions[r])
+            message = 'world {} update {}'.format(SUITE_VERSION, i).encode()
+            stream = [ b'commit refs/heads/master\n', 'committer mc_ctl <mc_ctl@localhost> {} +0900\n'.format(t).encode(), b'data %d\n%s\n' % (len(message), message) ]
+            for path in (files.keys() if i == 0 else [ 'world/region/r.{}.0.mca'.format(r) for r in changed ]):
+                stream.append(b'M 100644 inline %s\ndata %d\n%s\n' % (path.encode(), len(files[path]), files[path]))
+            proc.stdin.write(b''.join(stream))
+        proc.stdin.close()
+        if proc.wait() != 0:
+            raise Exception('fast-import failed')
+
+    def reset_world(self, world_name):
+        repository = self.root / 'github' / world_name
+        if repository.exists():
+            shutil.rmtree(str(repository))
+        shutil.copytree(str(self.root / 'pristine' / world_name), str(repository))
+
+    def play(self, world_name):
+        for droplet_id, droplet in list(self.droplets.items()):
+            if droplet['name'] == 'minecraft-{}'.format(world_name):
+                _play_regions(self.hosts[droplet_id].sandbox / 'data' / 'world' / 'region', random.Random(droplet_id))
+
+    def api_call(self, method, parts, query, request):
+        if parts[0] == 'raw':
+            # raw.githubusercontent.com/<user>/<repository>/<branch>/<path>
+            branch = parts.index('master')
+            repository = self.root / 'github' / '/'.join(parts[1:branch])
+            proc = subprocess.run([ 'git', '--git-dir', str(repository), 'show', 'master:{}'.format('/'.join(parts[branch + 1:])) ],
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            if proc.returncode != 0:
+                raise KeyError(parts)
+            return 200, proc.stdout
+
+        resource = parts[1:]
+        if resource == [ 'droplets' ] and method == 'GET':
+            droplets = [ d for d in self.droplets.values() if 'tag_name' not in query or query['tag_name'][0] in d['tags'] ]
+            return 200, { 'droplets': droplets, 'links': {}, 'meta': { 'total': len(droplets) } }
+        elif resource == [ 'droplets' ] and method == 'POST':
+            droplet = self.create_droplet(request)
+            return 202, { 'droplet': droplet, 'links': { 'actions': [ { 'id': droplet['id'], 'rel': 'create' } ] } }
+        elif resource[0] == 'droplets' and method == 'GET':
+            return 200, { 'droplet': self.droplets[int(resource[1])] }
+        elif resource[0] == 'droplets' and method == 'DELETE':
+            self.destroy_droplet(int(resource[1]))
+            return 204, None
+        elif resource[0] == 'droplets' and resource[2:] == [ 'actions' ] and method == 'POST':
+            droplet = self.droplets[int(resource[1])]
+            # power actions have nothing to change, the droplet keeps serving
+            if request['type'] == 'rename':
+                droplet['name'] = request['name']
+            elif request['type'] == 'resize':
+                droplet['size_slug'] = request['size']
+            return 201, { 'action': { 'id': int(resource[1]), 'status': 'completed', 'type': request['type'] } }
+        elif resource[0] == 'actions':
+            # droplets boot instantly, the benchmark measures mc_ctl rather than DigitalOcean
+            return 200, { 'action': { 'id': int(resource[1]), 'status': 'completed', 'type': 'create' } }
+        elif resource == [ 'account', 'keys' ] and method == 'GET':
+            return 200, { 'ssh_keys': self.ssh_keys, 'links': {}, 'meta': { 'total': len(self.ssh_keys) } }
+        elif resource == [ 'account', 'keys' ] and method == 'POST':
+            key = { 'id': len(self.ssh_keys) + 1, 'name': request['name'], 'public_key': request['public_key'], 'fingerprint': '' }
+            self.ssh_keys.append(key)
+            return 201, { 'ssh_key': key }
+        elif resource == [ 'tags' ]:
+            return 201, { 'tag': { 'name': request['name'], 'resources': {} } }
+        elif resource[0] == 'tags':
+            return 204, None
+        elif resource == [ 'snapshots' ]:
+            return 200, { 'snapshots': [], 'links': {}, 'meta': { 'total': 0 } }
+        raise KeyError(parts)
+
+    def create_droplet(self, request):
+        with self.lock:
+            droplet_id = self.next_id
+            self.next_id += 1
+        ip_address = '127.0.0.{}'.format(droplet_id % 250 + 2)
+        sandbox = self.root / 'droplets' / str(droplet_id)
+        sandbox.mkdir(parents=True)
+        host = _FakeDroplet(self, ip_address, sandbox)
+        droplet = {
+            'id': droplet_id,
+            'name': request['name'],
+            'status': 'active',
+            'size_slug': request['size'],
+            'tags': request.get('tags') or [],
+            'networks': { 'v4': [ { 'ip_address': ip_address, 'type': 'public' } ], 'v6': [] }
+        }
+        with self.lock:
+            self.droplets[droplet_id] = droplet
+            self.hosts[droplet_id] = host
+        return droplet
+
+    def destroy_droplet(self, droplet_id, wait=False):
+        with self.lock:
+            del self.droplets[droplet_id]
+            host = self.hosts.pop(droplet_id)
+
+        def teardown():
+            host.close()
+            shutil.rmtree(str(host.sandbox), ignore_errors=True)
+        # like the API, answer before the droplet is actually gone
+        thread = threading.Thread(target=teardown, daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+
+class _FakeApiHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        harness = self.server.harness
+        time.sleep(FAKE_API_RTT)
+        url = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length > 0 else b''
+        request = json.loads(body.decode('utf-8')) if len(body) > 0 else {}
+        try:
+            status, response = harness.api_call(method, [ p for p in url.path.split('/') if p != '' ], urllib.parse.parse_qs(url.query), request)
+        except (KeyError, IndexError, ValueError):
+            status, response = 404, { 'id': 'not_found', 'message': 'The resource you requested could not be found.' }
+        if response is None:
+            data = b''
+        elif isinstance(response, bytes):
+            data = response
+        else:
+            data = json.dumps(response).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        # headers of the response are about as long as those of the request
+        harness.count(api_bytes=2 * (len(self.requestline) + len(str(self.headers))) + len(body) + len(data))
+
+class _FakeDroplet(paramiko.ServerInterface):
+    # accepts any key; /root/ in commands is the sandbox directory and docker, apt and fuser are stubs
+    def __init__(self, harness, ip_address, sandbox):
+        self.harness = harness
+        self.ip_address = ip_address
+        self.sandbox = sandbox
+        self.transports = []
+        self.minecraft = {}
+        self.rcon = None
+        self.tunnels = set()
+        self.env = dict(os.environ, PATH='{}:{}'.format(harness.bin_dir, os.environ.get('PATH', '')), HOME=str(sandbox))
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((ip_address, harness.ssh_port))
+        self.sock.listen(16)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.sock.close()
+        for transport in self.transports:
+            transport.close()
+        for minecraft in self.minecraft.values():
+            minecraft.close()
+        if self.rcon is not None:
+            self.rcon.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        # port probes connect and close without negotiating
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self.harness.host_key)
+        try:
+            transport.start_server(server=self)
+        except (EOFError, paramiko.SSHException):
+            return
+        self.transports.append(transport)
+
+        # sessions are served by check_channel_exec_request, only tunnels need the accepted channel
+        while transport.is_active():
+            chan = transport.accept(timeout=1)
+            if chan is not None and chan.get_id() in self.tunnels:
+                threading.Thread(target=self._relay, args=(chan,), daemon=True).start()
+
+    def _relay(self, chan):
+        # every tunnel ends at the RCON server of the simulated container, whatever its destination
+        if self.rcon is None:
+            chan.close()
+            return
+        sock = socket.create_connection(self.rcon.address)
+        def upstream():
+            try:
+                while True:
+                    data = chan.recv(65536)
+                    if len(data) == 0:
+                        break
+                    sock.sendall(data)
+                sock.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+        threading.Thread(target=upstream, daemon=True).start()
+        try:
+            while True:
+                data = sock.recv(65536)
+                if len(data) == 0:
+                    break
+                chan.sendall(data)
+        except OSError:
+            pass
+        sock.close()
+        chan.close()
+
+    def _feed(self, channel, proc):
+        # like sshd, what the client sends is the standard input of the command until it sends EOF
+        try:
+            while True:
+                data = channel.recv(65536)
+                if len(data) == 0:
+                    break
+                proc.stdin.write(data)
+            proc.stdin.close()
+        except OSError:
+            pass
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        self.tunnels.add(chanid)
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self._exec, args=(channel, command.decode('utf-8')), daemon=True).start()
+        return True
+
+    def _exec(self, channel, command):
+        # paths of another sandbox come from commands one droplet runs on another, ex: the source of a migration
+        command = command.replace('/root/', '{}/'.format(self.sandbox))
+        command = re.sub(re.escape(str(self.harness.root / 'droplets')) + r'/\d+/', '{}/'.format(self.sandbox), command)
+        proc = subprocess.Popen([ 'bash', '-c', command ], cwd=str(self.sandbox), env=self.env,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        threading.Thread(target=self._feed, args=(channel, proc), daemon=True).start()
+        while True:
+            data = proc.stdout.read1(32768)
+            if len(data) == 0:
+                break
+            channel.sendall(data)
+            self.harness.count(ssh_bytes=len(data))
+        status = proc.wait()
+
+        started = re.search(r'docker run -d -v (\S+):/data .*-e VERSION=(\S+) .* -p ([0-9]+):', command)
+        if status == 0 and started is not None and int(started.group(3)) not in self.minecraft:
+            # the image downloads the server jar into /data and starts answering pings; every container shares one RCON server
+            data_dir, version, port = pathlib.Path(started.group(1)), started.group(2), int(started.group(3))
+            data_dir.mkdir(parents=True, exist_ok=True)
+            (data_dir / 'minecraft_server.{}.jar'.format(version)).write_bytes(b'')
+            self.minecraft[port] = _FakeMinecraftServer(self.ip_address, version, port)
+            if self.rcon is None:
+                self.rcon = _FakeRconServer('benchmark', 0, 0.001)
+        channel.send_exit_status(status)
+        channel.close()
+
+class _FakeMinecraftServer:
+    # answers Server List Ping like a started server
+    def __init__(self, ip_address, version, port):
+        self.status = json.dumps({
+            'version': { 'name': version, 'protocol': 754 },
+            'players': { 'max': 20, 'online': 0 },
+            'description': { 'text': 'mc_ctl benchmark' }
+        }).encode('utf-8')
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((ip_address, port))
+        self.sock.listen(16)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.sock.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            try:
+                f = conn.makefile('rb')
+                _read_packet(f) # handshake
+                _read_packet(f) # status request
+                conn.sendall(_packet(b'\x00' + _varint(len(self.status)) + self.status))
+                conn.sendall(_packet(_read_packet(f))) # pong echoes the ping
+            except (EOFError, OSError):
+                pass
+
+def _varint(n):
+    out = b''
+    while True:
+        if n >> 7:
+            out += bytes([ (n & 0x7f) | 0x80 ])
+            n >>= 7
+        else:
+            return out + bytes([ n ])
+
+def _packet(body):
+    return _varint(len(body)) + body
+
+def _read_packet(f):
+    length = 0
+    for i in range(5):
+        b = f.read(1)
+        if len(b) == 0:
+            raise EOFError()
+        length |= (b[0] & 0x7f) << (7 * i)
+        if not b[0] & 0x80:
+            break
+    return f.read(length)
+
+def _write_region(path):
+    # location table, timestamp table, then every chunk in its own two sectors
+    sectors = (5 + CHUNK_BYTES + 4095) // 4096
+    locations = b''.join(struct.pack('>I', (2 + i * sectors) << 8 | sectors) for i in range(REGION_CHUNKS))
+    with path.open('wb') as f:
+        f.write(locations.ljust(4096, b'\0') + b'\0' * 4096)
+        for _ in range(REGION_CHUNKS):
+            f.write((struct.pack('>IB', CHUNK_BYTES + 1, 2) + os.urandom(CHUNK_BYTES)).ljust(sectors * 4096, b'\0'))
+
+def _play_regions(region_dir, rand):
+    # rewrite a few chunks in a quarter of the regions, like players walking around
+    regions = sorted(region_dir.glob('*.mca'))
+    sectors = (5 + CHUNK_BYTES + 4095) // 4096
+    for path in rand.sample(regions, max(1, len(regions) // 4)):
+        with path.open('r+b') as f:
+            for chunk in rand.sample(range(REGION_CHUNKS), 4):
+                f.seek((2 + chunk * sectors) * 4096 + 5)
+                f.write(os.urandom(CHUNK_BYTES))
+
+def _git_output(cwd, *args):
+    return subprocess.run([ 'git' ] + list(args), cwd=str(cwd), check=True, stdout=subprocess.PIPE).stdout.decode().strip()
+
+def _git(cwd, *args):
+    subprocess.run([ 'git', '-c', 'init.defaultBranch=master', '-c', 'user.name=mc_ctl', '-c', 'user.email=mc_ctl@localhost' ] + list(args),
+            cwd=str(cwd), check=True, stdout=subprocess.DEVNULL)
+
+def _report(name, count, func):
+    started = time.time()
+    func()
+    elapsed = time.time() - started
+    print('  {:<24} {:8.2f}s {:10.1f} commands/s'.format(name, elapsed, count / elapsed))
+
+class _FakeRconServer:
+    # answers every command after a simulated round trip; commands run one by one like on the server thread
+    def __init__(self, password, rtt, exec_time):
+        self.password = password
+        self.rtt = rtt
+        self.exec_time = exec_time
+        self.log = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(16)
+        self.address = self.sock.getsockname()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.sock.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        outbox = collections.deque()
+        ready = threading.Condition()
+        threading.Thread(target=self._deliver, args=(conn, outbox, ready), daemon=True).start()
+
+        buffer = b''
+        busy_until = 0
+        while True:
+            data = conn.recv(65536)
+            if len(data) == 0:
+                break
+            buffer += data
+            while len(buffer) >= 4 and len(buffer) >= 4 + struct.unpack('<i', buffer[:4])[0]:
+                length = struct.unpack('<i', buffer[:4])[0]
+                request_id, packet_type = struct.unpack('<ii', buffer[4:12])
+                body = buffer[12:4 + length - 2].decode('utf-8')
+                buffer = buffer[4 + length:]
+
+                arrived = time.time() + self.rtt / 2
+                busy_until = max(busy_until, arrived) + self.exec_time
+                if packet_type == mc_ctl._RconClient.SERVERDATA_AUTH:
+                    response = (request_id if body == self.password else -1, mc_ctl._RconClient.SERVERDATA_AUTH_RESPONSE, '')
+                elif packet_type != mc_ctl._RconClient.SERVERDATA_EXECCOMMAND:
+                    # like vanilla servers
+                    response = (request_id, 0, 'Unknown request {:x}'.format(packet_type))
+                elif body.startswith('repeat '):
+                    # repeat <count> <text>: a long response, ex: text with multibyte formatting codes
+                    _, count, text = body.split(' ', 2)
+                    response = (request_id, 0, text * int(count))
+                else:
+                    self.log.append(body)
+                    response = (request_id, 0, 'ok: {}'.format(body))
+                with ready:
+                    outbox.append((busy_until + self.rtt / 2, response))
+                    ready.notify()
+        with ready:
+            outbox.append((0, None))
+            ready.notify()
+
+    def _deliver(self, conn, outbox, ready):
+        while True:
+            with ready:
+                while len(outbox) == 0:
+                    ready.wait()
+                deliver_at, response = outbox.popleft()
+            if response is None:
+                conn.close()
+                return
+            time.sleep(max(0, deliver_at - time.time()))
+            # split into packets of up to 4096 bytes like vanilla servers, even inside a character
+            body = response[2].encode('utf-8')
+            for offset in range(0, max(1, len(body)), RCON_FRAGMENT_BYTES):
+                payload = struct.pack('<ii', response[0], response[1]) + body[offset:offset + RCON_FRAGMENT_BYTES] + b'\0\0'
+                conn.sendall(struct.pack('<i', len(payload)) + payload)
+
+if __name__ == '__main__':
+    sys.exit(bench_handler(sys.argv))
@@ -1,5 +1,9 @@
 import os
 import sys
+import socket
+import struct
+import threading
+import collections
 import urllib.request
 import pathlib
 import re
@@ -7,6 +11,7 @@ import shutil
 import traceback
 import stat
 import datetime
+import time
 
 # furl
 from furl import furl
@@ -18,8 +23,6 @@ import digitalocean
 import paramiko
 # cryptodomex
 from Cryptodome.PublicKey import RSA
-# retry
-from retry import retry
 # emoji
 import emoji
 
@@ -35,11 +38,37 @@ GITHUB_URL = 'https://github.com'
 GITHUB_RAW_URL = 'https://raw.githubusercontent.com'
 SCRIPT_DIR = pathlib.Path(__file__).parent.resolve()
 MINECRAFT_PORT = 25565
+RCON_PORT = 25575
+# RCON requests sent before waiting for responses; vanilla servers drop the connection
+# when several packets arrive in one read, so only raise it for servers that handle that
+RCON_PIPELINE_WINDOW = int(os.getenv('MCCTL_RCON_PIPELINE_WINDOW', '1'))
+# seconds an rcon response may take before the connection is given up; save-all flush of a large world is the slowest
+RCON_TIMEOUT = int(os.getenv('MCCTL_RCON_TIMEOUT', '120'))
+# shallow: tip commit only / blobless: all commits, tip blobs only / full: whole history
+RESTORE_MODE = os.getenv('MCCTL_RESTORE_MODE', 'shallow')
+RESTORE_CLONE_OPTIONS = {
+    'shallow': { 'depth': 1, 'single_branch': True, 'no_tags': True },
+    'blobless': { 'filter': 'blob:none', 'single_branch': True, 'no_tags': True },
+    'full': {}
+}
+# files kept beside the world for incremental backups (.mcctl_index.json, ...)
+BACKUP_IGNORE = '/.mcctl_*'
+PERFORMANCE_PROFILE = os.getenv('MCCTL_PERFORMANCE_PROFILE', 'balanced')
+# heap: share of the memory docker sees that goes to the JVM heap, cpus: share of the vCPUs the container may use,
+# distances: (base, per vCPU, cap); vanilla keeps the defaults of the image
+PERFORMANCE_PROFILES = {
+    'vanilla': None,
+    'lean': { 'heap': 0.5, 'gc': 'serial', 'cpus': 0.75, 'view_distance': (6, 1, 8), 'simulation_distance': (4, 1, 6) },
+    'balanced': { 'heap': 0.6, 'gc': 'aikar', 'cpus': 1.0, 'view_distance': (6, 2, 12), 'simulation_distance': (4, 1, 8) },
+    'performance': { 'heap': 0.7, 'gc': 'aikar', 'cpus': 1.0, 'view_distance': (8, 2, 16), 'simulation_distance': (6, 2, 12) }
+}
 USAGE = '''
-Usage: {0} [create|backup|destroy|destroy_without_backup|help] [target]
+Usage: {0} [create|backup|destroy|destroy_without_backup|regions|help] [target]
     create: Create and serve minecraft server
-        {0} create [world_repository] [version|LATEST|SNAPSHOT]
+        {0} create [world_repository] [version|LATEST|SNAPSHOT] [vanilla|lean|balanced|performance]
         ex: {0} create hungcat/minecraft_world 1.14.4
+        ex: {0} create hungcat/minecraft_world LATEST lean
+        The performance profile is sized to what the local docker has and recorded in MCCTL_PROFILE.txt.
     backup: Back up current world to corresponding github repository
         {0} backup [world_repository]
         ex: {0} backup hungcat/minecraft_world
@@ -49,6 +78,10 @@ Usage: {0} [create|backup|destroy|destroy_without_backup|help] [target]
     destroy_without_backup: Destroy current world without backup
         {0} destroy_without_backup [world_repository]
         ex: {0} destroy_without_backup hungcat/minecraft_world
+    regions: Report chunk counts, sizes and InhabitedTime of region files, or prune chunks players spent less time in
+        {0} regions [report|prune] [min_inhabited_seconds]
+        ex: {0} regions prune 30
+        prune stops the server while it rewrites regions; pruned chunks are generated again when visited.
     help: Show this
         {0} help
 
@@ -58,6 +91,8 @@ Required environment variables:
     GITHUB_TOKEN (for backup)
         Personal access token of github for backup the world.
         ref: https://help.github.com/ja/github/authenticating-to-github/creating-a-personal-access-token-for-the-command-line
+    MCCTL_PERFORMANCE_PROFILE (optional)
+        Profile of worlds which have none recorded: vanilla, lean, balanced or performance. (default: balanced)
 '''.format(__file__).strip()
 
 
@@ -80,7 +115,7 @@ def command_handler(args):
     try:
         if action == 'create':
             print(_emoji(':muscle: Creating server...'))
-            print(create_server(world_name, version))
+            print(create_server(world_name, version, args[4] if argc > 4 else ''))
         elif action == 'backup':
             print(_emoji(':muscle: Backuping world data...'))
             print(backup_world(world_name))
@@ -101,6 +136,9 @@ def command_handler(args):
             print(restart())
         elif action == 'rcon':
             print(rcon(world_name))
+        elif action == 'regions':
+            print(_emoji(':muscle: Analyzing regions...'))
+            print(analyze_regions(world_name if world_name != '' else 'report', version if version != '' else '60'))
         else:
             print('Invalid action: {}'.format(action))
             print(USAGE)
@@ -118,10 +156,18 @@ def restart():
     return _emoji(':information: Server restarted.')
 
 def rcon(cmd):
-    status, out = docker.from_env().containers.get('minecraft').exec_run('rcon-cli {}'.format(cmd))
-    return out.decode('utf-8')
-
-def create_server(world_name='', version=''):
+    properties = (SCRIPT_DIR / 'data' / 'server.properties').read_text().splitlines()
+    settings = dict(line.split('=', 1) for line in properties if line.startswith('rcon.'))
+    rcon_client = _RconClient(socket.create_connection(('127.0.0.1', RCON_PORT)), settings.get('rcon.password', ''))
+    try:
+        responses = rcon_client.commands([ c for c in cmd.splitlines() if c.strip() != '' ])
+    finally:
+        rcon_client.close()
+    return '\n'.join(responses)
+
+def create_server(world_name='', version='', profile=''):
+    if profile != '' and profile not in PERFORMANCE_PROFILES:
+        return _emoji(':no_good: Unknown performance profile: {}'.format(profile))
     data_dir = SCRIPT_DIR / 'data'
     backup_url = _construct_github_url(world_name)
     version_url = _construct_github_url(world_name, path='master/MCCTL_VERSION.txt', is_raw=True)
@@ -129,7 +175,12 @@ def create_server(world_name='', version=''):
     data_dir.mkdir(parents=True, exist_ok=True)
 
     if _test_github_url(backup_url) == True:
-        git.Repo.clone_from(backup_url, data_dir)
+        # a shallow checkout can still push later backups since they only add commits on top of its tip
+        started = time.time()
+        git.Repo.clone_from(backup_url, data_dir, **RESTORE_CLONE_OPTIONS[RESTORE_MODE])
+        elapsed = max(time.time() - started, 0.001)
+        size = sum(f.stat().st_size for f in data_dir.rglob('*') if f.is_file()) / 1048576
+        print(_emoji(':information: Restored {} clone: {:.1f} MiB in {:.1f}s ({:.1f} MiB/s)'.format(RESTORE_MODE, size, elapsed, size / elapsed)))
 
         v = ''
         try:
@@ -146,18 +197,31 @@ def create_server(world_name='', version=''):
     if version == '':
         version = 'LATEST'
 
+    # the profile is recorded beside MCCTL_VERSION.txt, so a restore comes back with the same tuning
+    if profile == '':
+        profile_path = data_dir / 'MCCTL_PROFILE.txt'
+        last_profile = profile_path.read_text().strip() if profile_path.exists() else ''
+        profile = last_profile if last_profile in PERFORMANCE_PROFILES else PERFORMANCE_PROFILE
+    (data_dir / 'MCCTL_PROFILE.txt').write_text(profile)
+    client = docker.from_env()
+    info = client.info()
+    env, limits = _performance_settings(profile, info['NCPU'], info['MemTotal'])
+    if len(limits) > 0:
+        limits = { 'mem_limit': limits['memory'], 'nano_cpus': int(float(limits['cpus']) * 1e9) }
+
     try:
-        docker.from_env().containers.run('itzg/minecraft-server',
+        client.containers.run('itzg/minecraft-server',
                 detach=True,
-                environment={ 'EULA': 'TRUE', 'VERSION': version, 'WORLD': '/data/world', 'TZ': 'Asia/Tokyo' },
+                environment=dict({ 'EULA': 'TRUE', 'VERSION': version, 'WORLD': '/data/world', 'TZ': 'Asia/Tokyo' }, **env),
                 volumes={ re.sub(r'^([a-zA-Z]):/', lambda m: '/{}/'.format(m.group(1).lower()), data_dir.resolve().as_posix()): { 'bind': '/data', 'mode': 'rw' } },
                 name='minecraft',
-                ports={ '{}/tcp'.format(MINECRAFT_PORT): MINECRAFT_PORT },
-                restart_policy={ "Name": "always" })
+                ports={ '{}/tcp'.format(MINECRAFT_PORT): MINECRAFT_PORT, '{}/tcp'.format(RCON_PORT): ('127.0.0.1', RCON_PORT) },
+                restart_policy={ "Name": "always" },
+                **limits)
         # host port is left hand (corresponding to below message)
 
         print(_emoji(':muscle: Minecraft is waking up!'))
-        message = _emoji(':hammer_and_pick: Created minecraft {} instance: `{}`'.format(version, get_ip()))
+        message = _emoji(':hammer_and_pick: Created minecraft {} instance ({}): `{}`'.format(version, profile, get_ip()))
     except Exception as e:
         print(_emoji(':cry: Minecraft couldn\'t wake up. Please destroy this server yourself IF it waked up...'))
         #message = _emoji(':cry: Failed to create server...')
@@ -166,6 +230,34 @@ def create_server(world_name='', version=''):
     return message
 
 
+def _performance_settings(profile, cpus, memory_bytes):
+    # environment of the image and limits of the container on a host with cpus and memory_bytes
+    if profile not in PERFORMANCE_PROFILES:
+        raise Exception('Unknown performance profile: {}'.format(profile))
+    tuning = PERFORMANCE_PROFILES[profile]
+    env = collections.OrderedDict()
+    limits = collections.OrderedDict()
+    if tuning is None:
+        return env, limits
+
+    memory_mb = memory_bytes // 1048576
+    heap_mb = max(512, int(memory_mb * tuning['heap']) // 256 * 256)
+    env['MEMORY'] = '{}M'.format(heap_mb)
+    # Aikar's flags expect the whole heap committed up front; a lean server grows into it
+    if tuning['gc'] == 'aikar':
+        env['INIT_MEMORY'] = '{}M'.format(heap_mb)
+        env['USE_AIKAR_FLAGS'] = 'true'
+    else:
+        env['INIT_MEMORY'] = '{}M'.format(max(256, heap_mb // 2))
+        env['JVM_XX_OPTS'] = '-XX:+UseSerialGC'
+    for name in [ 'view_distance', 'simulation_distance' ]:
+        base, per_cpu, cap = tuning[name]
+        env[name.upper()] = str(min(cap, base + per_cpu * cpus))
+    # besides the heap the JVM needs metaspace, thread stacks and direct buffers; the rest stays with the OS
+    limits['memory'] = '{}m'.format(max(heap_mb + 256, min(memory_mb - 256, heap_mb * 5 // 4 + 256)))
+    limits['cpus'] = '{:g}'.format(max(1, cpus * tuning['cpus']))
+    return env, limits
+
 def backup_world(world_name=''):
     backup_url = _construct_github_url(world_name)
     output_url = '{}/{}'.format(GITHUB_URL, world_name)
@@ -198,7 +290,10 @@ def backup_world(world_name=''):
 
     gitignore = repo_path / '.gitignore'
     if not gitignore.exists():
-        gitignore.write_text('/minecraft_server*.jar')
+        gitignore.write_text('/minecraft_server*.jar\n')
+    if BACKUP_IGNORE not in gitignore.read_text().splitlines():
+        with gitignore.open('a') as f:
+            f.write('\n{}\n'.format(BACKUP_IGNORE))
 
     jars = list(repo_path.glob('*.jar'))
     version = ''
@@ -206,8 +301,15 @@ def backup_world(world_name=''):
         version = re.sub(r'^[^.]*\.([0-9.]*)\.jar$', r'\1', jars[0].name)
         (repo_path / 'MCCTL_VERSION.txt').write_text(version)
 
-    repo.git.add('--all')
+    # only world files whose content changed since the last backup are staged
+    changes = _scan_world_changes(str(repo_path))
+    for i in range(0, len(changes['changed']), 1000):
+        repo.git.add('--', *changes['changed'][i:i + 1000])
+    for i in range(0, len(changes['deleted']), 1000):
+        repo.git.rm('-q', '--cached', '--ignore-unmatch', '--', *changes['deleted'][i:i + 1000])
+    repo.git.add('--all', '--', '.', ':(exclude)world*')
     repo.index.commit('world {} update [{}]'.format(version, datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9))).strftime('%Y/%m/%d %H:%M:%S%z')))
+    os.replace(str(repo_path / '.mcctl_index.json.new'), str(repo_path / '.mcctl_index.json'))
     origin.push('master')
 
     return _emoji(':rocket: Backuped world: {}'.format(output_url))
@@ -228,6 +330,298 @@ def destroy_server(world_name=''):
 
     return _emoji(':boom: Destroyed instance: `minecraft`')
 
+def analyze_regions(mode='report', min_inhabited_seconds='60'):
+    if mode not in [ 'report', 'prune' ]:
+        return _emoji(':no_good: Unknown regions mode: {}'.format(mode))
+    container = docker.from_env().containers.get('minecraft')
+    if mode == 'prune':
+        # the server must not write regions while they are rewritten; it saves them when it stops
+        container.stop()
+    try:
+        # InhabitedTime counts ticks, 20 a second
+        _analyze_regions(str(SCRIPT_DIR / 'data'), mode, int(float(min_inhabited_seconds) * 20))
+    finally:
+        if mode == 'prune':
+            container.start()
+
+    if mode == 'prune':
+        return _emoji(':scissors: Pruned regions, the next backup commits them')
+    return _emoji(':mag: Analyzed regions')
+
+def _analyze_regions(data_dir, mode='report', min_inhabited=0, region_path=None):
+    # called with region_path, it is the worker analyzing (and pruning) one region file in a process of the pool
+    import os
+    import time
+    import zlib
+    import struct
+    import functools
+    import concurrent.futures
+
+    if region_path is not None:
+        # the tag of InhabitedTime (TAG_Long, name length 13), found in the decompressed chunk without parsing the NBT
+        pattern = b'\x04\x00\x0dInhabitedTime'
+
+        def inhabited_time(compression, payload):
+            if compression == 3:
+                found = payload.find(pattern)
+                return struct.unpack('>q', payload[found + len(pattern):found + len(pattern) + 8])[0] if found >= 0 else None
+            if compression not in [ 1, 2 ]:
+                return None
+            # decompressed only as far as the tag, which is near the start of most chunks
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16 if compression == 1 else zlib.MAX_WBITS)
+            data = b''
+            while True:
+                data += decompressor.decompress(payload, 16384)
+                payload = decompressor.unconsumed_tail
+                found = data.find(pattern)
+                if found >= 0 and len(data) >= found + len(pattern) + 8:
+                    return struct.unpack('>q', data[found + len(pattern):found + len(pattern) + 8])[0]
+                if len(payload) == 0:
+                    return None
+
+        def drop_chunks(path, dropped):
+            # rewrites the region with the kept chunks packed from sector 2, or removes it when none is kept
+            with open(path, 'rb') as f:
+                data = f.read()
+            if len(data) < 8192:
+                return 0
+            locations = list(struct.unpack('>1024I', data[:4096]))
+            timestamps = list(struct.unpack('>1024I', data[4096:8192]))
+            sectors = []
+            next_sector = 2
+            for i in range(1024):
+                offset, count = locations[i] >> 8, locations[i] & 0xff
+                if i in dropped or offset < 2 or count == 0:
+                    locations[i] = timestamps[i] = 0
+                    continue
+                sectors.append(data[offset * 4096:(offset + count) * 4096].ljust(count * 4096, b'\0'))
+                locations[i] = next_sector << 8 | count
+                next_sector += count
+            if len(sectors) == 0:
+                os.remove(path)
+                return len(data)
+            tmp_path = path + '.mcctl_tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(struct.pack('>1024I', *locations) + struct.pack('>1024I', *timestamps) + b''.join(sectors))
+            os.replace(tmp_path, path)
+            return len(data) - next_sector * 4096
+
+        stats = { 'path': os.path.relpath(region_path, data_dir), 'bytes': os.path.getsize(region_path), 'chunks': 0, 'inhabited': 0, 'max_inhabited': 0, 'unknown': 0, 'prunable': [], 'freed': 0, 'removed': 0 }
+        with open(region_path, 'rb') as f:
+            data = f.read()
+        if len(data) < 8192:
+            return stats
+        # all 1024 locations in one call: offset in 4 KiB sectors << 8 | sector count
+        for i, location in enumerate(struct.unpack('>1024I', data[:4096])):
+            offset = location >> 8
+            if offset < 2 or location & 0xff == 0:
+                continue
+            stats['chunks'] += 1
+            try:
+                length, compression = struct.unpack('>IB', data[offset * 4096:offset * 4096 + 5])
+                inhabited = inhabited_time(compression, data[offset * 4096 + 5:offset * 4096 + 4 + length])
+            except (struct.error, zlib.error):
+                # ex: a chunk the running server is rewriting right now
+                inhabited = None
+            if inhabited is None:
+                stats['unknown'] += 1
+                continue
+            stats['inhabited'] += inhabited
+            stats['max_inhabited'] = max(stats['max_inhabited'], inhabited)
+            if inhabited < min_inhabited:
+                stats['prunable'].append(i)
+
+        if mode == 'prune' and len(stats['prunable']) > 0:
+            dropped = set(stats['prunable'])
+            stats['freed'] = drop_chunks(region_path, dropped)
+            # entities and poi of 1.14+ are region files of the same name in sibling directories
+            for sibling in [ 'entities', 'poi' ]:
+                path = os.path.join(os.path.dirname(os.path.dirname(region_path)), sibling, os.path.basename(region_path))
+                if os.path.exists(path):
+                    stats['freed'] += drop_chunks(path, dropped)
+        stats['prunable'] = len(stats['prunable'])
+        stats['removed'] = int(not os.path.exists(region_path))
+        return stats
+
+    started = time.time()
+    region_paths = []
+    for world_dir in sorted(e.path for e in os.scandir(data_dir) if e.is_dir() and e.name.startswith('world')):
+        for root, dirs, files in os.walk(world_dir):
+            if os.path.basename(root) == 'region':
+                region_paths.extend(os.path.join(root, name) for name in files if name.endswith('.mca'))
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        results = list(executor.map(functools.partial(_analyze_regions, data_dir, mode, min_inhabited), region_paths, chunksize=16))
+    elapsed = max(time.time() - started, 0.001)
+
+    with open(os.path.join(data_dir, '.mcctl_regions.tsv'), 'w') as f:
+        f.write('path\tbytes\tchunks\tinhabited_ticks\tmax_inhabited_ticks\tunknown\tprunable\tfreed\n')
+        for r in results:
+            f.write('{path}\t{bytes}\t{chunks}\t{inhabited}\t{max_inhabited}\t{unknown}\t{prunable}\t{freed}\n'.format(**r))
+    print('{:<40} {:>9} {:>7} {:>11} {:>9}'.format('largest regions', 'MiB', 'chunks', 'inhabited h', 'prunable'))
+    for r in sorted(results, key=lambda r: -r['bytes'])[:10]:
+        print('{:<40} {:9.2f} {:7d} {:11.2f} {:9d}'.format(r['path'], r['bytes'] / 1048576, r['chunks'], r['inhabited'] / 72000, r['prunable']))
+
+    chunks = sum(r['chunks'] for r in results)
+    print('Scanned {} region files, {} chunks ({} unreadable), {:.1f} MiB in {:.1f}s ({:.0f} regions/s, {:.0f} chunks/s)'.format(
+        len(results), chunks, sum(r['unknown'] for r in results), sum(r['bytes'] for r in results) / 1048576, elapsed, len(results) / elapsed, chunks / elapsed))
+    if mode == 'prune':
+        print('Pruned {} chunks inhabited for less than {} ticks: freed {:.1f} MiB, removed {} region files'.format(
+            sum(r['prunable'] for r in results), min_inhabited, sum(r['freed'] for r in results) / 1048576, sum(r['removed'] for r in results)))
+    else:
+        print('{} chunks are inhabited for less than {} ticks; every region is in {}'.format(
+            sum(r['prunable'] for r in results), min_inhabited, os.path.join(data_dir, '.mcctl_regions.tsv')))
+    return results
+
+def _scan_world_changes(data_dir, list_prefix=None, world_root=None):
+    import os
+    import json
+    import hashlib
+
+    index_path = os.path.join(data_dir, '.mcctl_index.json')
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+
+    # world_root: where the world dirs are read, ex: a copy taken by a hot backup
+    if world_root is None:
+        world_root = data_dir
+    new_index = {}
+    changed = []
+    scanned_bytes = hashed_bytes = staged_bytes = 0
+    world_dirs = [ e.name for e in os.scandir(world_root) if e.is_dir() and e.name.startswith('world') ]
+    for world_dir in world_dirs:
+        for root, _, files in os.walk(os.path.join(world_root, world_dir)):
+            for name in files:
+                path = os.path.join(root, name)
+                rel_path = os.path.relpath(path, world_root)
+                st = os.stat(path)
+                scanned_bytes += st.st_size
+                entry = index.get(rel_path)
+                if entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+                    new_index[rel_path] = entry
+                    continue
+
+                sha1 = hashlib.sha1()
+                with open(path, 'rb') as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b''):
+                        sha1.update(block)
+                hashed_bytes += st.st_size
+                new_index[rel_path] = { 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': sha1.hexdigest() }
+                if entry is None or entry['sha1'] != new_index[rel_path]['sha1']:
+                    changed.append(rel_path)
+                    staged_bytes += st.st_size
+    deleted = [ rel_path for rel_path in index if rel_path not in new_index ]
+
+    # promoted to .mcctl_index.json only once the commit has been made
+    with open(index_path + '.new', 'w') as f:
+        json.dump(new_index, f)
+    if list_prefix is not None:
+        with open(list_prefix + 'changed', 'wb') as f:
+            f.write(b''.join(p.encode('utf-8') + b'\0' for p in changed))
+        with open(list_prefix + 'deleted', 'wb') as f:
+            f.write(b''.join(p.encode('utf-8') + b'\0' for p in deleted))
+
+    print('Scanned {:.1f} MiB in {} files, hashed {:.1f} MiB, staging {:.1f} MiB in {} files ({} removed)'.format(
+        scanned_bytes / 1048576, len(new_index), hashed_bytes / 1048576, staged_bytes / 1048576, len(changed), len(deleted)))
+    return { 'changed': changed, 'deleted': deleted, 'scanned_bytes': scanned_bytes, 'hashed_bytes': hashed_bytes, 'staged_bytes': staged_bytes }
+
+class _RconClient:
+    # Source RCON: little-endian int32 length, request id and type, then the body and two NUL bytes
+    # ref: https://developer.valvesoftware.com/wiki/Source_RCON_Protocol
+    SERVERDATA_AUTH = 3
+    SERVERDATA_EXECCOMMAND = 2
+    SERVERDATA_AUTH_RESPONSE = 2
+    SERVERDATA_RESPONSE_VALUE = 0
+    # longer responses are split into packets of this many bytes with the same request id
+    MAX_FRAGMENT = 4096
+
+    def __init__(self, sock, password, window=RCON_PIPELINE_WINDOW):
+        self.sock = sock
+        self.window = window
+        self.lock = threading.Lock()
+        self._next_id = 0
+        self._buffer = b''
+        self.sock.settimeout(RCON_TIMEOUT)
+
+        request_id = self._send(self.SERVERDATA_AUTH, password)
+        while True:
+            response_id, response_type, _ = self._receive()
+            if response_type == self.SERVERDATA_AUTH_RESPONSE:
+                break
+        if response_id == -1 or response_id != request_id:
+            raise Exception('RCON authentication failed')
+
+    def command(self, command):
+        return self.commands([ command ])[0]
+
+    def commands(self, commands):
+        # up to window requests are in flight; responses are matched to them by request id
+        with self.lock:
+            try:
+                return self._commands(commands)
+            except Exception:
+                # a response may be left half read, so the connection is of no use any more
+                self.close()
+                raise
+
+    def _commands(self, commands):
+        request_ids = []
+        responses = {}
+        markers = {}
+        in_flight = 0
+        sent = 0
+        while sent < len(commands) or in_flight > 0:
+            while sent < len(commands) and in_flight < self.window:
+                request_id = self._send(self.SERVERDATA_EXECCOMMAND, commands[sent])
+                request_ids.append(request_id)
+                responses[request_id] = []
+                in_flight += 1
+                sent += 1
+
+            response_id, _, body = self._receive()
+            if response_id in markers:
+                del markers[response_id]
+                in_flight -= 1
+            elif response_id in responses:
+                responses[response_id].append(body)
+                if response_id in markers.values():
+                    continue
+                elif len(body) < self.MAX_FRAGMENT:
+                    in_flight -= 1
+                else:
+                    # a full packet may be the last one; an empty request of another type is answered in order,
+                    # so its answer ends the response. It is sent only now that the server has read the command,
+                    # since vanilla servers drop packets which arrive in the same read
+                    markers[self._send(self.SERVERDATA_RESPONSE_VALUE, '')] = response_id
+        # decoded as a whole, fragments may split characters
+        return [ b''.join(responses[request_id]).decode('utf-8', errors='replace') for request_id in request_ids ]
+
+    def close(self):
+        self.sock.close()
+
+    def _send(self, packet_type, body):
+        self._next_id = self._next_id % 0x7fffffff + 1
+        payload = struct.pack('<ii', self._next_id, packet_type) + body.encode('utf-8') + b'\0\0'
+        self.sock.sendall(struct.pack('<i', len(payload)) + payload)
+        return self._next_id
+
+    def _receive(self):
+        length = struct.unpack('<i', self._receive_exactly(4))[0]
+        payload = self._receive_exactly(length)
+        request_id, packet_type = struct.unpack('<ii', payload[:8])
+        return request_id, packet_type, payload[8:-2]
+
+    def _receive_exactly(self, size):
+        while len(self._buffer) < size:
+            data = self.sock.recv(65536)
+            if len(data) == 0:
+                raise EOFError('RCON connection closed')
+            self._buffer += data
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
 def _construct_github_url(world_name, path='', is_raw=False):
     if is_raw:
         url = furl(GITHUB_RAW_URL)
@@ -1,57 +1,293 @@
 import os
+import io
+import re
 import sys
+import socket
+import struct
+import codecs
+import zlib
+import atexit
 import urllib.request
 import pathlib
 import datetime
+import json
+import time
+import fnmatch
+import inspect
+import shlex
+import tempfile
+import textwrap
+import concurrent.futures
+import threading
+import collections
+import contextlib
+import importlib
+import itertools
+import socketserver
+
+class _LazyModule:
+    # imported on first attribute access, so each action only pays for the libraries it actually uses
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
 
 # furl
-from furl import furl
+furl = _LazyModule('furl')
 # GitPython
-import git
+git = _LazyModule('git')
 # python-digitalocean
-import digitalocean
+digitalocean = _LazyModule('digitalocean')
 # paramiko
-import paramiko
+paramiko = _LazyModule('paramiko')
 # cryptodomex
-from Cryptodome.PublicKey import RSA
-# retry
-from retry import retry
+RSA = _LazyModule('Cryptodome.PublicKey.RSA')
 # emoji
-import emoji
+emoji = _LazyModule('emoji')
+# only with --profile
+cProfile = _LazyModule('cProfile')
+pstats = _LazyModule('pstats')
 
 DIGITALOCEAN_API_TOKEN = os.getenv('DIGITALOCEAN_API_TOKEN')
 DIGITALOCEAN_REGION_SLUG = os.getenv('DIGITALOCEAN_REGION_SLUG')
 GITHUB_USER = os.getenv('GITHUB_USER')
 GITHUB_TOKEN = os.getenv('GITHUB_TOKEN')
 
+DROPLET_REGION = DIGITALOCEAN_REGION_SLUG if DIGITALOCEAN_REGION_SLUG is not None else 'sgp1'
+
 GITHUB_URL = 'https://github.com'
 GITHUB_RAW_URL = 'https://raw.githubusercontent.com'
 SCRIPT_DIR = pathlib.Path(__file__).parent.resolve()
+SSH_PORT = 22
+MINECRAFT_PORT = 25565
+# RCON requests sent before waiting for responses; vanilla servers drop the connection
+# when several packets arrive in one read, so only raise it for servers that handle that
+RCON_PIPELINE_WINDOW = int(os.getenv('MCCTL_RCON_PIPELINE_WINDOW', '1'))
+# seconds an rcon response may take before the connection is given up; save-all flush of a large world is the slowest
+RCON_TIMEOUT = int(os.getenv('MCCTL_RCON_TIMEOUT', '120'))
+# seconds to wait for each readiness phase of a new server
+DROPLET_READY_TIMEOUT = 300
+SSH_READY_TIMEOUT = 300
+MINECRAFT_READY_TIMEOUT = int(os.getenv('MCCTL_MINECRAFT_READY_TIMEOUT', '900'))
+# sshd allows 10 sessions per connection by default (MaxSessions)
+SSH_MAX_SESSIONS = 10
+# tail of each command output kept in memory while streaming it
+COMMAND_OUTPUT_RETAINED_BYTES = 64 * 1024
+# files kept beside the world for incremental backups (.mcctl_index.json, ...)
+BACKUP_IGNORE = '/.mcctl_*'
+# git: commit world files as they are / chunks: commit region chunks into a deduplicated .chunkstore
+BACKUP_FORMAT = os.getenv('MCCTL_BACKUP_FORMAT', 'git')
+# cold: back up the live world / hot: pause saving, copy the world beside it and back up the copy
+BACKUP_MODE = os.getenv('MCCTL_BACKUP_MODE', 'cold')
+# world dirs are mirrored into this dir of the data dir by hot backups; it matches BACKUP_IGNORE
+BACKUP_SNAPSHOT_NAME = '.mcctl_snapshot'
+# hot backups scan, commit and push at the lowest priority so the server keeps its CPU and disk
+BACKUP_LOW_PRIORITY = 'renice -n 19 -p $$ >/dev/null && ionice -c 2 -n 7 -p $$'
+DROPLET_SIZE = '2gb'
+# cloud-init may still hold the dpkg lock right after boot
+INSTALL_GIT_COMMAND = 'while fuser /var/lib/dpkg/lock >/dev/null 2>&1; do sleep 1; done; apt install -y git'
+# while it is filled, the new droplet of a migration is named after the world with this suffix
+MIGRATION_SUFFIX = '-migrating'
+MIGRATION_KEY_PATH = '/root/.ssh/mcctl_migrate'
+MIGRATION_KEY_COMMENT = 'mcctl-migrate'
+MIGRATION_ATTEMPTS = 5
+# top level entries of /root/data which the new droplet rebuilds by itself
+MIGRATION_EXCLUDES = [ BACKUP_SNAPSHOT_NAME ]
+# shallow: tip commit only / blobless: all commits, tip blobs only / full: whole history
+RESTORE_MODE = os.getenv('MCCTL_RESTORE_MODE', 'shallow')
+RESTORE_CLONE_OPTIONS = {
+    'shallow': '--depth 1 --single-branch --no-tags',
+    # checkout.workers lets newer git fetch and write the missing blobs in parallel
+    'blobless': '--filter=blob:none --single-branch --no-tags --config checkout.workers=0',
+    'full': ''
+}
+# compact keeps the newest snapshot of each bucket, under the first rule whose window a snapshot is in:
+# each hour of the last 24 hours, each day of the last 30 days, then each month; a count of 0 has no end
+BACKUP_RETENTION = os.getenv('MCCTL_BACKUP_RETENTION', 'hour:24,day:30,month:0')
+RETENTION_BUCKETS = { 'hour': ('%Y%m%d%H', 3600), 'day': ('%Y%m%d', 86400), 'week': ('%G%V', 7 * 86400), 'month': ('%Y%m', 31 * 86400) }
+# the window and depth of git gc --aggressive; world files are compressed already, so deltas only pay off
+# between versions of a region, and the memory of the delta search is bounded instead of the number of candidates
+COMPACT_REPACK_CONFIG = [ 'pack.windowMemory=256m', 'pack.deltaCacheSize=256m', 'core.bigFileThreshold=256m', 'pack.threads=0' ]
+COMPACT_REPACK_OPTIONS = [ '-a', '-d', '-f', '-q', '--window=250', '--depth=50' ]
+# where a world lives on its droplet; a droplet of its own runs the container minecraft on /root/data
+DEDICATED_SLOT = { 'container': 'minecraft', 'data_dir': '/root/data', 'port': MINECRAFT_PORT }
+# pack puts worlds onto shared droplets, each in a container and data dir named after the world and a port of its own;
+# the labels of the containers record which world is where
+PACK_DROPLET_PREFIX = 'minecraft-pack-'
+PACK_DROPLET_SIZE = os.getenv('MCCTL_PACK_DROPLET_SIZE', '4gb')
+PACK_DATA_ROOT = '/root/worlds'
+PACK_INDEX_PATH = SCRIPT_DIR / 'cache' / 'packs.json'
+PACK_LIST_COMMAND = "docker ps -a --filter label=mcctl.world --format '{{.Label \"mcctl.world\"}}\t{{.Label \"mcctl.port\"}}'"
+PACK_USAGE_COMMAND = "docker info --format '{{.NCPU}} {{.MemTotal}}' && docker stats --no-stream --format '{{.CPUPerc}} {{.MemUsage}}'"
+# a packed world's container is sized to this memory, and it is expected to keep this many vCPUs busy
+PACK_WORLD_MEMORY = int(os.getenv('MCCTL_PACK_WORLD_MEMORY_MB', '1024')) * 1048576
+PACK_WORLD_CPUS = float(os.getenv('MCCTL_PACK_WORLD_CPUS', '0.5'))
+# share of the memory and vCPUs of a shared droplet that measured usage and a new world may take
+PACK_FILL = 0.85
+PERFORMANCE_PROFILE = os.getenv('MCCTL_PERFORMANCE_PROFILE', 'balanced')
+# heap: share of the memory docker sees that goes to the JVM heap, cpus: share of the vCPUs the container may use,
+# distances: (base, per vCPU, cap); vanilla keeps the defaults of the image
+PERFORMANCE_PROFILES = {
+    'vanilla': None,
+    'lean': { 'heap': 0.5, 'gc': 'serial', 'cpus': 0.75, 'view_distance': (6, 1, 8), 'simulation_distance': (4, 1, 6) },
+    'balanced': { 'heap': 0.6, 'gc': 'aikar', 'cpus': 1.0, 'view_distance': (6, 2, 12), 'simulation_distance': (4, 1, 8) },
+    'performance': { 'heap': 0.7, 'gc': 'aikar', 'cpus': 1.0, 'view_distance': (8, 2, 16), 'simulation_distance': (6, 2, 12) }
+}
+# droplets created by this script carry this tag so they can be listed server-side
+DROPLET_TAG = 'mc-ctl'
+DROPLET_INDEX_PATH = SCRIPT_DIR / 'cache' / 'droplets.json'
+DROPLET_INDEX_TTL = int(os.getenv('MCCTL_DROPLET_INDEX_TTL', '300'))
+MINECRAFT_IMAGE = 'itzg/minecraft-server'
+MINECRAFT_IMAGE_TAG_URL = 'https://hub.docker.com/v2/repositories/itzg/minecraft-server/tags/latest'
+# pre-baked droplet snapshots are named <prefix><timestamp>, the newest one is used
+SNAPSHOT_PREFIX = 'mc-ctl-base-'
+SNAPSHOT_MAX_AGE_DAYS = int(os.getenv('MCCTL_SNAPSHOT_MAX_AGE_DAYS', '30'))
+BAKE_VERSIONS = [ v for v in os.getenv('MCCTL_BAKE_VERSIONS', 'LATEST').split(',') if v != '' ]
+FLEET_CONCURRENCY = int(os.getenv('MCCTL_FLEET_CONCURRENCY', '8'))
+METRICS_FILE = os.getenv('MCCTL_METRICS_FILE')
+# byte offset of each world's latest.log already shown by logs
+LOG_OFFSETS_PATH = SCRIPT_DIR / 'cache' / 'log_offsets.json'
+LOG_INITIAL_BYTES = 8 * 1024
+LOG_FOLLOW_INTERVAL = 2
+AUTOSCALE_SIZES = [ s for s in os.getenv('MCCTL_AUTOSCALE_SIZES', '2gb,4gb,8gb').split(',') if s != '' ]
+AUTOSCALE_STATE_PATH = SCRIPT_DIR / 'cache' / 'autoscale.json'
+AUTOSCALE_COOLDOWN = int(os.getenv('MCCTL_AUTOSCALE_COOLDOWN', '3600'))
+# a world is resized once this many samples in a row are past the thresholds of one direction
+AUTOSCALE_UP_SAMPLES = 5
+AUTOSCALE_DOWN_SAMPLES = 30
+# hysteresis: the thresholds of scaling down are well inside those of scaling up
+AUTOSCALE_MSPT_HIGH = 45
+AUTOSCALE_MSPT_LOW = 20
+AUTOSCALE_TPS_LOW = 18
+AUTOSCALE_MEMORY_HIGH = 0.9
+AUTOSCALE_MEMORY_LOW = 0.5
+AUTOSCALE_PLAYERS_LOW = 2
+RESIZE_TIMEOUT = 1800
+PREGEN_CHECKPOINT_PATH = SCRIPT_DIR / 'cache' / 'pregen.json'
+# forceload takes at most 256 chunks at once
+PREGEN_BATCH_CHUNKS = 8
+# seconds a square stays force loaded, long enough for the server to generate it
+PREGEN_HOLD = 5
+PREGEN_INTERVAL = 1
+PREGEN_REPORT_INTERVAL = 10
+PREGEN_WINDOW_MAX = 16
+PREGEN_MSPT_TARGET = 35
+PREGEN_MSPT_HIGH = 45
+PREGEN_TPS_LOW = 19
+FLEET_ACTIONS = [ 'backup', 'destroy', 'destroy_without_backup', 'restart', 'rcon', 'do_commands' ]
+# serve keeps libraries, keys, the DigitalOcean client and SSH transports warm for requests on this socket;
+# while it exists, invocations of the script are sent there
+DAEMON_SOCKET_PATH = pathlib.Path(os.getenv('MCCTL_DAEMON_SOCKET', str(SCRIPT_DIR / 'cache' / 'mcctl.sock')))
+DAEMON_WORKERS = int(os.getenv('MCCTL_DAEMON_WORKERS', '8'))
+# run by the invoking process: they replace sys.stdout of the whole process or run until interrupted
+DAEMON_LOCAL_ACTIONS = [ 'serve', 'help', 'fleet', 'logs', 'watch', 'autoscale' ]
+# their first argument is a world; the daemon runs the requests of one world one after another in arrival order
+DAEMON_WORLD_ACTIONS = [ 'create', 'pack', 'backup', 'destroy', 'destroy_without_backup', 'migrate', 'resize', 'restart',
+        'rcon', 'do_commands', 'do_commands_parallel', 'regions', 'pregen', 'compact' ]
+# jsonl: one span per line as it ends / chrome: trace event format for chrome://tracing or Perfetto
+TRACE_FORMAT = os.getenv('MCCTL_TRACE_FORMAT', 'jsonl')
+TRACE_DIR = SCRIPT_DIR / 'cache' / 'traces'
+# spans keep only the head of long remote commands
+TRACE_COMMAND_LENGTH = 200
 USAGE = '''
-Usage: {0} [create|backup|destroy|destroy_without_backup|help] [target]
+Usage: {0} [--trace[=path]] [--profile[=path]] [create|backup|destroy|destroy_without_backup|help] [target]
+    --trace: Record timed spans of API calls, SSH connections, remote commands and waits (default: cache/traces/)
+    --profile: Profile the local python side with cProfile and print the top functions to stderr (default: cache/traces/)
+        ex: {0} --trace create hungcat/minecraft-world
+        ex: {0} --trace=create.json --profile create hungcat/minecraft-world
     create: Create and serve minecraft server
-        {0} create [world_repository] [version|LATEST|SNAPSHOT]
+        {0} create [world_repository] [version|LATEST|SNAPSHOT] [vanilla|lean|balanced|performance]
         ex: {0} create hungcat/minecraft-world 1.14.4
+        ex: {0} create hungcat/minecraft-world LATEST performance
+        The performance profile sizes the heap, GC flags, view and simulation distance and container limits
+        to the droplet; it is recorded in MCCTL_PROFILE.txt and reused by the next create of the world.
+    pack: Create and serve minecraft server on a droplet shared with other worlds, each on a port of its own
+        {0} pack [world_repository] [version|LATEST|SNAPSHOT] [vanilla|lean|balanced|performance]
+        ex: {0} pack hungcat/small-world
+        The world goes to the shared droplet whose measured memory and CPU it fits most tightly, or to a new one.
+        backup, restart, rcon and destroy address it by name like any world; the shared droplet is destroyed with its last world.
     backup: Back up current world to corresponding github repository
-        {0} backup [world_repository]
+        {0} backup [world_repository] [git|chunks] [cold|hot]
         ex: {0} backup hungcat/minecraft-world
+        ex: {0} backup hungcat/minecraft-world chunks
+        ex: {0} backup hungcat/minecraft-world git hot
     destroy: Destroy current world with backup
         {0} destroy [world_repository]
         ex: {0} destroy hungcat/minecraft-world
     destroy_without_backup: Destroy current world without backup
         {0} destroy_without_backup [world_repository]
         ex: {0} destroy_without_backup hungcat/minecraft-world
+    migrate: Move a running world to a new droplet of another size or region, copying it droplet to droplet
+        {0} migrate [world_repository] [size_slug] [region_slug]
+        ex: {0} migrate hungcat/minecraft-world 4gb
+        ex: {0} migrate hungcat/minecraft-world 2gb sfo3
+        Players are only cut off from stopping the old server until the new one answers pings.
+    compact: Thin out old snapshots of a world repository, repack it and force push it
+        {0} compact [world_repository] [retention] [dry]
+        ex: {0} compact hungcat/minecraft-world
+        ex: {0} compact hungcat/minecraft-world hour:24,day:30,week:52,month:0 dry
+        Retention rules are bucket:count (hour, day, week or month); the newest snapshot of each of the last count
+        buckets is kept, by the first rule that covers it, and a count of 0 keeps every bucket. dry only lists the kept snapshots.
     restart: Restart minecraft server
         {0} restart [world_repository]
         ex: {0} restart hungcat/minecraft-world
-    rcon: Run rcon-cli command
-        {0} rcon [world_repository] [command]
+    rcon: Run rcon command (- reads one command per line from stdin)
+        {0} rcon [world_repository] [command|-]
         ex: {0} rcon hungcat/minecraft-world /help
+        ex: {0} rcon hungcat/minecraft-world - < whitelist_commands.txt
     do_commands: Run commands
         {0} do_commands [world_repository] [commands...]
         ex: {0} do_commands hungcat/minecraft-world "ls" "cat /data/logs/latest.log | tail -10"
+    do_commands_parallel: Run independent commands at once on one connection
+        {0} do_commands_parallel [world_repository] [commands...]
+        ex: {0} do_commands_parallel hungcat/minecraft-world "df -h" "free -m" "docker ps"
+    fleet: Run backup|destroy|destroy_without_backup|restart|rcon|do_commands on many worlds at once
+        {0} fleet [action] [world_pattern[,world_pattern...]] [arguments of action...]
+        ex: {0} fleet backup '*'
+        ex: {0} fleet rcon 'hungcat/*,friend/survival' /save-all
+    bake: Build a droplet snapshot with git, the server image and server jars installed
+        {0} bake [status|force]
+        ex: {0} bake
+    status: Show performance metrics of running worlds as json lines or prometheus text
+        {0} status [world_pattern[,world_pattern...]] [json|prometheus]
+        ex: {0} status '*' prometheus
+    watch: Keep sampling performance metrics of running worlds
+        {0} watch [world_pattern[,world_pattern...]] [interval_seconds] [json|prometheus]
+        ex: {0} watch 'hungcat/*' 15 json
+    logs: Show lines added to logs/latest.log since the last call, filtered on the droplet
+        {0} logs [world_pattern[,world_pattern...]] [regex] [follow]
+        ex: {0} logs hungcat/minecraft-world
+        ex: {0} logs '*' 'joined the game|left the game' follow
+    resize: Back up the world and resize its droplet, keeping its address (the disk is kept so it can shrink again)
+        {0} resize [world_repository] [size_slug]
+        ex: {0} resize hungcat/minecraft-world 4gb
+    autoscale: Keep sampling running worlds and resize droplets whose tick times, players or memory stay past thresholds
+        {0} autoscale [world_pattern[,world_pattern...]] [interval_seconds] [dry]
+        ex: {0} autoscale '*' 60
+        ex: {0} autoscale 'hungcat/*' 60 dry
+        dry only prints the resizes the policy decides.
+    regions: Report chunk counts, sizes and InhabitedTime of region files, or prune chunks players spent less time in
+        {0} regions [world_repository] [report|prune] [min_inhabited_seconds]
+        ex: {0} regions hungcat/minecraft-world
+        ex: {0} regions hungcat/minecraft-world prune 30
+        prune stops the server while it rewrites regions; pruned chunks are generated again when visited.
+    pregen: Generate chunks around a point ahead of players, as fast as tick times allow; rerun without radius to resume
+        {0} pregen [world_repository] [radius_blocks|border] [center_x,center_z]
+        ex: {0} pregen hungcat/minecraft-world 2000
+        ex: {0} pregen hungcat/minecraft-world border 100,-250
+        ex: {0} pregen hungcat/minecraft-world
     list: List running worlds
         {0} list
+    serve: Keep serving actions of other invocations on a unix socket, with libraries, keys and connections warm
+        {0} serve [socket_path]
+        ex: {0} serve
+        While it runs, {0} sends actions to it (except serve, help, fleet, logs, watch and autoscale, and traced ones);
+        actions of one world run in the order they came, those of different worlds on up to MCCTL_DAEMON_WORKERS workers.
+        Questions are answered no, since nobody sits at the terminal of the daemon.
     help: Show this
         {0} help
 
@@ -66,15 +302,104 @@ Required environment variables:
     GITHUB_TOKEN (for backup)
         Personal access token of github for backup the world.
         ref: https://help.github.com/ja/github/authenticating-to-github/creating-a-personal-access-token-for-the-command-line
+    MCCTL_DROPLET_INDEX_TTL (optional)
+        Seconds a cached world -> droplet lookup stays valid. (default: 300)
+    MCCTL_BACKUP_FORMAT (optional)
+        git: commit world files as they are (default)
+        chunks: commit region files split into deduplicated chunks
+    MCCTL_BACKUP_MODE (optional)
+        cold: commit the world while the server keeps writing it (default)
+        hot: stop saving over rcon, flush and copy the world, resume saving, then commit the copy at low priority
+    MCCTL_RESTORE_MODE (optional)
+        shallow: clone only the latest snapshot of the world (default)
+        blobless: clone every commit but only the files of the latest one
+        full: clone the whole history
+    MCCTL_PERFORMANCE_PROFILE (optional)
+        Profile of worlds which have none recorded: vanilla, lean, balanced or performance. (default: balanced)
+    MCCTL_PACK_DROPLET_SIZE (optional)
+        Size slug of the droplets pack creates. (default: 4gb)
+    MCCTL_PACK_WORLD_MEMORY_MB (optional)
+        Memory a packed world's container is sized to and reserved by placement. (default: 1024)
+    MCCTL_PACK_WORLD_CPUS (optional)
+        vCPUs placement reserves for a new packed world. (default: 0.5)
+    MCCTL_DAEMON_SOCKET (optional)
+        Unix socket of serve. (default: cache/mcctl.sock)
+    MCCTL_DAEMON_WORKERS (optional)
+        Requests serve runs at once. (default: 8)
+    MCCTL_BACKUP_RETENTION (optional)
+        Retention rules of compact. (default: hour:24,day:30,month:0)
+    MCCTL_BAKE_VERSIONS (optional)
+        Comma separated minecraft versions whose server jar is put in the snapshot. (default: LATEST)
+    MCCTL_SNAPSHOT_MAX_AGE_DAYS (optional)
+        Days after which the snapshot is stale regardless of the upstream image. (default: 30)
+    MCCTL_MINECRAFT_READY_TIMEOUT (optional)
+        Seconds create waits for the new server to answer server list pings. (default: 900)
+    MCCTL_RCON_PIPELINE_WINDOW (optional)
+        Number of rcon commands sent ahead of their responses. (default: 1)
+    MCCTL_RCON_TIMEOUT (optional)
+        Seconds an rcon response may take. (default: 120)
+    MCCTL_FLEET_CONCURRENCY (optional)
+        Number of worlds fleet, status and watch handle at the same time. (default: 8)
+    MCCTL_METRICS_FILE (optional)
+        File watch keeps replacing with the latest samples, ex: for a node_exporter textfile collector.
+    MCCTL_AUTOSCALE_SIZES (optional)
+        Comma separated droplet sizes autoscale moves worlds between, smallest first. (default: 2gb,4gb,8gb)
+    MCCTL_AUTOSCALE_COOLDOWN (optional)
+        Seconds autoscale leaves a world alone after resizing it. (default: 3600)
+    MCCTL_TRACE_FORMAT (optional)
+        Format of --trace: jsonl or chrome (chrome://tracing, Perfetto). (default: jsonl)
 '''.format(__file__).strip()
 
 
 def command_handler(args):
+    # leading --trace[=path] and --profile[=path] options wrap whatever action follows
+    global _tracer
+    options = collections.OrderedDict()
+    while len(args) > 1 and args[1].startswith('--'):
+        name, _, value = args[1][2:].partition('=')
+        options[name] = value
+        args = args[:1] + args[2:]
+    if len(options) == 0:
+        return _handle_action(args)
+    for name in options:
+        if name not in [ 'trace', 'profile' ]:
+            print('Invalid option: --{}'.format(name))
+            print(USAGE)
+            return 1
+    if TRACE_FORMAT not in [ 'jsonl', 'chrome' ]:
+        print(_emoji(':no_good: Unknown trace format: {}'.format(TRACE_FORMAT)))
+        return 1
+
+    action = args[1] if len(args) > 1 else 'help'
+    label = '{}-{}'.format(action, datetime.datetime.now().strftime('%Y%m%d-%H%M%S'))
+    if 'trace' in options:
+        trace_path = pathlib.Path(options['trace']) if options['trace'] != '' else TRACE_DIR / '{}.{}'.format(label, 'json' if TRACE_FORMAT == 'chrome' else 'jsonl')
+        _tracer = _Tracer(trace_path, TRACE_FORMAT)
+        _trace_digitalocean()
+    profiler = None
+    if 'profile' in options:
+        profiler = _Profiler(pathlib.Path(options['profile']) if options['profile'] != '' else TRACE_DIR / '{}.prof'.format(label))
+        profiler.start()
+
+    try:
+        with _span('action', action, arguments=args[2:]) as attributes:
+            attributes['status'] = _handle_action(args)
+            return attributes['status']
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            print('Profile: {}'.format(profiler.path), file=sys.stderr)
+        if _tracer is not None:
+            _tracer.close()
+            print('Trace: {}'.format(_tracer.path), file=sys.stderr)
+            _tracer = None
+
+def _handle_action(args):
     argc = len(args)
     if argc < 2:
         # show usage
         print(USAGE)
-        return
+        return 0
     else:
         world_name = ''
         version = ''
@@ -88,13 +413,19 @@ def command_handler(args):
     try:
         if action == 'create':
             print(_emoji(':muscle: Creating server...(first creation takes a bit time for downloading image)'))
-            print(create_server(world_name, version))
+            print(create_server(world_name, version, args[4] if argc > 4 else ''))
+        elif action == 'pack':
+            print(_emoji(':muscle: Packing server onto a shared droplet...'))
+            print(pack_world(world_name, version, args[4] if argc > 4 else ''))
         elif action == 'list':
             print(_emoji(':muscle: Listing server...'))
             print(list_server())
+        elif action == 'bake':
+            print(_emoji(':muscle: Baking droplet snapshot...'))
+            print(bake_snapshot(world_name))
         elif action == 'backup':
             print(_emoji(':muscle: Backuping world data...'))
-            print(backup_world(world_name))
+            print(backup_world(world_name, version if version != '' else BACKUP_FORMAT, args[4] if argc > 4 else BACKUP_MODE))
         elif action == 'destroy':
             print(_emoji(':muscle: Backuping world data...'))
             print(backup_world(world_name))
@@ -103,164 +434,1584 @@ def command_handler(args):
         elif action == 'destroy_without_backup':
             print(_emoji(':muscle: Destroying server...'))
             print(destroy_server(world_name))
+        elif action == 'migrate':
+            print(_emoji(':muscle: Migrating world...'))
+            print(migrate_world(world_name, version if version != '' else DROPLET_SIZE, args[4] if argc > 4 else DROPLET_REGION))
         elif action == 'help':
             print(USAGE)
         elif action == 'restart':
             print(_emoji(':muscle: Restarting minecraft server...'))
-            print(do_commands(world_name, [ 'docker restart minecraft' ]))
+            print(restart_server(world_name))
         elif action == 'rcon':
-            print(_emoji(':muscle: Restarting minecraft server...'))
-            print(do_commands(world_name, [ 'docker exec rcon-cli {}'.format(version) ]))
+            print(_emoji(':muscle: Running rcon command...'))
+            print(rcon(world_name, sys.stdin.read() if args[3:] == [ '-' ] else ' '.join(args[3:])))
         elif action == 'do_commands':
-            print(_emoji(':muscle: Restarting minecraft server...'))
+            print(_emoji(':muscle: Running commands...'))
             print(do_commands(world_name, args[3:]))
+        elif action == 'do_commands_parallel':
+            print(_emoji(':muscle: Running commands...'))
+            print(do_commands(world_name, args[3:], parallel=True))
+        elif action == 'status':
+            print(status_worlds(world_name if world_name != '' else '*', version if version != '' else 'json'))
+        elif action == 'watch':
+            watch_worlds(world_name if world_name != '' else '*', float(version) if version != '' else 30, args[4] if argc > 4 else 'json')
+        elif action == 'compact':
+            print(_emoji(':muscle: Compacting backups...'))
+            print(compact_backups(world_name, version if version != '' else BACKUP_RETENTION, argc > 4 and args[4] == 'dry'))
+        elif action == 'resize':
+            print(_emoji(':muscle: Resizing server...'))
+            print(resize_server(world_name, version if version != '' else DROPLET_SIZE))
+        elif action == 'autoscale':
+            autoscale_worlds(world_name if world_name != '' else '*', float(version) if version != '' else 60, args[4] if argc > 4 else '')
+        elif action == 'regions':
+            print(_emoji(':muscle: Analyzing regions...'))
+            print(analyze_regions(world_name, version if version != '' else 'report', args[4] if argc > 4 else '60'))
+        elif action == 'pregen':
+            print(_emoji(':muscle: Pre-generating chunks...'))
+            print(pregen_world(world_name, version, args[4] if argc > 4 else ''))
+        elif action == 'logs':
+            print(logs(world_name, version, argc > 4 and args[4] == 'follow'))
+        elif action == 'serve':
+            print(serve_daemon(world_name))
+        elif action == 'fleet':
+            print(_emoji(':muscle: Running {} on worlds {}...'.format(world_name, version)))
+            message, status = fleet(world_name, version, args[4:])
+            print(message)
+            return status
         else:
             print('Invalid action: {}'.format(action))
             print(USAGE)
     except Exception as e:
         print(_emoji(':no_good: Error: {}'.format(e)))
+        return 1
 
-    return
+    return 0
 
 
-def list_server():
-    manager = digitalocean.Manager(token=DIGITALOCEAN_API_TOKEN)
-    return manager.get_all_droplets()
+_tracer = None
+
+class _Tracer:
+    def __init__(self, path, trace_format):
+        self.path = path
+        self.format = trace_format
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.events = []
+        self.thread_names = {}
+        # spans opened by worker threads have no parent in that thread, they belong to the outermost span
+        self.root_id = None
+        self._next_id = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = path.open('w')
+
+    def new_id(self):
+        with self.lock:
+            self._next_id += 1
+            if self.root_id is None:
+                self.root_id = self._next_id
+            return self._next_id
+
+    def parent_id(self):
+        return getattr(self.local, 'span_id', self.root_id)
+
+    def record(self, category, name, started, finished, attributes, span_id, parent_id):
+        thread = threading.current_thread()
+        name = _redact(name)
+        attributes = { key: _redact(value) for key, value in attributes.items() }
+        with self.lock:
+            if self.format == 'chrome':
+                self.thread_names[thread.ident] = thread.name
+                self.events.append({ 'name': name, 'cat': category, 'ph': 'X', 'ts': started * 1000000, 'dur': (finished - started) * 1000000,
+                    'pid': os.getpid(), 'tid': thread.ident, 'args': dict(attributes, span_id=span_id, parent_id=parent_id) })
+            else:
+                # written as soon as the span ends, so long running actions can be followed with tail -f
+                self.file.write(json.dumps({ 'span_id': span_id, 'parent_id': parent_id, 'category': category, 'name': name,
+                    'start': started, 'duration': finished - started, 'thread': thread.name, 'attributes': attributes }, default=str) + '\n')
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.format == 'chrome':
+                metadata = [ { 'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': { 'name': name } } for tid, name in self.thread_names.items() ]
+                json.dump({ 'traceEvents': metadata + self.events, 'displayTimeUnit': 'ms' }, self.file, default=str)
+            self.file.close()
+
+def _redact(value):
+    # credentials in URLs, like the GitHub token _construct_github_url embeds, must not end up in trace files
+    if isinstance(value, str):
+        return re.sub(r'//[^/@\s]+@', '//***@', value)
+    elif isinstance(value, (list, tuple)):
+        return [ _redact(v) for v in value ]
+    return value
+
+@contextlib.contextmanager
+def _span(category, name, **attributes):
+    # times the block when --trace is on; the block may add attributes to the yielded dict
+    tracer = _tracer
+    if tracer is None:
+        yield attributes
+        return
+    parent_id = tracer.parent_id()
+    span_id = tracer.new_id()
+    tracer.local.span_id = span_id
+    started = time.time()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes['error'] = repr(e)
+        raise
+    finally:
+        tracer.local.span_id = parent_id
+        tracer.record(category, name, started, time.time(), attributes, span_id, parent_id)
+
+def _record_span(category, name, started, **attributes):
+    # for work that does not fit in a with block, like a streamed remote command
+    tracer = _tracer
+    if tracer is not None:
+        tracer.record(category, name, started, time.time(), attributes, tracer.new_id(), tracer.parent_id())
+
+def _trace_digitalocean():
+    # every DigitalOcean API request of python-digitalocean goes through BaseAPI.get_data
+    baseapi = importlib.import_module('digitalocean.baseapi')
+    get_data = baseapi.BaseAPI.get_data
+    if getattr(get_data, 'traced', False):
+        return
+    def traced_get_data(self, *args, **kwargs):
+        url = args[0] if len(args) > 0 else kwargs.get('url', '')
+        method = kwargs.get('type', args[1] if len(args) > 1 else baseapi.GET)
+        with _span('digitalocean', '{} {}'.format(method, url.split('?')[0]), url=url):
+            return get_data(self, *args, **kwargs)
+    traced_get_data.traced = True
+    baseapi.BaseAPI.get_data = traced_get_data
+
+def _command_label(command):
+    # ex: "cd /root/data && git push" -> "git push"
+    words = re.sub(r'^(cd \S+ && )+', '', command).split()
+    return ' '.join(words[:2])
+
+class _Profiler:
+    # before python 3.12 cProfile only sees the thread that enabled it, so every thread started while profiling gets its own profile;
+    # from 3.12 it sees every thread through sys.monitoring and allows only one active profiler
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.profiles = []
+
+    def start(self):
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._start_in_thread)
+        self._start_in_thread()
+
+    def _start_in_thread(self, *args):
+        # in a new thread this runs as its profile function, which an enabled profile replaces
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active; without this the thread would keep calling back here on every event
+            sys.setprofile(None)
+            return
+        with self.lock:
+            self.profiles.append(profile)
+
+    def stop(self):
+        threading.setprofile(None)
+        with self.lock:
+            profiles = list(self.profiles)
+        stats = pstats.Stats(*profiles, stream=sys.stderr)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        stats.dump_stats(str(self.path))
+        stats.sort_stats('cumulative').print_stats(25)
+
+def fleet(action, world_patterns, args=[]):
+    if action not in FLEET_ACTIONS:
+        return _emoji(':no_good: Fleet does not support action: {}'.format(action)), 1
+    worlds = _resolve_worlds(world_patterns)
+    if len(worlds) == 0:
+        return _emoji(':thinking_face: No world matches {}'.format(world_patterns)), 1
+
+    results = {}
+    stdout = sys.stdout
+    sys.stdout = _ThreadPrefixedWriter(stdout)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=FLEET_CONCURRENCY) as executor:
+            futures = { executor.submit(_run_fleet_action, action, world, args): world for world in worlds }
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+    finally:
+        sys.stdout.flush()
+        sys.stdout = stdout
+
+    failed = [ world for world in worlds if not results[world][0] ]
+    lines = [ '{} [{}] {} ({:.1f}s)'.format(_emoji(':o:' if ok else ':x:'), world, message, elapsed) for world, (ok, message, elapsed) in sorted(results.items()) ]
+    lines.append(_emoji(':bar_chart: {}/{} worlds succeeded'.format(len(worlds) - len(failed), len(worlds))))
+    return '\n'.join(lines), 0 if len(failed) == 0 else 1
+
+def _resolve_worlds(world_patterns, droplets=None):
+    patterns = [ p for p in world_patterns.split(',') if p != '' ]
+    if droplets is None:
+        droplets = list_server()
+    # shared droplets of pack are no world; the worlds on them are addressed by name;
+    # the new droplet of a migration is the world's only once the migration renames it
+    running = sorted(droplet.name[len('minecraft-'):] for droplet in droplets
+            if droplet.name.startswith('minecraft-') and droplet.name != 'minecraft-' and not droplet.name.startswith(PACK_DROPLET_PREFIX)
+            and not droplet.name.endswith(MIGRATION_SUFFIX))
+
+    worlds = []
+    for pattern in patterns:
+        if any(c in pattern for c in '*?['):
+            matched = fnmatch.filter(running, pattern)
+        else:
+            # plain names are kept even if not running so that the failure is reported
+            matched = [ pattern ]
+        worlds.extend(w for w in matched if w not in worlds)
+    return worlds
+
+def _run_fleet_action(action, world_name, args):
+    # one world's failure must not stop the others, so everything is turned into a result
+    _ThreadPrefixedWriter.set_prefix('[{}] '.format(world_name))
+    started = time.time()
+    try:
+        if action == 'backup':
+            message = backup_world(world_name)
+        elif action == 'destroy':
+            message = backup_world(world_name)
+            if not _is_failure_message(message):
+                message = destroy_server(world_name)
+        elif action == 'destroy_without_backup':
+            message = destroy_server(world_name)
+        elif action == 'restart':
+            message = restart_server(world_name)
+        elif action == 'rcon':
+            message = rcon(world_name, ' '.join(args))
+        elif action == 'do_commands':
+            message = do_commands(world_name, args)
+        ok = not _is_failure_message(message)
+    except Exception as e:
+        message = _emoji(':no_good: Error: {}'.format(e))
+        ok = False
+    print(message)
+    return ok, message, time.time() - started
+
+def serve_daemon(socket_path=''):
+    path = pathlib.Path(socket_path) if socket_path != '' else DAEMON_SOCKET_PATH
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(str(path))
+                return _emoji(':thinking_face: A daemon is serving on {} already'.format(path))
+            except OSError:
+                # left by a daemon which did not stop cleanly
+                path.unlink()
+
+    # what every invocation of the script pays for before its first request
+    for module in [ furl, git, digitalocean, paramiko, emoji ]:
+        getattr(module, '__name__')
+    _get_ssh_keys()
+    _get_manager()
+
+    server = _DaemonServer(str(path), _DaemonHandler)
+    server.queue = _KeyedQueue(DAEMON_WORKERS)
+    os.chmod(str(path), 0o600)
+    stdout = sys.stdout
+    sys.stdout = _RoutedWriter(stdout)
+    print(_emoji(':satellite: Serving on {} with {} workers'.format(path, DAEMON_WORKERS)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.queue.shutdown()
+        if path.exists():
+            path.unlink()
+        sys.stdout = stdout
+    return _emoji(':wave: Stopped serving on {}'.format(path))
+
+def _forward_to_daemon(args):
+    # the thin client: None when there is no daemon to send the action to, so that it runs in this process
+    action = args[1] if len(args) > 1 else 'help'
+    if action in DAEMON_LOCAL_ACTIONS or action.startswith('--') or not DAEMON_SOCKET_PATH.exists():
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(DAEMON_SOCKET_PATH))
+    except OSError:
+        sock.close()
+        return None
+
+    # the daemon cannot read the standard input of this process
+    if action == 'rcon' and args[3:] == [ '-' ]:
+        args = args[:3] + [ sys.stdin.read() ]
+    with sock, sock.makefile('rwb') as f:
+        f.write('{}\n'.format(json.dumps({ 'args': args[1:] })).encode('utf-8'))
+        f.flush()
+        for line in f:
+            response = json.loads(line.decode('utf-8'))
+            if 'output' in response:
+                _print_output(response['output'])
+            else:
+                return response['status']
+    print(_emoji(':cry: The daemon closed the connection'))
+    return 1
 
-def create_server(world_name='', version=''):
+class _DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+class _DaemonHandler(socketserver.StreamRequestHandler):
+    # a request is one json line {"args": [action, ...]}; the response is json lines {"output": text} and {"status": n}
+    def handle(self):
+        client = _DaemonClient(self.wfile)
+        try:
+            args = [ sys.argv[0] ] + json.loads(self.rfile.readline().decode('utf-8'))['args']
+        except (ValueError, KeyError, TypeError) as e:
+            client.send({ 'output': 'Invalid request: {}\n'.format(e) })
+            client.send({ 'status': 1 })
+            return
+        key = args[2] if len(args) > 2 and args[1] in DAEMON_WORLD_ACTIONS else None
+        future = self.server.queue.submit(key, _run_daemon_request, client, args)
+        client.send({ 'status': future.result() })
+
+class _DaemonClient:
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, response):
+        # a client which went away does not stop its request
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.wfile.write('{}\n'.format(json.dumps(response)).encode('utf-8'))
+                self.wfile.flush()
+            except OSError:
+                self.closed = True
+
+    def write(self, text):
+        if text != '':
+            self.send({ 'output': text })
+        return len(text)
+
+    def flush(self):
+        pass
+
+def _run_daemon_request(client, args):
+    _RoutedWriter.route(client)
     try:
-        commands, version = _construct_droplet_docker_commands(world_name, version)
+        status = command_handler(args)
+        return status if isinstance(status, int) else 0
     except Exception as e:
-        return _emoji(':no_good: Exit: {}'.format(e))
+        print(_emoji(':no_good: Error: {}'.format(e)))
+        return 1
+    finally:
+        _RoutedWriter.route(None)
+
+class _KeyedQueue:
+    # runs jobs on a bounded pool; jobs of one key run one after another in the order they came,
+    # jobs of other keys and those without a key meanwhile
+    def __init__(self, workers):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def submit(self, key, func, *args):
+        job = (concurrent.futures.Future(), func, args)
+        if key is not None:
+            with self.lock:
+                if key in self.pending:
+                    self.pending[key].append(job)
+                    return job[0]
+                self.pending[key] = collections.deque()
+        self.executor.submit(self._run, key, job)
+        return job[0]
+
+    def _run(self, key, job):
+        future, func, args = job
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
+        if key is None:
+            return
+        with self.lock:
+            if len(self.pending[key]) == 0:
+                del self.pending[key]
+                return
+            job = self.pending[key].popleft()
+        self.executor.submit(self._run, key, job)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+class _RoutedWriter:
+    # sys.stdout of the daemon: what the worker of a request prints goes to its client, the rest to the daemon's output
+    # (threads an action starts itself included)
+    _local = threading.local()
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    @classmethod
+    def route(cls, target):
+        cls._local.target = target
+
+    @classmethod
+    def routed(cls):
+        return getattr(cls._local, 'target', None) is not None
+
+    def write(self, text):
+        target = getattr(self._local, 'target', None)
+        return (target if target is not None else self.stream).write(text)
+
+    def flush(self):
+        target = getattr(self._local, 'target', None)
+        (target if target is not None else self.stream).flush()
+
+def _is_failure_message(message):
+    return any(message.startswith(_emoji(e)) for e in [ ':cry:', ':thinking_face:', ':no_good:', ':raised_hand:' ])
+
+class _ThreadPrefixedWriter:
+    # keeps lines printed by concurrent workers apart by prefixing them with the worker's label
+    _local = threading.local()
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    @classmethod
+    def set_prefix(cls, prefix):
+        cls._local.prefix = prefix
+        cls._local.pending = ''
+
+    def write(self, text):
+        prefix = getattr(self._local, 'prefix', '')
+        pending = getattr(self._local, 'pending', '') + text
+        lines = pending.split('\n')
+        self._local.pending = lines.pop()
+        if len(lines) > 0:
+            with self.lock:
+                self.stream.write(''.join('{}{}\n'.format(prefix, line) for line in lines))
+        return len(text)
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
+
+def status_worlds(world_patterns='*', output_format='json'):
+    samples = _sample_worlds(_resolve_worlds(world_patterns))
+    return _format_samples(samples, output_format)
+
+def watch_worlds(world_patterns='*', interval=30, output_format='json'):
+    # connections stay in the pools between samples, so each round only costs the probes
+    while True:
+        started = time.time()
+        samples = _sample_worlds(_resolve_worlds(world_patterns))
+        text = _format_samples(samples, output_format)
+        if METRICS_FILE is not None:
+            tmp_path = '{}.{}.tmp'.format(METRICS_FILE, os.getpid())
+            with open(tmp_path, 'w') as f:
+                f.write(text + '\n')
+            os.replace(tmp_path, METRICS_FILE)
+        print(text)
+        sys.stdout.flush()
+        time.sleep(max(0, interval - (time.time() - started)))
+
+def _sample_worlds(worlds):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=FLEET_CONCURRENCY) as executor:
+        return list(executor.map(_sample_world, worlds))
+
+def _sample_world(world_name):
+    sample = collections.OrderedDict([ ('timestamp', time.time()), ('world', world_name), ('up', 0) ])
+    try:
+        droplet, slot = _find_world(world_name)
+        if droplet is None:
+            raise Exception('That world is not running')
+        private_key, _ = _get_ssh_keys()
+        ip_address = _get_ip_address_of_droplet(droplet)
+
+        server_status = _server_list_ping(ip_address, slot['port'])
+        sample['up'] = 1
+        sample['ping_latency_ms'] = server_status['latency_ms']
+        sample['players_online'] = server_status['players']['online']
+        sample['players_max'] = server_status['players']['max']
+
+        sample.update(_sample_rcon(ip_address, private_key, slot))
+        sample.update(_sample_host(ip_address, private_key, slot['container']))
+    except Exception as e:
+        sample['error'] = str(e)
+    return sample
+
+def _sample_rcon(ip_address, private_key, slot=DEDICATED_SLOT):
+    # tps/mspt exist on Paper/Spigot only; commands run on the server thread, so the
+    # round trip of a cheap command also reflects how late ticks are
+    sample = {}
+    started = time.time()
+    tps, mspt = _get_rcon_client(ip_address, private_key, slot).commands([ 'tps', 'mspt' ])
+    sample['rcon_latency_ms'] = (time.time() - started) * 1000
+    numbers = re.findall(r'[0-9]+(?:\.[0-9]+)?', re.sub(r'\u00a7.', '', tps.split(':', 1)[-1]))
+    if tps.startswith('\u00a76TPS') or tps.startswith('TPS'):
+        sample['tps'] = float(numbers[0])
+    # ex: Server tick times (avg/min/max) from last 5s, 10s, 1m: ◴ 1.2/0.5/3.4, ...
+    numbers = re.findall(r'([0-9.]+)/[0-9.]+/[0-9.]+', re.sub(r'\u00a7.', '', mspt))
+    if len(numbers) > 0:
+        sample['mspt'] = float(numbers[0])
+    return sample
+
+def _sample_host(ip_address, private_key, container=DEDICATED_SLOT['container']):
+    # on a shared droplet the load is the whole host's while the stats are the world's container
+    stream = _stream_command(_get_ssh_client(ip_address, private_key), ' ; '.join([
+        "docker stats --no-stream --format '{{{{.CPUPerc}}}} {{{{.MemUsage}}}}' {}".format(container),
+        'echo ---',
+        'cat /proc/loadavg',
+        'echo ---',
+        # jstat only exists in images shipping a JDK
+        "docker exec {} sh -c 'jstat -gc $(pgrep -n java)' 2>/dev/null".format(container)
+    ]))
+    for _ in stream:
+        pass
+    stats, loadavg, jstat = (stream.output() + '\n---\n---').split('---', 2)[:3]
+
+    sample = {}
+    stats = stats.split()
+    if len(stats) >= 4:
+        sample['container_cpu_percent'] = float(stats[0].rstrip('%'))
+        sample['container_memory_bytes'] = _parse_size(stats[1])
+        sample['container_memory_limit_bytes'] = _parse_size(stats[3])
+    loadavg = loadavg.split()
+    if len(loadavg) >= 3:
+        sample['load1'], sample['load5'], sample['load15'] = [ float(l) for l in loadavg[:3] ]
+    lines = [ line.split() for line in jstat.strip().splitlines() if line.strip() != '---' ]
+    if len(lines) >= 2:
+        gc = dict(zip(lines[0], [ float(v) for v in lines[1] ]))
+        sample['jvm_heap_used_bytes'] = sum(gc.get(k, 0) for k in [ 'S0U', 'S1U', 'EU', 'OU' ]) * 1024
+        sample['jvm_heap_committed_bytes'] = sum(gc.get(k, 0) for k in [ 'S0C', 'S1C', 'EC', 'OC' ]) * 1024
+    return sample
+
+def _parse_size(text):
+    # docker prints sizes like 1.2GiB or 512MB
+    m = re.match(r'([0-9.]+)([KMGT]?i?B)', text)
+    if m is None:
+        return 0
+    units = { 'B': 1, 'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4 }
+    return int(float(m.group(1)) * units[m.group(2)])
+
+def _format_samples(samples, output_format):
+    if output_format == 'json':
+        return '\n'.join(json.dumps(sample) for sample in samples)
+
+    # Prometheus text exposition format
+    lines = []
+    names = []
+    for sample in samples:
+        names.extend(k for k, v in sample.items() if isinstance(v, (int, float)) and k != 'timestamp' and k not in names)
+    for name in names:
+        lines.append('# TYPE minecraft_{} gauge'.format(name))
+        for sample in samples:
+            if name in sample:
+                lines.append('minecraft_{}{{world="{}"}} {}'.format(name, sample['world'].replace('\\', '\\\\').replace('"', '\\"'), sample[name]))
+    return '\n'.join(lines)
+
+def autoscale_worlds(world_patterns='*', interval=60, mode=''):
+    if mode not in [ '', 'dry' ]:
+        print(_emoji(':no_good: Unknown autoscale mode: {}'.format(mode)))
+        return
+    # streaks and cooldowns outlive the process, except those of a dry run
+    states = {} if mode == 'dry' else _load_cache(AUTOSCALE_STATE_PATH)
+    while True:
+        started = time.time()
+        droplets = { droplet.name: droplet for droplet in list_server() }
+        samples = _sample_worlds(_resolve_worlds(world_patterns, droplets.values()))
+        for line in _autoscale_round(samples, droplets, states, dry_run=mode == 'dry'):
+            print(line)
+        if mode != 'dry':
+            _save_cache(AUTOSCALE_STATE_PATH, states)
+        sys.stdout.flush()
+        time.sleep(max(0, interval - (time.time() - started)))
+
+def _autoscale_round(samples, droplets, states, dry_run=False):
+    lines = []
+    for sample in samples:
+        droplet = droplets.get('minecraft-{}'.format(sample['world']))
+        if droplet is None:
+            continue
+        state = states.setdefault(sample['world'], {})
+        size_slug = _autoscale_decision(state, sample, droplet.size_slug)
+        if size_slug is None:
+            continue
+
+        lines.append(_emoji(':information: [{}] {} samples in a row {}, resizing {} -> {}'.format(
+            sample['world'], abs(state['streak']), 'overloaded' if state['streak'] > 0 else 'idle', droplet.size_slug, size_slug)))
+        # the cooldown starts with the attempt, so a failing resize is not retried every round
+        state['streak'] = 0
+        state['resized_at'] = sample['timestamp']
+        if dry_run:
+            continue
+        _save_cache(AUTOSCALE_STATE_PATH, states)
+        try:
+            lines.append(resize_server(sample['world'], size_slug))
+        except Exception as e:
+            lines.append(_emoji(':no_good: Error: {}'.format(e)))
+    return lines
+
+def _autoscale_decision(state, sample, size_slug, sizes=AUTOSCALE_SIZES):
+    # state['streak'] counts samples in a row overloaded (positive) or idle (negative);
+    # returns the size to resize to, or None
+    pressure = _autoscale_pressure(sample)
+    streak = state.get('streak', 0)
+    if pressure == 0 or streak * pressure < 0:
+        streak = 0
+    state['streak'] = streak + pressure
+
+    if sample['timestamp'] - state.get('resized_at', 0) < AUTOSCALE_COOLDOWN or size_slug not in sizes:
+        return None
+    index = sizes.index(size_slug)
+    if state['streak'] >= AUTOSCALE_UP_SAMPLES and index + 1 < len(sizes):
+        return sizes[index + 1]
+    if state['streak'] <= -AUTOSCALE_DOWN_SAMPLES and index > 0:
+        return sizes[index - 1]
+    return None
+
+def _autoscale_pressure(sample):
+    # 1: overloaded, -1: idle, 0: in between or unknown; metrics a server does not report are not held against it
+    if sample.get('up') != 1:
+        return 0
+    if 'jvm_heap_used_bytes' in sample and sample.get('jvm_heap_committed_bytes'):
+        memory = sample['jvm_heap_used_bytes'] / sample['jvm_heap_committed_bytes']
+    elif sample.get('container_memory_limit_bytes'):
+        memory = sample['container_memory_bytes'] / sample['container_memory_limit_bytes']
+    else:
+        memory = None
 
-    private_key, public_key = _get_ssh_keys()
-    droplet = _create_droplet(public_key, world_name)
-    print('Droplet has created. Run minecraft...')
+    if sample.get('mspt', 0) > AUTOSCALE_MSPT_HIGH or sample.get('tps', 20) < AUTOSCALE_TPS_LOW or (memory or 0) > AUTOSCALE_MEMORY_HIGH:
+        return 1
+    if sample.get('players_online', 0) <= AUTOSCALE_PLAYERS_LOW and sample.get('mspt', 0) < AUTOSCALE_MSPT_LOW and (memory or 0) < AUTOSCALE_MEMORY_LOW:
+        return -1
+    return 0
 
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ip_address = _get_ip_address_of_droplet(droplet)
-    _ssh_connect(client, hostname=ip_address, username='root', pkey=private_key)
-    status = _exec_commands(client, commands, ignore_error=True)
+def logs(world_patterns='', pattern='', follow=False):
+    worlds = _resolve_worlds(world_patterns)
+    if len(worlds) == 0:
+        return _emoji(':thinking_face: No world matches {}'.format(world_patterns))
+
+    stop = threading.Event()
+    results = {}
+    threads = [ threading.Thread(target=_tail_log, args=(world, pattern, follow, stop, results), daemon=True) for world in worlds ]
+    stdout = sys.stdout
+    if len(worlds) > 1:
+        sys.stdout = _ThreadPrefixedWriter(stdout)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.stdout.flush()
+        sys.stdout = stdout
+
+    return '\n'.join(results[world] for world in worlds if world in results)
+
+def _tail_log(world_name, pattern, follow, stop, results):
+    _ThreadPrefixedWriter.set_prefix('[{}] '.format(world_name))
+    transferred = log_bytes = 0
+    try:
+        droplet = _find_droplet(world_name)
+        if droplet is None:
+            results[world_name] = _emoji(':thinking_face: [{}] That world is not running'.format(world_name))
+            return
+        private_key, _ = _get_ssh_keys()
+        ip_address = _get_ip_address_of_droplet(droplet)
+        while True:
+            t, l = _fetch_new_log(world_name, ip_address, private_key, pattern)
+            transferred += t
+            log_bytes += l
+            if not follow or stop.wait(LOG_FOLLOW_INTERVAL):
+                break
+    except Exception as e:
+        results[world_name] = _emoji(':no_good: [{}] Error: {}'.format(world_name, e))
+        return
+    results[world_name] = _emoji(':information: [{}] {:.1f} KiB transferred for {:.1f} KiB of new log'.format(world_name, transferred / 1024, log_bytes / 1024))
+
+def _fetch_new_log(world_name, ip_address, private_key, pattern):
+    # the droplet sends "<inode> <size>\n" followed by the gzipped, already filtered log since the saved offset
+    with _log_offsets_lock:
+        state = _load_cache(LOG_OFFSETS_PATH).get(world_name, { 'inode': '', 'offset': -1 })
+    log_filter = 'cat' if pattern == '' else '{{ grep -a -E {} || true; }}'.format(shlex.quote(pattern))
+    command = '''
+f=/root/data/logs/latest.log
+[ -f $f ] || exit 1
+set -- $(stat -c '%i %s' $f)
+inode=$1; size=$2; offset={offset}
+echo "$inode $size"
+{{
+    if [ $offset -lt 0 ]; then
+        start=$(( size > {initial} ? size - {initial} + 1 : 1 ))
+        tail -c +$start $f | head -c $(( size - start + 1 )) | {{ if [ $start -gt 1 ]; then tail -n +2; else cat; fi; }}
+    else
+        if [ "$inode" != "{inode}" ] || [ $size -lt $offset ]; then
+            # rotated: the rest of the previous latest.log is the newest .log.gz
+            prev=$(ls -t /root/data/logs/*.log.gz 2>/dev/null | head -n 1)
+            [ -n "$prev" ] && zcat "$prev" | tail -c +$(( offset + 1 ))
+            offset=0
+        fi
+        tail -c +$(( offset + 1 )) $f | head -c $(( size - offset ))
+    fi
+}} | {log_filter} | gzip -1 -c
+'''.format(offset=state['offset'], inode=state['inode'], initial=LOG_INITIAL_BYTES, log_filter=log_filter)
+
+    chan = _get_ssh_client(ip_address, private_key).get_transport().open_session()
+    chan.exec_command(command)
+    header = b''
+    while not header.endswith(b'\n'):
+        data = chan.recv(1)
+        if len(data) == 0:
+            raise Exception('{} has no logs/latest.log'.format(world_name))
+        header += data
+    inode, size = header.decode('utf-8').split()
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    transferred = len(header)
+    while True:
+        data = chan.recv(32768)
+        if len(data) == 0:
+            break
+        transferred += len(data)
+        _print_output(decoder.decode(decompressor.decompress(data)))
+    _print_output(decoder.decode(decompressor.flush(), final=True))
+    chan.recv_exit_status()
+    chan.close()
+
+    with _log_offsets_lock:
+        offsets = _load_cache(LOG_OFFSETS_PATH)
+        offsets[world_name] = { 'inode': inode, 'offset': int(size) }
+        _save_cache(LOG_OFFSETS_PATH, offsets)
+    if state['offset'] < 0:
+        return transferred, min(int(size), LOG_INITIAL_BYTES)
+    elif state['inode'] != inode or int(size) < state['offset']:
+        return transferred, int(size)
+    return transferred, int(size) - state['offset']
+
+def list_server():
+    all_droplets = _get_manager().get_all_droplets()
+    _refresh_droplet_index(all_droplets)
+    return all_droplets
+
+def create_server(world_name='', version='', profile=''):
+    if profile != '' and profile not in PERFORMANCE_PROFILES:
+        return _emoji(':no_good: Unknown performance profile: {}'.format(profile))
+    droplet, slot = _find_world(world_name)
+    if droplet is not None:
+        return _emoji(':thinking_face: That world is running already: `{}:{}`'.format(_get_ip_address_of_droplet(droplet), slot['port']))
+    # github checks and key loading overlap with droplet boot; timings show the critical path
+    timings = collections.OrderedDict()
+    started = time.time()
+    # failures destroy the droplet only if this call created it: _create_droplet hands back a droplet
+    # of that name which came up meanwhile as it is, without the actions of a creation
+    created = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        snapshot_future = executor.submit(_timed_call, timings, 'snapshot lookup', _find_base_snapshot)
+        repository_future = executor.submit(_timed_call, timings, 'github checks', _inspect_world_repository, world_name)
+        keys_future = executor.submit(_timed_call, timings, 'ssh keys', _get_ssh_keys)
+
+        def boot():
+            base_snapshot = snapshot_future.result()
+            private_key, public_key = keys_future.result()
+            droplet = _timed_call(timings, 'droplet create', _create_droplet, public_key, world_name, base_snapshot)
+            if len(droplet.action_ids) > 0:
+                created.append(droplet)
+            print('Droplet has created. Waiting for boot...')
+            ip_address = _timed_call(timings, 'droplet active', _get_ip_address_of_droplet, droplet)
+            _update_droplet_index(droplet)
+            _timed_call(timings, 'ssh port open', _wait_for_port, ip_address, SSH_PORT, SSH_READY_TIMEOUT)
+            client = _timed_call(timings, 'ssh connect', _get_ssh_client, ip_address, private_key)
+            host_size = _timed_call(timings, 'host size', _read_host_size, client)
+            return ip_address, client, host_size
+        boot_future = executor.submit(boot)
 
+        try:
+            backup_url, last_version, last_profile = repository_future.result()
+            version = _resolve_version(version, last_version)
+            if profile == '':
+                profile = last_profile if last_profile in PERFORMANCE_PROFILES else PERFORMANCE_PROFILE
+        except Exception as e:
+            message = _emoji(':no_good: Exit: {}'.format(e))
+            boot_future.result()
+            if len(created) > 0:
+                print(_emoji(':muscle: Destroying server...'))
+                destroy_server(world_name)
+            return message
+
+        ip_address, client, host_size = boot_future.result()
+        stages = _construct_droplet_docker_commands(backup_url, version, snapshot_future.result(), profile, host_size)
+
+    print('Run minecraft...')
+    for i, stage in enumerate(stages):
+        status = _timed_call(timings, 'remote stage {}'.format(i + 1), _exec_commands, client, stage, parallel=len(stage) > 1)
+        if status != 0:
+            break
+
+    server_status = None
     if status == 0:
+        # docker run returns long before the server accepts players
+        try:
+            server_status = _timed_call(timings, 'minecraft ready', _wait_for_minecraft, ip_address, MINECRAFT_READY_TIMEOUT)
+        except Exception as e:
+            print(_emoji(':no_good: Error: {}'.format(e)))
+    _print_timings(timings, started)
+
+    if status == 0 and server_status is None:
+        message = _emoji(':thinking_face: Created minecraft {} instance but it does not answer yet: `{}`'.format(version, ip_address))
+    elif status == 0:
         print('Minecraft has waked up!')
-        message = _emoji(':hammer_and_pick: Created minecraft {} instance: `{}`'.format(version, ip_address))
+        message = _emoji(':hammer_and_pick: Created minecraft {} instance ({}): `{}`'.format(server_status['version']['name'], profile, ip_address))
+    elif len(created) == 0:
+        print('Minecraft couldn\'t wake up!')
+        message = _emoji(':cry: Failed to create server on the droplet which was running already: `{}`'.format(ip_address))
     else:
         print('Minecraft couldn\'t wake up!')
         print(_emoji(':muscle: Destroying server...'))
         message = _emoji(':cry: Failed to create server...')
         try:
-            destroy_server()
+            destroy_server(world_name)
         except Exception as e:
             print(_emoji(':no_good: Error: {}'.format(e)))
             print(_emoji(':cry: Please destroy this server yourself...'))
 
     return message
 
-def _construct_droplet_docker_commands(world_name, version):
-    backup_url = _construct_github_url(world_name)
-    version_url = _construct_github_url(world_name, path='master/MCCTL_VERSION.txt', is_raw=True)
-    commands = [
-        'apt install -y git'
-    ]
-
-    if _test_github_url(backup_url) == True:
-        commands.append('git clone {} /root/data'.format(backup_url))
+_pack_placement_lock = threading.Lock()
+
+def pack_world(world_name='', version='', profile=''):
+    # like create, but onto the shared droplet which fits the world best by measured memory and vCPUs,
+    # in a container, data dir and port of its own; a new shared droplet is created when none fits
+    if profile != '' and profile not in PERFORMANCE_PROFILES:
+        return _emoji(':no_good: Unknown performance profile: {}'.format(profile))
+    droplet, slot = _find_world(world_name)
+    if droplet is not None:
+        return _emoji(':thinking_face: That world is running already: `{}:{}`'.format(_get_ip_address_of_droplet(droplet), slot['port']))
+    timings = collections.OrderedDict()
+    started = time.time()
+    try:
+        backup_url, last_version, last_profile = _timed_call(timings, 'github checks', _inspect_world_repository, world_name)
+        version = _resolve_version(version, last_version)
+    except Exception as e:
+        return _emoji(':no_good: Exit: {}'.format(e))
+    if profile == '':
+        profile = last_profile if last_profile in PERFORMANCE_PROFILES else PERFORMANCE_PROFILE
+    private_key, public_key = _get_ssh_keys()
 
-        v = ''
+    # placement reads the ports and shared droplets in use, so it may not run alongside another until the container holds its port
+    with _pack_placement_lock:
+        packs = _timed_call(timings, 'measure packs', _measure_packs)
+        pack = _place_world(packs, PACK_WORLD_MEMORY, PACK_WORLD_CPUS)
+        if pack is None:
+            names = set(p['droplet'].name for p in packs)
+            name = next('pack-{}'.format(i) for i in itertools.count(1) if '{}{}'.format(PACK_DROPLET_PREFIX, i) not in names)
+            base_snapshot = _timed_call(timings, 'snapshot lookup', _find_base_snapshot)
+            droplet = _timed_call(timings, 'droplet create', _create_droplet, public_key, name, base_snapshot, PACK_DROPLET_SIZE)
+            print('Shared droplet minecraft-{} has created. Waiting for boot...'.format(name))
+            try:
+                ip_address = _timed_call(timings, 'droplet active', _get_ip_address_of_droplet, droplet)
+                _update_droplet_index(droplet)
+                _timed_call(timings, 'ssh port open', _wait_for_port, ip_address, SSH_PORT, SSH_READY_TIMEOUT)
+                client = _timed_call(timings, 'ssh connect', _get_ssh_client, ip_address, private_key)
+                cpus, _ = _timed_call(timings, 'host size', _read_host_size, client)
+            except Exception as e:
+                print(_emoji(':no_good: Error: {}'.format(e)))
+                _print_timings(timings, started)
+                # a droplet of that name which came up meanwhile is handed back without the actions of a creation, and kept
+                if len(droplet.action_ids) > 0:
+                    print(_emoji(':muscle: Destroying server...'))
+                    _invalidate_droplet_index(droplet.name)
+                    if droplet.ip_address is not None:
+                        _close_ssh_client(droplet.ip_address)
+                    droplet.destroy()
+                return _emoji(':cry: Failed to boot the shared droplet minecraft-{}'.format(name))
+            pack = { 'droplet': droplet, 'slots': {}, 'cpus': cpus }
+        else:
+            base_snapshot = None
+            ip_address = pack['droplet'].ip_address
+            client = _get_ssh_client(ip_address, private_key)
+            print('Packing onto {} ({} worlds)'.format(pack['droplet'].name, len(pack['slots'])))
+
+        ports = set(s['port'] for s in pack['slots'].values())
+        slot = _packed_slot(world_name, next(p for p in itertools.count(MINECRAFT_PORT) if p not in ports))
+        # the profile sizes the world to a host of its share of the memory, with every vCPU to burst on
+        stages = _construct_droplet_docker_commands(backup_url, version, base_snapshot, profile, (pack['cpus'], PACK_WORLD_MEMORY), slot, host_ready=len(pack['slots']) > 0)
+
+        print('Run minecraft...')
+        for i, stage in enumerate(stages):
+            status = _timed_call(timings, 'remote stage {}'.format(i + 1), _exec_commands, client, stage, parallel=len(stage) > 1)
+            if status != 0:
+                break
+        if status == 0:
+            _update_pack_index(world_name, pack['droplet'], slot)
+
+    server_status = None
+    if status == 0:
         try:
-            with urllib.request.urlopen(urllib.request.Request(version_url)) as res:
-                v = res.read().decode('utf-8')
-        except urllib.request.URLError as e:
-            print(_emoji(':information: MCCTL_VERSION.txt may not exists: {}'.format(e)))
-        if v != '':
-            if version == '':
-                version = v
-            else:
-                if _yes_no_input('Last run version is {}. Run version {} now?'.format(v, version)) == False:
-                    raise Exception('Disagreed with version setting')
+            server_status = _timed_call(timings, 'minecraft ready', _wait_for_minecraft, ip_address, MINECRAFT_READY_TIMEOUT, slot['port'])
+        except Exception as e:
+            print(_emoji(':no_good: Error: {}'.format(e)))
+    _print_timings(timings, started)
+
+    if status == 0 and server_status is None:
+        return _emoji(':thinking_face: Packed minecraft {} instance but it does not answer yet: `{}:{}`'.format(version, ip_address, slot['port']))
+    elif status == 0:
+        return _emoji(':package: Packed minecraft {} instance ({}) onto {}: `{}:{}`'.format(server_status['version']['name'], profile, pack['droplet'].name, ip_address, slot['port']))
+    print(_emoji(':muscle: Removing the world...'))
+    _exec_commands(client, [ 'docker rm -f {}; rm -rf {}'.format(slot['container'], slot['data_dir']) ])
+    if len(pack['slots']) == 0:
+        print(_emoji(':muscle: Destroying server...'))
+        _invalidate_droplet_index(pack['droplet'].name)
+        _close_ssh_client(ip_address)
+        pack['droplet'].destroy()
+    return _emoji(':cry: Failed to pack server...')
+
+def _measure_packs():
+    # what every shared droplet has and what its containers take right now
+    packs = []
+    private_key, _ = _get_ssh_keys()
+    for droplet, slots in _list_packs():
+        if slots is None:
+            continue
+        status, output = _read_command_output(_get_ssh_client(droplet.ip_address, private_key), PACK_USAGE_COMMAND)
+        lines = output.splitlines()
+        if status != 0 or len(lines) == 0 or re.fullmatch(r'[0-9]+ [0-9]+', lines[0]) is None:
+            print(_emoji(':information: Failed to measure {}: {}'.format(droplet.name, output)))
+            continue
+        cpus, memory = [ int(v) for v in lines[0].split() ]
+        pack = { 'droplet': droplet, 'slots': slots, 'cpus': cpus, 'memory': memory, 'cpus_used': 0.0, 'memory_used': 0 }
+        # ex: 12.50% 700.1MiB / 768MiB
+        for stats in [ line.split() for line in lines[1:] ]:
+            if len(stats) >= 2:
+                pack['cpus_used'] += float(stats[0].rstrip('%')) / 100
+                pack['memory_used'] += _parse_size(stats[1])
+        print('{}: {} worlds, {:.2f}/{} vCPUs, {:.0f}/{:.0f} MiB'.format(droplet.name, len(slots), pack['cpus_used'], cpus, pack['memory_used'] / 1048576, memory / 1048576))
+        packs.append(pack)
+    return packs
+
+def _place_world(packs, memory, cpus):
+    # best fit: of the droplets with room for the world within PACK_FILL, the one left with the least memory,
+    # so droplets fill up before another one is needed
+    best = None
+    for pack in packs:
+        memory_left = pack['memory'] * PACK_FILL - pack['memory_used'] - memory
+        cpus_left = pack['cpus'] * PACK_FILL - pack['cpus_used'] - cpus
+        if memory_left >= 0 and cpus_left >= 0 and (best is None or memory_left < best[0]):
+            best = (memory_left, pack)
+    return best[1] if best is not None else None
+
+def _inspect_world_repository(world_name):
+    backup_url = _construct_github_url(world_name)
+    if _test_github_url(backup_url) == False:
+        return None, '', ''
+    return backup_url, _fetch_world_file(world_name, 'MCCTL_VERSION.txt'), _fetch_world_file(world_name, 'MCCTL_PROFILE.txt').strip()
+
+def _fetch_world_file(world_name, file_name):
+    url = _construct_github_url(world_name, path='master/{}'.format(file_name), is_raw=True)
+    try:
+        with _span('github', 'raw {}'.format(file_name)), urllib.request.urlopen(urllib.request.Request(url)) as res:
+            return res.read().decode('utf-8')
+    except urllib.request.URLError as e:
+        print(_emoji(':information: {} may not exists: {}'.format(file_name, e)))
+    return ''
+
+def _resolve_version(version, last_version):
+    if last_version != '':
+        if version == '':
+            version = last_version
+        else:
+            if _yes_no_input('Last run version is {}. Run version {} now?'.format(last_version, version)) == False:
+                raise Exception('Disagreed with version setting')
 
     if version == '':
         version = 'LATEST'
+    return version
+
+def _construct_droplet_docker_commands(backup_url, version, base_snapshot, profile, host_size, slot=DEDICATED_SLOT, host_ready=False):
+    # list of stages run one after another; the commands of a stage run in parallel;
+    # host_ready: git and the image are there already, ex: a shared droplet running other worlds
+    data_dir = slot['data_dir']
+    world_commands = []
+    if base_snapshot is None and not host_ready:
+        world_commands.append(INSTALL_GIT_COMMAND)
+    if backup_url is not None:
+        world_commands.append(_construct_clone_command(backup_url, data_dir))
+        world_commands.append('cd {} && if [ -d .chunkstore ]; then {}; fi'.format(data_dir, _remote_python_command(_restore_chunk_store, data_dir)))
+    if base_snapshot is not None or host_ready:
+        # the image skips downloading a server jar which is already in /data
+        world_commands.append('mkdir -p {1} && {{ cp -n /root/jars/{0}/*.jar {1}/ 2>/dev/null || true; }}'.format(version, data_dir))
+
+    setup_stage = []
+    if len(world_commands) > 0:
+        setup_stage.append(' && '.join(world_commands))
+    if not host_ready and (base_snapshot is None or base_snapshot.stale):
+        # the world is cloned while the image is pulled; a baked snapshot only pulls layers changed since baking
+        setup_stage.append('docker pull {}'.format(MINECRAFT_IMAGE))
+
+    run_stage = [ _construct_run_command(version, profile, host_size, slot) ]
+
+    return [ stage for stage in [ setup_stage, run_stage ] if len(stage) > 0 ]
+
+def _construct_run_command(version, profile, host_size, slot=DEDICATED_SLOT):
+    # the profile is recorded beside MCCTL_VERSION.txt, so a restore comes back with the same tuning
+    env, limits = _performance_settings(profile, *host_size)
+    options = ''.join(' -e {}={}'.format(name, shlex.quote(value)) for name, value in env.items())
+    options += ''.join(' --{} {}'.format(name, value) for name, value in limits.items())
+    if 'world' in slot:
+        options += ' --label mcctl.world={} --label mcctl.port={}'.format(shlex.quote(slot['world']), slot['port'])
+    return 'mkdir -p {0} && echo {1} > {0}/MCCTL_PROFILE.txt && docker run -d -v {0}:/data -e EULA=TRUE -e VERSION={2} -e WORLD=/data/world -e TZ=Asia/Tokyo{3} --name {4} -p {5}:25565 --restart always {6}'.format(
+        slot['data_dir'], profile, version, options, slot['container'], slot['port'], MINECRAFT_IMAGE)
+
+def _performance_settings(profile, cpus, memory_bytes):
+    # environment of the image and limits of the container on a host with cpus and memory_bytes
+    if profile not in PERFORMANCE_PROFILES:
+        raise Exception('Unknown performance profile: {}'.format(profile))
+    tuning = PERFORMANCE_PROFILES[profile]
+    env = collections.OrderedDict()
+    limits = collections.OrderedDict()
+    if tuning is None:
+        return env, limits
+
+    memory_mb = memory_bytes // 1048576
+    heap_mb = max(512, int(memory_mb * tuning['heap']) // 256 * 256)
+    env['MEMORY'] = '{}M'.format(heap_mb)
+    # Aikar's flags expect the whole heap committed up front; a lean server grows into it
+    if tuning['gc'] == 'aikar':
+        env['INIT_MEMORY'] = '{}M'.format(heap_mb)
+        env['USE_AIKAR_FLAGS'] = 'true'
+    else:
+        env['INIT_MEMORY'] = '{}M'.format(max(256, heap_mb // 2))
+        env['JVM_XX_OPTS'] = '-XX:+UseSerialGC'
+    for name in [ 'view_distance', 'simulation_distance' ]:
+        base, per_cpu, cap = tuning[name]
+        env[name.upper()] = str(min(cap, base + per_cpu * cpus))
+    # besides the heap the JVM needs metaspace, thread stacks and direct buffers; the rest stays with the OS
+    limits['memory'] = '{}m'.format(max(heap_mb + 256, min(memory_mb - 256, heap_mb * 5 // 4 + 256)))
+    limits['cpus'] = '{:g}'.format(max(1, cpus * tuning['cpus']))
+    return env, limits
+
+def _read_host_size(client):
+    # what docker sees of the droplet, like test_mc.py reads it from the local docker
+    status, output = _read_command_output(client, "docker info --format '{{.NCPU}} {{.MemTotal}}'")
+    if status != 0 or re.fullmatch(r'[0-9]+ [0-9]+', output) is None:
+        raise Exception('Failed to read the size of the host: {}'.format(output))
+    cpus, memory_bytes = output.split()
+    return int(cpus), int(memory_bytes)
+
+def _read_world_profile(client):
+    status, profile = _read_command_output(client, 'cat /root/data/MCCTL_PROFILE.txt')
+    return profile if status == 0 and profile in PERFORMANCE_PROFILES else PERFORMANCE_PROFILE
+
+def _read_command_output(client, command):
+    stream = _stream_command(client, command)
+    for _ in stream:
+        pass
+    return stream.status, stream.output().strip()
+
+def _timed_call(timings, name, func, *args, **kwargs):
+    started = time.time()
+    try:
+        with _span('phase', name):
+            return func(*args, **kwargs)
+    finally:
+        timings[name] = (started, time.time())
+
+def _print_timings(timings, origin):
+    print('[[Timings]] total: {:.1f}s'.format(time.time() - origin))
+    for name, (started, finished) in sorted(timings.items(), key=lambda item: item[1][0]):
+        print('  {:<16} {:7.1f}s -> {:7.1f}s  ({:.1f}s)'.format(name, started - origin, finished - origin, finished - started))
+
+
+def _construct_clone_command(backup_url, data_dir, restore_mode=RESTORE_MODE):
+    if restore_mode not in RESTORE_CLONE_OPTIONS:
+        raise Exception('Unknown restore mode: {}'.format(restore_mode))
+    # a shallow checkout can still push later backups since they only add commits on top of its tip
+    return ' && '.join([
+        'start=$(date +%s.%N)',
+        'git clone {} {} {}'.format(RESTORE_CLONE_OPTIONS[restore_mode], backup_url, data_dir),
+        'end=$(date +%s.%N)',
+        'size=$(du -sb {} | cut -f1)'.format(data_dir),
+        'awk -v s=$start -v e=$end -v b=$size \'BEGIN {{ printf "Restored {} clone: %.1f MiB in %.1fs (%.1f MiB/s)\\n", b / 1048576, e - s, b / 1048576 / (e - s) }}\''.format(restore_mode)
+    ])
 
-    commands.append('docker run -d -v /root/data:/data -e EULA=TRUE -e VERSION={} -e WORLD=/data/world -e TZ=Asia/Tokyo --name minecraft -p 25565:25565 --restart always itzg/minecraft-server'.format(version))
-
-    return commands, version
-
-
-def backup_world(world_name=''):
+def backup_world(world_name='', backup_format=BACKUP_FORMAT, backup_mode=BACKUP_MODE):
+    if backup_format not in [ 'git', 'chunks' ]:
+        return _emoji(':no_good: Unknown backup format: {}'.format(backup_format))
+    if backup_mode not in [ 'cold', 'hot' ]:
+        return _emoji(':no_good: Unknown backup mode: {}'.format(backup_mode))
     backup_url = _construct_github_url(world_name)
     output_url = '{}/{}'.format(GITHUB_URL, world_name)
     if _test_github_url(backup_url) == False:
         return _emoji(':thinking_face: Unavailable repository: {}'.format(output_url))
 
-    manager = digitalocean.Manager(token=DIGITALOCEAN_API_TOKEN)
-    all_droplets = manager.get_all_droplets()
-    target = filter(lambda droplet: droplet.name == 'minecraft-{}'.format(world_name), all_droplets)
-    if len(target) == 0:
-        target = filter(lambda droplet: droplet.name == 'minecraft-', all_droplets)
-        if len(target) == 0:
+    droplet, slot = _find_world(world_name)
+    if droplet is None:
+        droplet, slot = _find_droplet(''), DEDICATED_SLOT
+        if droplet is None:
             return _emoji(':thinking_face: That world is not running')
         elif _yes_no_input('Overwrite {} with running new minecraft world?'.format(output_url)) == False:
             return _emoji(':raised_hand: Cannceled overwriting {} with running new minecraft world'.format(output_url))
-    droplet = target[0]
-
-    private_key = _get_ssh_keys()
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
+    private_key, _ = _get_ssh_keys()
     ip_address = _get_ip_address_of_droplet(droplet)
-    _ssh_connect(client, hostname=ip_address, username='root', pkey=private_key)
+    client = _get_ssh_client(ip_address, private_key)
+    data_dir = slot['data_dir']
 
+    # every command runs in its own channel, so each one has to cd by itself
     status = _exec_commands(client, [
-        'cd /root/data',
-        '[ -d .git ] || git init && git remote add origin {} && git config branch.master.remote origin && git config branch.master.merge refs/heads/master'.format(backup_url),
-        r'find /root/data -maxdepth 1 -name *.jar -print0 -quit | sed -e "s,^.*/[^.]*\.\([0-9.]*\)\.jar\x0$,\1," > MCCTL_VERSION.txt'
-        '[ -f .gitignore ] || echo "/minecraft_server*.jar" > .gitignore',
-        'git add --all',
-        'git commit -m "world `cat MCCTL_VERSION.txt` update [{}]"'.format(version, datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9))).strftime('%Y/%m/%d %H:%M:%S%z')),
-        'git push'
+        'cd {} && {{ [ -d .git ] || {{ git init && git remote add origin {} && git config branch.master.remote origin && git config branch.master.merge refs/heads/master; }}; }}'.format(data_dir, backup_url),
+        r'cd {0} && find {0} -maxdepth 1 -name "*.jar" -print0 -quit | sed -e "s,^.*/[^.]*\.\([0-9.]*\)\.jar\x0$,\1," > MCCTL_VERSION.txt'.format(data_dir),
+        'cd {0} && {{ [ -f .gitignore ] || echo "/minecraft_server*.jar" > .gitignore; }} && {{ grep -qxF "{1}" .gitignore || echo "{1}" >> .gitignore; }}'.format(data_dir, BACKUP_IGNORE)
     ])
+    if status != 0:
+        return _emoji(':cry: Failed to backup')
 
-    if status == 0:
+    paused = None
+    if backup_mode == 'hot':
+        try:
+            status, paused = _snapshot_world(client, ip_address, private_key, slot)
+        except Exception as e:
+            # without a running server nothing writes the world, so the live files are consistent
+            print(_emoji(':information: Hot backup is unavailable, backing up the live world: {}'.format(e)))
+            backup_mode = 'cold'
+        if status != 0:
+            return _emoji(':cry: Failed to snapshot the world')
+    world_root = '{}/{}'.format(data_dir, BACKUP_SNAPSHOT_NAME) if backup_mode == 'hot' else data_dir
+    prefix = 'cd {} && {} && '.format(data_dir, BACKUP_LOW_PRIORITY) if backup_mode == 'hot' else 'cd {} && '.format(data_dir)
+
+    now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9)))
+    commit_command = 'git diff --cached --quiet || git -c user.name=mc_ctl -c user.email=mc_ctl@localhost commit -m "world `cat MCCTL_VERSION.txt` update [{}]"'.format(now.strftime('%Y/%m/%d %H:%M:%S%z'))
+    if backup_format == 'git':
+        # only world files whose content changed since the last backup are staged, from the snapshot when hot
+        backup_commands = [
+            prefix + _remote_python_command(_scan_world_changes, data_dir, '{}/.mcctl_'.format(data_dir), world_root),
+            prefix + 'cd {1} && xargs -0 -r git --git-dir={0}/.git --work-tree=. add -- < {0}/.mcctl_changed && cd {0} && xargs -0 -r git rm -q --cached --ignore-unmatch -- < .mcctl_deleted && git add --all -- . ":(exclude)world*"'.format(data_dir, world_root),
+            prefix + '{{ {}; }} && mv -f .mcctl_index.json.new .mcctl_index.json'.format(commit_command)
+        ]
+    else:
+        # world files themselves are not tracked, only the chunk objects and snapshot manifests;
+        # the index of git backups goes with them, so that the next git backup stages every world file again
+        backup_commands = [
+            prefix + _remote_python_command(_snapshot_chunk_store, data_dir, now.strftime('%Y%m%d-%H%M%S'), world_root),
+            prefix + 'git rm -r -q --cached --ignore-unmatch -- "world*" && rm -f .mcctl_index.json .mcctl_index.json.new && git add --all -- . ":(exclude)world*"',
+            prefix + commit_command
+        ]
+
+    status = _exec_commands(client, backup_commands + [
+        prefix + 'git push'
+    ])
+
+    if status == 0 and paused is not None:
+        message = _emoji(':rocket: Backuped world: {} (saving paused for {:.2f}s)'.format(output_url, paused))
+    elif status == 0:
         message = _emoji(':rocket: Backuped world: {}'.format(output_url))
     else:
         message = _emoji(':cry: Failed to backup')
 
     return message
 
+def _snapshot_world(client, ip_address, private_key, slot):
+    # the server writes nothing between save-all flush and save-on, so the copy is consistent;
+    # only the files changed since the previous snapshot are copied
+    rcon_client = _get_rcon_client(ip_address, private_key, slot)
+    started = time.time()
+    with _span('backup', 'saving paused') as attributes:
+        try:
+            rcon_client.commands([ 'save-off', 'save-all flush' ])
+            stream = _stream_command(client, _remote_python_command(_mirror_world_dirs, slot['data_dir'], '{}/{}'.format(slot['data_dir'], BACKUP_SNAPSHOT_NAME)))
+            for text in stream:
+                _print_output(text)
+        finally:
+            _resume_saving(rcon_client, ip_address, private_key, slot)
+            paused = time.time() - started
+            attributes['seconds'] = paused
+    print('Saving was paused for {:.2f}s'.format(paused))
+    return stream.status, paused
+
+def _resume_saving(rcon_client, ip_address, private_key, slot):
+    # save-off may have been applied before the pooled client broke; the server must not be left without saving
+    try:
+        rcon_client.command('save-on')
+        return
+    except Exception as e:
+        print(_emoji(':information: Retrying save-on on a new RCON connection: {}'.format(e)))
+    _close_rcon_client(ip_address, slot)
+    _get_rcon_client(ip_address, private_key, slot).command('save-on')
+
+def compact_backups(world_name='', retention=BACKUP_RETENTION, dry_run=False):
+    # the history of master is rewritten in a bare clone with commit-tree, keeping the trees of the retained
+    # snapshots, and pushed back only if no backup moved master meanwhile
+    rules = _parse_retention(retention)
+    backup_url = _construct_github_url(world_name)
+    output_url = '{}/{}'.format(GITHUB_URL, world_name)
+    if _test_github_url(backup_url) == False:
+        return _emoji(':thinking_face: Unavailable repository: {}'.format(output_url))
+
+    with tempfile.TemporaryDirectory(prefix='mcctl_compact_') as work_dir:
+        repo, clone_before = _timed_clone(backup_url, os.path.join(work_dir, 'before'))
+        size_before = _repository_size(repo)
+        print('Before: {:.1f} MiB cloned in {:.1f}s'.format(size_before / 1048576, clone_before))
+
+        snapshots = _list_snapshots(repo)
+        kept = _retained_snapshots(snapshots, rules, time.time())
+        print('Keeping {} of {} snapshots ({})'.format(len(kept), len(snapshots), retention))
+        if dry_run:
+            for snapshot in kept:
+                print('  {} {}'.format(snapshot['sha'][:10], snapshot['message'].splitlines()[0]))
+            return _emoji(':information: Dry run, {} was not changed'.format(output_url))
+        elif len(kept) == len(snapshots):
+            return _emoji(':ok_hand: Nothing to compact in {}'.format(output_url))
+
+        tip = _rewrite_snapshots(repo, kept)
+        repo.git.update_ref('refs/heads/master', tip, snapshots[0]['sha'])
+        repo.git.reflog('expire', '--expire=now', '--all')
+        _repack_repository(repo)
+        print('Compacted: {:.1f} MiB'.format(_repository_size(repo) / 1048576))
+        try:
+            repo.git.push('--force-with-lease=master:{}'.format(snapshots[0]['sha']), 'origin', 'master')
+        except git.GitCommandError as e:
+            return _emoji(':cry: Failed to push the compacted history, a backup may have been pushed meanwhile: {}'.format(e.stderr.strip()))
+
+        remote_path = _local_repository_path(backup_url)
+        if remote_path is not None:
+            # a repository on disk can be cleaned right away; GitHub drops the old snapshots at its own gc
+            remote = git.Repo(remote_path)
+            remote.git.reflog('expire', '--expire=now', '--all')
+            _repack_repository(remote)
+            remote.git.prune('--expire=now')
+
+        status = _reset_running_world(world_name)
+        after, clone_after = _timed_clone(backup_url, os.path.join(work_dir, 'after'))
+        size_after = _repository_size(after)
+        print('After: {:.1f} MiB cloned in {:.1f}s'.format(size_after / 1048576, clone_after))
+
+    message = _emoji(':broom: Compacted {}: {} -> {} snapshots, {:.1f} -> {:.1f} MiB, clone {:.1f}s -> {:.1f}s'.format(
+        output_url, len(snapshots), len(kept), size_before / 1048576, size_after / 1048576, clone_before, clone_after))
+    if status != 0:
+        message += '\n' + _emoji(':cry: Failed to move the running world onto the compacted history, its next backup will be rejected')
+    return message
+
+def _parse_retention(retention):
+    rules = []
+    for rule in retention.split(','):
+        bucket, _, count = rule.strip().partition(':')
+        if bucket not in RETENTION_BUCKETS:
+            raise Exception('Unknown retention bucket: {}'.format(bucket))
+        rules.append((bucket, int(count) if count != '' else 0))
+    return rules
+
+def _timed_clone(url, path):
+    started = time.time()
+    with _span('git', 'clone'):
+        repo = git.Repo.clone_from(url, path, bare=True)
+    return repo, time.time() - started
+
+def _repository_size(repo):
+    # "size" is loose objects, "size-pack" packs, both in KiB
+    counts = dict(line.split(': ', 1) for line in repo.git.count_objects('-v').splitlines())
+    return (int(counts['size']) + int(counts['size-pack'])) * 1024
+
+def _list_snapshots(repo):
+    # newest first; backups only ever commit on top of master, so its first parents are every snapshot
+    fields = [ 'sha', 'parent', 'tree', 'time', 'author_name', 'author_email', 'author_date', 'committer_name', 'committer_email', 'committer_date', 'message' ]
+    log = repo.git.log('--first-parent', '-z', '--date=raw', '--format=%H%x1f%P%x1f%T%x1f%ct%x1f%an%x1f%ae%x1f%ad%x1f%cn%x1f%ce%x1f%cd%x1f%B', 'master')
+    snapshots = []
+    for record in log.split('\0'):
+        if record.strip() == '':
+            continue
+        snapshot = dict(zip(fields, record.split('\x1f')))
+        snapshot['parent'] = snapshot['parent'].split(' ')[0]
+        snapshot['time'] = int(snapshot['time'])
+        snapshot['message'] = snapshot['message'].rstrip('\n')
+        snapshots.append(snapshot)
+    return snapshots
+
+def _retained_snapshots(snapshots, rules, now):
+    # buckets are taken on the clock backups name their commits with; the newest snapshot is always kept
+    timezone = datetime.timezone(datetime.timedelta(hours=9))
+    kept = []
+    buckets = set()
+    for i, snapshot in enumerate(snapshots):
+        key = None
+        for bucket, count in rules:
+            bucket_format, seconds = RETENTION_BUCKETS[bucket]
+            if count == 0 or now - snapshot['time'] < count * seconds:
+                key = (bucket, datetime.datetime.fromtimestamp(snapshot['time'], timezone).strftime(bucket_format))
+                break
+        if i == 0 or (key is not None and key not in buckets):
+            kept.append(snapshot)
+            buckets.add(key)
+    return kept
+
+def _rewrite_snapshots(repo, kept):
+    # oldest first; snapshots whose parent is unchanged keep their commit, so compacting again rewrites nothing
+    # older than the first dropped snapshot
+    parent = ''
+    for snapshot in reversed(kept):
+        if snapshot['parent'] == parent:
+            parent = snapshot['sha']
+            continue
+        env = {
+            'GIT_AUTHOR_NAME': snapshot['author_name'], 'GIT_AUTHOR_EMAIL': snapshot['author_email'], 'GIT_AUTHOR_DATE': snapshot['author_date'],
+            'GIT_COMMITTER_NAME': snapshot['committer_name'], 'GIT_COMMITTER_EMAIL': snapshot['committer_email'], 'GIT_COMMITTER_DATE': snapshot['committer_date']
+        }
+        parent_options = [ '-p', parent ] if parent != '' else []
+        parent = repo.git.commit_tree(snapshot['tree'], *parent_options, '-m', snapshot['message'], env=env)
+    return parent
+
+def _repack_repository(repo):
+    config = [ option for c in COMPACT_REPACK_CONFIG for option in [ '-c', c ] ]
+    with _span('git', 'repack'):
+        repo.git.execute([ 'git' ] + config + [ 'repack' ] + COMPACT_REPACK_OPTIONS)
+
+def _local_repository_path(url):
+    if url.startswith('file://'):
+        return str(furl.furl(url).path)
+    elif os.path.isdir(url):
+        return url
+    return None
+
+def _reset_running_world(world_name):
+    # the clone of a running world still has the old tip, whose tree is the new tip's; a soft reset onto the new tip
+    # keeps what is staged, so its next backup is a fast-forward again (a blobless or full clone becomes shallow)
+    droplet, slot = _find_world(world_name)
+    if droplet is None:
+        return 0
+    private_key, _ = _get_ssh_keys()
+    client = _get_ssh_client(_get_ip_address_of_droplet(droplet), private_key)
+    return _exec_commands(client, [
+        'cd {} && {{ [ ! -d .git ] || {{ git fetch -q --depth 1 origin master && git reset -q --soft FETCH_HEAD; }}; }}'.format(slot['data_dir'])
+    ])
+
 def destroy_server(world_name=''):
-    manager = digitalocean.Manager(token=DIGITALOCEAN_API_TOKEN)
-    all_droplets = manager.get_all_droplets()
-    target = filter(lambda droplet: droplet.name == 'minecraft-{}'.format(world_name), all_droplets)
-    if len(target) == 0:
+    droplet, slot = _find_world(world_name)
+    if droplet is None:
         message = _emoji(':thinking_face: That world is not running')
         return message
-    droplet = target[0]
 
     ip_address = _get_ip_address_of_droplet(droplet)
+    _close_rcon_client(ip_address, slot)
+    if 'world' in slot:
+        # a world packed onto a shared droplet takes only its container and data dir along;
+        # the droplet goes with its last world
+        private_key, _ = _get_ssh_keys()
+        client = _get_ssh_client(ip_address, private_key)
+        status = _exec_commands(client, [ 'docker rm -f {} && rm -rf {}'.format(slot['container'], slot['data_dir']) ])
+        _invalidate_pack_index(world_name)
+        if status != 0:
+            return _emoji(':cry: Failed to destroy {} on `{}`'.format(slot['container'], ip_address))
+        status, worlds = _read_command_output(client, PACK_LIST_COMMAND)
+        if status != 0 or worlds != '':
+            return _emoji(':boom: Destroyed instance: `{}` on `{}:{}`'.format(slot['container'], ip_address, slot['port']))
+    _close_ssh_client(ip_address)
+    _invalidate_droplet_index(droplet.name)
     droplet.destroy()
 
     message = _emoji(':boom: Destroyed instance: `{}`'.format(ip_address))
     return message
 
-def do_commands(world_name='', commands=[]):
-    manager = digitalocean.Manager(token=DIGITALOCEAN_API_TOKEN)
-    all_droplets = manager.get_all_droplets()
-    target = filter(lambda droplet: droplet.name == 'minecraft-{}'.format(world_name), all_droplets)
-    if len(target) == 0:
+def migrate_world(world_name='', size_slug=DROPLET_SIZE, region=DROPLET_REGION):
+    # the old droplet sends the world straight to the new one; players are only cut off
+    # from stopping the old server until the new one answers pings
+    source = _find_droplet(world_name)
+    if source is None:
+        return _emoji(':thinking_face: That world is not running')
+
+    timings = collections.OrderedDict()
+    started = time.time()
+    private_key, public_key = _get_ssh_keys()
+    source_ip = _get_ip_address_of_droplet(source)
+    source_client = _get_ssh_client(source_ip, private_key)
+    version = _read_world_version(source_client)
+    profile = _read_world_profile(source_client)
+    base_snapshot = _timed_call(timings, 'snapshot lookup', _find_base_snapshot, region)
+    # a rerun after an interruption finds the droplet of the previous run and only sends what it lacks
+    target = _timed_call(timings, 'droplet create', _create_droplet, public_key, world_name + MIGRATION_SUFFIX, base_snapshot, size_slug, region)
+    print('Droplet has created. Waiting for boot...')
+    target_ip = _timed_call(timings, 'droplet active', _get_ip_address_of_droplet, target)
+    _update_droplet_index(target)
+
+    def abort(message):
+        print(_emoji(':muscle: Destroying the new droplet...'))
+        _close_ssh_client(target_ip)
+        _invalidate_droplet_index(target.name)
+        target.destroy()
+        _print_timings(timings, started)
+        return message
+
+    try:
+        target_client = _timed_call(timings, 'ssh connect', _get_ssh_client, target_ip, private_key)
+        # the tuning of the world follows it to the new size
+        stages = _construct_droplet_docker_commands(None, version, base_snapshot, profile, _read_host_size(target_client))
+        _timed_call(timings, 'key exchange', _authorize_migration_key, source_client, target_client)
+        def setup():
+            for stage in stages[:-1]:
+                status = _exec_commands(target_client, stage, parallel=len(stage) > 1)
+                if status != 0:
+                    return status
+            return 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            # the image is pulled on the new droplet while the world is copied to it
+            setup_future = executor.submit(_timed_call, timings, 'target setup', setup)
+            sent_bytes = _timed_call(timings, 'bulk copy', _copy_data_dir, source_ip, private_key, target_ip, True)
+            if setup_future.result() != 0:
+                raise Exception('Failed to set up the new droplet')
+    except Exception as e:
+        print(_emoji(':no_good: Error: {}'.format(e)))
+        return abort(_emoji(':cry: Failed to migrate, the world keeps running on `{}`'.format(source_ip)))
+
+    # the old server saves the world when it stops; what changed since the bulk copy goes in the final copy
+    downtime_started = time.time()
+    try:
+        if _timed_call(timings, 'source stop', _exec_commands, source_client, [ 'docker stop minecraft' ]) != 0:
+            raise Exception('Failed to stop the old server')
+        sent_bytes += _timed_call(timings, 'final copy', _copy_data_dir, source_ip, private_key, target_ip, False)
+        if _timed_call(timings, 'target run', _exec_commands, target_client, stages[-1]) != 0:
+            raise Exception('Failed to start the new server')
+        server_status = _timed_call(timings, 'minecraft ready', _wait_for_minecraft, target_ip, MINECRAFT_READY_TIMEOUT)
+    except Exception as e:
+        print(_emoji(':no_good: Error: {}'.format(e)))
+        print(_emoji(':muscle: Restarting the old server...'))
+        _exec_commands(_get_ssh_client(source_ip, private_key), [ 'docker start minecraft' ])
+        return abort(_emoji(':cry: Failed to migrate, the world keeps running on `{}`'.format(source_ip)))
+    downtime = time.time() - downtime_started
+
+    # switch over: the new droplet takes the name of the old one, which is not needed anymore
+    _exec_commands(target_client, [ 'sed -i "/ {}$/d" /root/.ssh/authorized_keys'.format(MIGRATION_KEY_COMMENT) ], ignore_error=True)
+    droplet_name = 'minecraft-{}'.format(world_name)
+    _close_rcon_client(source_ip)
+    _close_ssh_client(source_ip)
+    _invalidate_droplet_index(droplet_name)
+    source.destroy()
+    try:
+        target.rename(droplet_name)
+        _invalidate_droplet_index(target.name)
+        target.name = droplet_name
+        _update_droplet_index(target)
+    except Exception as e:
+        print(_emoji(':information: Failed to rename {} to {}: {}'.format(target.name, droplet_name, e)))
+    _print_timings(timings, started)
+
+    return _emoji(':truck: Migrated minecraft {} instance to {} in {}: `{}` (down for {:.1f}s, {:.1f} MiB transferred)'.format(
+        server_status['version']['name'], size_slug, region, target_ip, downtime, sent_bytes / 1048576))
+
+def _read_world_version(client):
+    # the version of the server jar in the world, so the new droplet does not upgrade it on the way
+    status, version = _read_command_output(client, r'find /root/data -maxdepth 1 -name "*.jar" -print0 -quit | sed -e "s,^.*/[^.]*\.\([0-9.]*\)\.jar\x0$,\1,"')
+    if status != 0 or re.fullmatch(r'[0-9.]+', version) is None:
+        return 'LATEST'
+    return version
+
+def _authorize_migration_key(source_client, target_client):
+    # the old droplet logs in to the new one by itself, so the world does not pass through this machine
+    status, public_key = _read_command_output(source_client, 'mkdir -p -m 700 /root/.ssh && {{ [ -f {0} ] || ssh-keygen -q -t ed25519 -N "" -C {1} -f {0}; }} && cat {0}.pub'.format(MIGRATION_KEY_PATH, MIGRATION_KEY_COMMENT))
+    if status != 0 or not public_key.endswith(' ' + MIGRATION_KEY_COMMENT):
+        raise Exception('Failed to create the migration key: {}'.format(public_key))
+    status = _exec_commands(target_client, [
+        'mkdir -p -m 700 /root/.ssh && {{ grep -qxF {0} /root/.ssh/authorized_keys 2>/dev/null || echo {0} >> /root/.ssh/authorized_keys; }}'.format(shlex.quote(public_key))
+    ])
+    if status != 0:
+        raise Exception('Failed to authorize the migration key')
+
+def _copy_data_dir(source_ip, private_key, target_ip, live):
+    # every attempt only sends what the target still lacks, so a dropped connection resumes the copy
+    last_error = None
+    for attempt in range(MIGRATION_ATTEMPTS):
+        try:
+            stream = _stream_command(_get_ssh_client(source_ip, private_key), _remote_python_command(_send_data_dir, '/root/data', target_ip, SSH_PORT, MIGRATION_KEY_PATH, MIGRATION_EXCLUDES, live))
+            for text in stream:
+                _print_output(text)
+            sent = re.search(r' (\d+) bytes of gzip ', stream.output())
+            if stream.status == 0 and sent is not None:
+                return int(sent.group(1))
+            last_error = 'status {}'.format(stream.status)
+        except (EOFError, OSError, paramiko.SSHException) as e:
+            _close_ssh_client(source_ip)
+            last_error = e
+        print(_emoji(':information: Copy attempt {} failed ({}), resuming...'.format(attempt + 1, last_error)))
+    raise Exception('Failed to copy the world after {} attempts: {}'.format(MIGRATION_ATTEMPTS, last_error))
+
+def resize_server(world_name='', size_slug=DROPLET_SIZE):
+    # the droplet keeps its address; its disk is not resized, so it can be resized back down later
+    droplet = _find_droplet(world_name, use_index=False)
+    if droplet is None:
         return _emoji(':thinking_face: That world is not running')
-    droplet = target[0]
+    old_size_slug = droplet.size_slug
+    if old_size_slug == size_slug:
+        return _emoji(':information: {} already runs on {}'.format(world_name, size_slug))
+
+    message = backup_world(world_name)
+    print(message)
+    if _is_failure_message(message):
+        return _emoji(':cry: Failed to backup, not resizing')
+
+    timings = collections.OrderedDict()
+    started = time.time()
+    private_key, _ = _get_ssh_keys()
+    ip_address = _get_ip_address_of_droplet(droplet)
+    # the server saves the world when it stops, before the droplet shuts down
+    if _timed_call(timings, 'server stop', _exec_commands, _get_ssh_client(ip_address, private_key), [ 'docker stop minecraft' ]) != 0:
+        return _emoji(':cry: Failed to stop the server')
+    _close_rcon_client(ip_address)
+    _close_ssh_client(ip_address)
+    try:
+        try:
+            _timed_call(timings, 'shutdown', _wait_for_action, droplet.shutdown(return_dict=False).id, DROPLET_READY_TIMEOUT)
+            _timed_call(timings, 'resize', _wait_for_action, droplet.resize(size_slug, return_dict=False, disk=False).id, RESIZE_TIMEOUT)
+        finally:
+            # a failed resize leaves the droplet at its old size, which has to come back up as well
+            _timed_call(timings, 'power on', _wait_for_action, droplet.power_on(return_dict=False).id, DROPLET_READY_TIMEOUT)
+            client = _timed_call(timings, 'ssh connect', _get_ssh_client, ip_address, private_key)
+            # the container is created again, so the heap and limits of its profile follow the new size;
+            # it came back up with the droplet, so it is stopped first to save the world instead of being killed
+            run_command = _construct_run_command(_read_world_version(client), _read_world_profile(client), _read_host_size(client))
+            if _timed_call(timings, 'server start', _exec_commands, client, [ 'docker stop minecraft', 'docker rm -f minecraft', run_command ]) != 0:
+                raise Exception('Failed to start the server')
+        server_status = _timed_call(timings, 'minecraft ready', _wait_for_minecraft, ip_address, MINECRAFT_READY_TIMEOUT)
+    except Exception as e:
+        print(_emoji(':no_good: Error: {}'.format(e)))
+        _print_timings(timings, started)
+        return _emoji(':cry: Failed to resize {} from {} to {}'.format(world_name, old_size_slug, size_slug))
+    _print_timings(timings, started)
 
-    private_key = _get_ssh_keys()
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    return _emoji(':arrow_up_down: Resized minecraft {} instance from {} to {}: `{}` (down for {:.1f}s)'.format(
+        server_status['version']['name'], old_size_slug, size_slug, ip_address, time.time() - started))
 
+def restart_server(world_name=''):
+    droplet, slot = _find_world(world_name)
+    if droplet is None:
+        return _emoji(':thinking_face: That world is not running')
+
+    private_key, _ = _get_ssh_keys()
     ip_address = _get_ip_address_of_droplet(droplet)
-    _ssh_connect(client, hostname=ip_address, username='root', pkey=private_key)
+    status = _exec_commands(_get_ssh_client(ip_address, private_key), [ 'docker restart {}'.format(slot['container']) ])
+    _close_rcon_client(ip_address, slot)
+
+    if status != 0:
+        return _emoji(':cry: Failed to restart {}'.format(slot['container']))
+    return _emoji(':thumbs_up: Restarted instance: `{}` on `{}:{}`'.format(slot['container'], ip_address, slot['port']))
 
-    status = _exec_commands(client, commands)
+def do_commands(world_name='', commands=[], parallel=False):
+    droplet = _find_droplet(world_name)
+    if droplet is None:
+        return _emoji(':thinking_face: That world is not running')
+
+    private_key, _ = _get_ssh_keys()
+    ip_address = _get_ip_address_of_droplet(droplet)
+    client = _get_ssh_client(ip_address, private_key)
+
+    status = _exec_commands(client, commands, parallel=parallel)
 
     if status == 0:
         message = _emoji(':thumbs_up: Commands succeeded!')
@@ -269,83 +2020,1236 @@ def do_commands(world_name='', commands=[]):
 
     return message
 
+def rcon(world_name='', command=''):
+    commands = [ c for c in command.splitlines() if c.strip() != '' ]
+    droplet, slot = _find_world(world_name)
+    if droplet is None:
+        return _emoji(':thinking_face: That world is not running')
 
+    private_key, _ = _get_ssh_keys()
+    ip_address = _get_ip_address_of_droplet(droplet)
+    for i in range(0, len(commands), 64):
+        batch = commands[i:i + 64]
+        try:
+            responses = _get_rcon_client(ip_address, private_key, slot).commands(batch)
+        except (EOFError, OSError, paramiko.SSHException):
+            # the server may have restarted since the connection was opened
+            _close_rcon_client(ip_address, slot)
+            responses = _get_rcon_client(ip_address, private_key, slot).commands(batch)
+        for c, response in zip(batch, responses):
+            print('[[{}]]'.format(c))
+            print(response)
+
+    return _emoji(':thumbs_up: {} rcon commands succeeded!'.format(len(commands)))
+
+
+def analyze_regions(world_name='', mode='report', min_inhabited_seconds='60'):
+    if mode not in [ 'report', 'prune' ]:
+        return _emoji(':no_good: Unknown regions mode: {}'.format(mode))
+    droplet = _find_droplet(world_name)
+    if droplet is None:
+        return _emoji(':thinking_face: That world is not running')
+    private_key, _ = _get_ssh_keys()
+    ip_address = _get_ip_address_of_droplet(droplet)
+    client = _get_ssh_client(ip_address, private_key)
+
+    # InhabitedTime counts ticks, 20 a second
+    command = 'cd /root/data && {} && {}'.format(BACKUP_LOW_PRIORITY, _remote_python_command(_analyze_regions, '/root/data', mode, int(float(min_inhabited_seconds) * 20)))
+    if mode == 'prune':
+        # the server must not write regions while they are rewritten; it saves them when it stops
+        if _exec_commands(client, [ 'docker stop minecraft' ]) != 0:
+            return _emoji(':cry: Failed to stop the server')
+    try:
+        stream = _stream_command(client, command)
+        for text in stream:
+            _print_output(text)
+    finally:
+        if mode == 'prune':
+            _exec_commands(client, [ 'docker start minecraft' ])
+
+    if stream.status != 0:
+        return _emoji(':cry: Failed to analyze regions')
+    elif mode == 'prune':
+        return _emoji(':scissors: Pruned regions of {}, the next backup commits them'.format(world_name))
+    return _emoji(':mag: Analyzed regions of {}'.format(world_name))
+
+def pregen_world(world_name='', radius='', center=''):
+    # chunks are generated by force loading squares of them for a while over RCON; how many squares
+    # are loaded at once follows the tick times of the server (see _pregen_throttle)
+    droplet = _find_droplet(world_name)
+    if droplet is None:
+        return _emoji(':thinking_face: That world is not running')
+    private_key, _ = _get_ssh_keys()
+    ip_address = _get_ip_address_of_droplet(droplet)
 
+    def commands(batch):
+        try:
+            return _get_rcon_client(ip_address, private_key).commands(batch)
+        except (EOFError, OSError, paramiko.SSHException):
+            # the server may be restarting; forced chunks survive that, so the job goes on where it was
+            _close_rcon_client(ip_address)
+            print(_emoji(':information: Lost RCON connection, waiting for the server...'))
+            _wait_for_minecraft(ip_address, MINECRAFT_READY_TIMEOUT)
+            return _get_rcon_client(ip_address, private_key).commands(batch)
+
+    checkpoints = _load_cache(PREGEN_CHECKPOINT_PATH)
+    job = checkpoints.get(world_name)
+    if radius == '' and job is None:
+        return _emoji(':thinking_face: No pre-generation of {} to resume'.format(world_name))
+    if radius != '':
+        if radius == 'border':
+            # ex: The world border is currently 2000 blocks wide
+            width = re.search(r'([0-9]+) block', commands([ 'worldborder get' ])[0])
+            if width is None:
+                return _emoji(':no_good: Failed to read the world border')
+            radius = int(width.group(1)) // 2
+        center_x, center_z = [ int(c) for c in (center if center != '' else '0,0').split(',') ]
+        if job is None or job['radius'] != int(radius) or job['center'] != [ center_x, center_z ]:
+            job = { 'radius': int(radius), 'center': [ center_x, center_z ], 'done': 0, 'loaded': [], 'chunks': 0 }
+    batches = _pregen_batches(job['center'][0], job['center'][1], job['radius'])
+    total_chunks = sum((x2 - x1 + 1) * (z2 - z1 + 1) for x1, z1, x2, z2 in batches)
+
+    def forceload(operation, index):
+        x1, z1, x2, z2 = batches[index]
+        return 'forceload {} {} {} {} {}'.format(operation, x1 * 16, z1 * 16, x2 * 16, z2 * 16)
+
+    # squares an interrupted run left loaded are released first
+    if len(job['loaded']) > 0:
+        commands([ forceload('remove', i) for i in job['loaded'] ])
+        job['loaded'] = []
+    print('Pre-generating {} chunks within {} blocks of {},{}, {} done'.format(total_chunks, job['radius'], job['center'][0], job['center'][1], job['chunks']))
+
+    window = 1
+    in_flight = collections.deque()
+    next_index = job['done']
+    baseline_ms = None
+    started = time.time()
+    resumed_chunks = job['chunks']
+    reported = started
+    with _span('pregen', world_name, radius=job['radius'], chunks=total_chunks):
+        while job['done'] < len(batches):
+            now = time.time()
+            released = []
+            while len(in_flight) > 0 and now - in_flight[0][1] >= PREGEN_HOLD:
+                released.append(in_flight.popleft()[0])
+            added = []
+            while len(in_flight) + len(added) < window and next_index < len(batches):
+                added.append(next_index)
+                next_index += 1
+            responses = commands([ forceload('remove', i) for i in released ] + [ forceload('add', i) for i in added ])
+            if any('Unknown or incomplete command' in r for r in responses):
+                return _emoji(':no_good: This server has no forceload command (1.14.2+)')
+            in_flight.extend((i, now) for i in added)
+
+            if len(released) > 0:
+                job['done'] = released[-1] + 1
+                job['chunks'] += sum((x2 - x1 + 1) * (z2 - z1 + 1) for x1, z1, x2, z2 in (batches[i] for i in released))
+            job['loaded'] = [ i for i, _ in in_flight ]
+            checkpoints = _load_cache(PREGEN_CHECKPOINT_PATH)
+            checkpoints[world_name] = job
+            _save_cache(PREGEN_CHECKPOINT_PATH, checkpoints)
+
+            sample = _sample_rcon(ip_address, private_key)
+            # without an mspt command, the time a command waits for the server thread stands in for it
+            baseline_ms = sample['rcon_latency_ms'] if baseline_ms is None else min(baseline_ms, sample['rcon_latency_ms'])
+            tick_ms = sample['mspt'] if 'mspt' in sample else sample['rcon_latency_ms'] - baseline_ms
+            window = _pregen_throttle(window, sample.get('tps', 20), tick_ms)
+
+            if time.time() - reported >= PREGEN_REPORT_INTERVAL:
+                reported = time.time()
+                print('{}/{} chunks ({:.1f}%), {:.1f} chunks/s, {} squares loaded, tick {:.1f}ms'.format(
+                    job['chunks'], total_chunks, job['chunks'] / total_chunks * 100, (job['chunks'] - resumed_chunks) / (reported - started), window, tick_ms))
+            time.sleep(max(0, PREGEN_INTERVAL - (time.time() - now)))
+
+    checkpoints = _load_cache(PREGEN_CHECKPOINT_PATH)
+    checkpoints.pop(world_name, None)
+    _save_cache(PREGEN_CHECKPOINT_PATH, checkpoints)
+    elapsed = time.time() - started
+    return _emoji(':world_map: Pre-generated {} chunks of {} in {:.0f}s ({:.1f} chunks/s)'.format(
+        job['chunks'] - resumed_chunks, world_name, elapsed, (job['chunks'] - resumed_chunks) / max(elapsed, 0.001)))
+
+def _pregen_batches(center_x, center_z, radius):
+    # squares of PREGEN_BATCH_CHUNKS chunks a side covering the radius, rings nearest to the center first,
+    # as (x1, z1, x2, z2) in chunks; the order is what checkpoints count in
+    side = PREGEN_BATCH_CHUNKS
+    chunk_radius = -(-radius // 16)
+    count = max(1, -(-2 * chunk_radius // side))
+    origin_x = center_x // 16 - count * side // 2
+    origin_z = center_z // 16 - count * side // 2
+    squares = sorted(((bx, bz) for bx in range(count) for bz in range(count)),
+            key=lambda b: (max(abs(2 * b[0] + 1 - count), abs(2 * b[1] + 1 - count)), b[1], b[0]))
+    return [ (origin_x + bx * side, origin_z + bz * side, origin_x + bx * side + side - 1, origin_z + bz * side + side - 1) for bx, bz in squares ]
+
+def _pregen_throttle(window, tps, tick_ms):
+    # AIMD: one more square at a time while ticks have headroom, half as many as soon as they run late
+    if tps < PREGEN_TPS_LOW or tick_ms > PREGEN_MSPT_HIGH:
+        return max(1, window // 2)
+    if tick_ms < PREGEN_MSPT_TARGET:
+        return min(PREGEN_WINDOW_MAX, window + 1)
+    return window
+
+
+
+_ssh_clients = {}
+_ssh_client_locks = collections.defaultdict(threading.Lock)
+_ssh_clients_lock = threading.Lock()
+
+def _get_ssh_client(ip_address, private_key):
+    # one authenticated transport per droplet, shared by every operation of this process
+    with _ssh_clients_lock:
+        lock = _ssh_client_locks[ip_address]
+    with lock:
+        client = _ssh_clients.get(ip_address)
+        if client is not None:
+            transport = client.get_transport()
+            if transport is not None and transport.is_active():
+                return client
+            client.close()
+
+        if isinstance(private_key, bytes):
+            private_key = paramiko.RSAKey.from_private_key(io.StringIO(private_key.decode('utf-8')))
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        _ssh_connect(client, hostname=ip_address, username='root', pkey=private_key)
+        client.get_transport().set_keepalive(30)
+        _ssh_clients[ip_address] = client
+        return client
+
+def _close_ssh_client(ip_address):
+    with _ssh_clients_lock:
+        lock = _ssh_client_locks[ip_address]
+    with lock:
+        client = _ssh_clients.pop(ip_address, None)
+        if client is not None:
+            client.close()
+
+@atexit.register
+def _close_ssh_clients():
+    for ip_address in list(_ssh_clients.keys()):
+        _close_ssh_client(ip_address)
 
-@retry(tries=30, delay=5)
 def _ssh_connect(client, hostname, username, pkey):
     print('Trying SSH connection... IP: {}'.format(hostname)) 
-    client.connect(hostname=hostname, username=username, pkey=pkey)
+    with _span('ssh', 'connect', host=hostname):
+        _wait_for_port(hostname, SSH_PORT, SSH_READY_TIMEOUT)
+        # sshd may accept connections a moment before it accepts the key
+        _wait_until('SSH login to {}'.format(hostname), lambda: client.connect(hostname=hostname, port=SSH_PORT, username=username, pkey=pkey, timeout=10) or True, timeout=60)
+
+def _exec_commands(client, commands, ignore_error=False, parallel=False):
+    if parallel:
+        return _exec_commands_parallel(client, commands, ignore_error=ignore_error)
 
-def _exec_commands(client, commands, ignore_error=False):
     for command in commands:
         print('[[Executing {}]]'.format(command)) 
-        chan = client.get_transport().open_session()
-        chan.set_combine_stderr(True)
-        chan.exec_command(command + ' ; exit "$?"')
-        stdouterr = chan.makefile('rb', -1)
-        status = chan.recv_exit_status()
-        print(stdouterr.read().decode('utf-8'))
+        stream = _stream_command(client, command)
+        for text in stream:
+            _print_output(text)
+        status = stream.status
 
         if ignore_error == False and status != 0:
             print('[[Stop since some error occured]] status: {}'.format(status))
             return status
     return 0
 
+def _exec_commands_parallel(client, commands, ignore_error=False):
+    # commands must not depend on each other: they run on sibling channels of one transport
+    result = 0
+    for i in range(0, len(commands), SSH_MAX_SESSIONS):
+        streams = [ (command, _stream_command(client, command)) for command in commands[i:i + SSH_MAX_SESSIONS] ]
+
+        for command, stream in streams:
+            print('[[Output of {}]]'.format(command))
+            for text in stream:
+                _print_output(text)
+            print('[[Executed {}]] status: {}'.format(command, stream.status))
+            if stream.status != 0 and result == 0:
+                result = stream.status
+
+    if ignore_error == False and result != 0:
+        print('[[Some commands failed]] status: {}'.format(result))
+        return result
+    return 0
 
-def _create_droplet(public_key, world_name=''):
-    key_name = 'hungcat-mc-ctl-' + public_key[-7:]
+def _stream_command(client, command, by_line=True, chunk_size=32768, max_retained=COMMAND_OUTPUT_RETAINED_BYTES):
+    chan = client.get_transport().open_session()
+    chan.set_combine_stderr(True)
+    chan.exec_command(command + ' ; exit "$?"')
+    return _CommandStream(chan, by_line=by_line, chunk_size=chunk_size, max_retained=max_retained, command=command)
+
+class _CommandStream:
+    # iterating yields decoded output as it arrives (whole lines or raw chunks);
+    # only the last max_retained bytes stay in memory for output()
+    def __init__(self, chan, by_line=True, chunk_size=32768, max_retained=COMMAND_OUTPUT_RETAINED_BYTES, command=''):
+        self.chan = chan
+        self.command = command
+        self.started = time.time()
+        self.by_line = by_line
+        self.chunk_size = chunk_size
+        self.max_retained = max_retained
+        self.status = None
+        self.received_bytes = 0
+        self._retained = bytearray()
+
+    def __iter__(self):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        pending = ''
+        while True:
+            data = self.chan.recv(self.chunk_size)
+            if not data:
+                break
+            self.received_bytes += len(data)
+            self._retained += data
+            if len(self._retained) > self.max_retained:
+                del self._retained[:len(self._retained) - self.max_retained]
+
+            text = decoder.decode(data)
+            if not self.by_line:
+                if text != '':
+                    yield text
+                continue
+            pending += text
+            if '\n' in pending:
+                lines, pending = pending.rsplit('\n', 1)
+                for line in lines.split('\n'):
+                    yield line + '\n'
+
+        pending += decoder.decode(b'', final=True)
+        if pending != '':
+            yield pending
+        self.status = self.chan.recv_exit_status()
+        self.chan.close()
+        _record_span('remote', _command_label(self.command), self.started,
+                command=_redact(self.command)[:TRACE_COMMAND_LENGTH], status=self.status, received_bytes=self.received_bytes)
+
+    def output(self):
+        # the retained tail may start in the middle of a character
+        return bytes(self._retained).decode('utf-8', errors='ignore')
+
+def _print_output(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+def _remote_python_command(func, *args):
+    # ships a self-contained function to the droplet and runs it there with python3
+    script = '{}\nimport json\nresult = {}(*json.loads({!r}))\n'.format(textwrap.dedent(inspect.getsource(func)), func.__name__, json.dumps(args))
+    return 'python3 -c {}'.format(shlex.quote(script))
+
+def _scan_world_changes(data_dir, list_prefix=None, world_root=None):
+    # runs on the droplet as well (see _remote_python_command), so it has to be self-contained
+    import os
+    import json
+    import hashlib
+
+    index_path = os.path.join(data_dir, '.mcctl_index.json')
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+
+    # world_root: where the world dirs are read, ex: a copy taken by a hot backup
+    if world_root is None:
+        world_root = data_dir
+    new_index = {}
+    changed = []
+    scanned_bytes = hashed_bytes = staged_bytes = 0
+    world_dirs = [ e.name for e in os.scandir(world_root) if e.is_dir() and e.name.startswith('world') ]
+    for world_dir in world_dirs:
+        for root, _, files in os.walk(os.path.join(world_root, world_dir)):
+            for name in files:
+                path = os.path.join(root, name)
+                rel_path = os.path.relpath(path, world_root)
+                st = os.stat(path)
+                scanned_bytes += st.st_size
+                entry = index.get(rel_path)
+                if entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+                    new_index[rel_path] = entry
+                    continue
+
+                sha1 = hashlib.sha1()
+                with open(path, 'rb') as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b''):
+                        sha1.update(block)
+                hashed_bytes += st.st_size
+                new_index[rel_path] = { 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': sha1.hexdigest() }
+                if entry is None or entry['sha1'] != new_index[rel_path]['sha1']:
+                    changed.append(rel_path)
+                    staged_bytes += st.st_size
+    deleted = [ rel_path for rel_path in index if rel_path not in new_index ]
+
+    # promoted to .mcctl_index.json only once the commit has been made
+    with open(index_path + '.new', 'w') as f:
+        json.dump(new_index, f)
+    if list_prefix is not None:
+        with open(list_prefix + 'changed', 'wb') as f:
+            f.write(b''.join(p.encode('utf-8') + b'\0' for p in changed))
+        with open(list_prefix + 'deleted', 'wb') as f:
+            f.write(b''.join(p.encode('utf-8') + b'\0' for p in deleted))
+
+    print('Scanned {:.1f} MiB in {} files, hashed {:.1f} MiB, staging {:.1f} MiB in {} files ({} removed)'.format(
+        scanned_bytes / 1048576, len(new_index), hashed_bytes / 1048576, staged_bytes / 1048576, len(changed), len(deleted)))
+    return { 'changed': changed, 'deleted': deleted, 'scanned_bytes': scanned_bytes, 'hashed_bytes': hashed_bytes, 'staged_bytes': staged_bytes }
+
+def _mirror_world_dirs(data_dir, snapshot_dir):
+    # runs on the droplet (see _remote_python_command), so it has to be self-contained;
+    # like rsync -a --delete: files whose size or mtime differ are copied, keeping their mtime
+    import os
+    import shutil
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    copied = copied_bytes = removed = 0
+    mirrored = set()
+    world_dirs = [ e.name for e in os.scandir(data_dir) if e.is_dir() and e.name.startswith('world') ]
+    for world_dir in world_dirs:
+        for root, _, files in os.walk(os.path.join(data_dir, world_dir)):
+            target_root = os.path.join(snapshot_dir, os.path.relpath(root, data_dir))
+            os.makedirs(target_root, exist_ok=True)
+            for name in files:
+                path = os.path.join(root, name)
+                target = os.path.join(target_root, name)
+                mirrored.add(target)
+                st = os.stat(path)
+                try:
+                    target_st = os.stat(target)
+                    if target_st.st_size == st.st_size and target_st.st_mtime_ns == st.st_mtime_ns:
+                        continue
+                except OSError:
+                    pass
+                shutil.copyfile(path, target)
+                os.utime(target, ns=(st.st_atime_ns, st.st_mtime_ns))
+                copied += 1
+                copied_bytes += st.st_size
+
+    for entry in os.scandir(snapshot_dir):
+        if not entry.is_dir() or not entry.name.startswith('world'):
+            continue
+        if entry.name not in world_dirs:
+            shutil.rmtree(entry.path)
+            continue
+        for root, _, files in os.walk(entry.path):
+            for name in files:
+                if os.path.join(root, name) not in mirrored:
+                    os.remove(os.path.join(root, name))
+                    removed += 1
+
+    print('Mirrored world: copied {:.1f} MiB in {} files, removed {} files'.format(copied_bytes / 1048576, copied, removed))
+    return { 'copied': copied, 'copied_bytes': copied_bytes, 'removed': removed }
+
+def _send_data_dir(data_dir, target_ip, port, key_path, excludes, live):
+    # runs on the source droplet (see _remote_python_command), so it has to be self-contained;
+    # files the target lacks or has with another size or mtime go as one gzip'ed tar stream over ssh,
+    # so a rerun after an interruption only sends what did not arrive
+    import os
+    import time
+    import subprocess
+
+    ssh = [ 'ssh', '-i', key_path, '-p', str(port), '-o', 'BatchMode=yes', '-o', 'StrictHostKeyChecking=no', '-o', 'UserKnownHostsFile=/dev/null', '-o', 'LogLevel=ERROR', 'root@{}'.format(target_ip) ]
+    started = time.time()
+    listing = subprocess.check_output(ssh + [ 'mkdir -p {0} && cd {0} && find . -type f -printf "%P\\t%s\\t%T@\\0"'.format(data_dir) ], stdin=subprocess.DEVNULL)
+    remote = {}
+    for record in listing.split(b'\0'):
+        if record != b'':
+            path, size, mtime = record.rsplit(b'\t', 2)
+            seconds, _, fraction = mtime.partition(b'.')
+            remote[path] = (int(size), int(seconds) * 1000000000 + int((fraction + b'000000000')[:9]))
+
+    root_dir = data_dir.encode('utf-8')
+    excluded = set(e.encode('utf-8') for e in excludes)
+    local = set()
+    send = []
+    send_bytes = 0
+    for root, dirs, files in os.walk(root_dir):
+        if root == root_dir:
+            dirs[:] = [ d for d in dirs if d not in excluded ]
+        for name in files:
+            path = os.path.relpath(os.path.join(root, name), root_dir)
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except FileNotFoundError:
+                # removed by the running server since it was listed
+                continue
+            local.add(path)
+            # pax headers keep mtimes in nanoseconds, so a file written again in the same second is sent again
+            if remote.get(path) != (st.st_size, st.st_mtime_ns):
+                send.append(path)
+                send_bytes += st.st_size
+    removed = [ p for p in remote if p not in local and p.split(b'/', 1)[0] not in excluded ]
+
+    if len(removed) > 0:
+        subprocess.run(ssh + [ 'cd {} && xargs -0 rm -f --'.format(data_dir) ], input=b''.join(p + b'\0' for p in removed), check=True)
+    sent = 0
+    if len(send) > 0:
+        list_path = '/tmp/mcctl_migrate_list'
+        with open(list_path, 'wb') as f:
+            f.write(b''.join(p + b'\0' for p in send))
+        tar = subprocess.Popen([ 'tar', '-C', data_dir, '--null', '--no-recursion', '-T', list_path, '--format=posix', '-cf', '-' ], stdout=subprocess.PIPE)
+        gzip = subprocess.Popen([ 'gzip', '-1' ], stdin=tar.stdout, stdout=subprocess.PIPE)
+        tar.stdout.close()
+        receiver = subprocess.Popen(ssh + [ 'gunzip | tar -C {} -xf -'.format(data_dir) ], stdin=subprocess.PIPE)
+        for block in iter(lambda: gzip.stdout.read(65536), b''):
+            receiver.stdin.write(block)
+            sent += len(block)
+        receiver.stdin.close()
+        tar_status, gzip_status, receiver_status = tar.wait(), gzip.wait(), receiver.wait()
+        # files the running server changes while they are read are sent again by the next copy
+        if receiver_status != 0 or gzip_status != 0 or (tar_status != 0 and not live):
+            raise Exception('tar over ssh failed: tar {}, gzip {}, ssh {}'.format(tar_status, gzip_status, receiver_status))
+
+    print('Sent {} of {} files ({:.1f} MiB) as {} bytes of gzip in {:.1f}s, removed {} files'.format(len(send), len(local), send_bytes / 1048576, sent, time.time() - started, len(removed)))
+    return { 'sent': len(send), 'sent_bytes': sent, 'removed': len(removed) }
+
+def _analyze_regions(data_dir, mode='report', min_inhabited=0, region_path=None):
+    # runs on the droplet (see _remote_python_command), so it has to be self-contained;
+    # called with region_path, it is the worker analyzing (and pruning) one region file in a process of the pool
+    import os
+    import time
+    import zlib
+    import struct
+    import functools
+    import concurrent.futures
+
+    if region_path is not None:
+        # the tag of InhabitedTime (TAG_Long, name length 13), found in the decompressed chunk without parsing the NBT
+        pattern = b'\x04\x00\x0dInhabitedTime'
+
+        def inhabited_time(compression, payload):
+            if compression == 3:
+                found = payload.find(pattern)
+                return struct.unpack('>q', payload[found + len(pattern):found + len(pattern) + 8])[0] if found >= 0 else None
+            if compression not in [ 1, 2 ]:
+                return None
+            # decompressed only as far as the tag, which is near the start of most chunks
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16 if compression == 1 else zlib.MAX_WBITS)
+            data = b''
+            while True:
+                data += decompressor.decompress(payload, 16384)
+                payload = decompressor.unconsumed_tail
+                found = data.find(pattern)
+                if found >= 0 and len(data) >= found + len(pattern) + 8:
+                    return struct.unpack('>q', data[found + len(pattern):found + len(pattern) + 8])[0]
+                if len(payload) == 0:
+                    return None
+
+        def drop_chunks(path, dropped):
+            # rewrites the region with the kept chunks packed from sector 2, or removes it when none is kept
+            with open(path, 'rb') as f:
+                data = f.read()
+            if len(data) < 8192:
+                return 0
+            locations = list(struct.unpack('>1024I', data[:4096]))
+            timestamps = list(struct.unpack('>1024I', data[4096:8192]))
+            sectors = []
+            next_sector = 2
+            for i in range(1024):
+                offset, count = locations[i] >> 8, locations[i] & 0xff
+                if i in dropped or offset < 2 or count == 0:
+                    locations[i] = timestamps[i] = 0
+                    continue
+                sectors.append(data[offset * 4096:(offset + count) * 4096].ljust(count * 4096, b'\0'))
+                locations[i] = next_sector << 8 | count
+                next_sector += count
+            if len(sectors) == 0:
+                os.remove(path)
+                return len(data)
+            tmp_path = path + '.mcctl_tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(struct.pack('>1024I', *locations) + struct.pack('>1024I', *timestamps) + b''.join(sectors))
+            os.replace(tmp_path, path)
+            return len(data) - next_sector * 4096
+
+        stats = { 'path': os.path.relpath(region_path, data_dir), 'bytes': os.path.getsize(region_path), 'chunks': 0, 'inhabited': 0, 'max_inhabited': 0, 'unknown': 0, 'prunable': [], 'freed': 0, 'removed': 0 }
+        with open(region_path, 'rb') as f:
+            data = f.read()
+        if len(data) < 8192:
+            return stats
+        # all 1024 locations in one call: offset in 4 KiB sectors << 8 | sector count
+        for i, location in enumerate(struct.unpack('>1024I', data[:4096])):
+            offset = location >> 8
+            if offset < 2 or location & 0xff == 0:
+                continue
+            stats['chunks'] += 1
+            try:
+                length, compression = struct.unpack('>IB', data[offset * 4096:offset * 4096 + 5])
+                inhabited = inhabited_time(compression, data[offset * 4096 + 5:offset * 4096 + 4 + length])
+            except (struct.error, zlib.error):
+                # ex: a chunk the running server is rewriting right now
+                inhabited = None
+            if inhabited is None:
+                stats['unknown'] += 1
+                continue
+            stats['inhabited'] += inhabited
+            stats['max_inhabited'] = max(stats['max_inhabited'], inhabited)
+            if inhabited < min_inhabited:
+                stats['prunable'].append(i)
+
+        if mode == 'prune' and len(stats['prunable']) > 0:
+            dropped = set(stats['prunable'])
+            stats['freed'] = drop_chunks(region_path, dropped)
+            # entities and poi of 1.14+ are region files of the same name in sibling directories
+            for sibling in [ 'entities', 'poi' ]:
+                path = os.path.join(os.path.dirname(os.path.dirname(region_path)), sibling, os.path.basename(region_path))
+                if os.path.exists(path):
+                    stats['freed'] += drop_chunks(path, dropped)
+        stats['prunable'] = len(stats['prunable'])
+        stats['removed'] = int(not os.path.exists(region_path))
+        return stats
+
+    started = time.time()
+    region_paths = []
+    for world_dir in sorted(e.path for e in os.scandir(data_dir) if e.is_dir() and e.name.startswith('world')):
+        for root, dirs, files in os.walk(world_dir):
+            if os.path.basename(root) == 'region':
+                region_paths.extend(os.path.join(root, name) for name in files if name.endswith('.mca'))
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        results = list(executor.map(functools.partial(_analyze_regions, data_dir, mode, min_inhabited), region_paths, chunksize=16))
+    elapsed = max(time.time() - started, 0.001)
+
+    with open(os.path.join(data_dir, '.mcctl_regions.tsv'), 'w') as f:
+        f.write('path\tbytes\tchunks\tinhabited_ticks\tmax_inhabited_ticks\tunknown\tprunable\tfreed\n')
+        for r in results:
+            f.write('{path}\t{bytes}\t{chunks}\t{inhabited}\t{max_inhabited}\t{unknown}\t{prunable}\t{freed}\n'.format(**r))
+    print('{:<40} {:>9} {:>7} {:>11} {:>9}'.format('largest regions', 'MiB', 'chunks', 'inhabited h', 'prunable'))
+    for r in sorted(results, key=lambda r: -r['bytes'])[:10]:
+        print('{:<40} {:9.2f} {:7d} {:11.2f} {:9d}'.format(r['path'], r['bytes'] / 1048576, r['chunks'], r['inhabited'] / 72000, r['prunable']))
+
+    chunks = sum(r['chunks'] for r in results)
+    print('Scanned {} region files, {} chunks ({} unreadable), {:.1f} MiB in {:.1f}s ({:.0f} regions/s, {:.0f} chunks/s)'.format(
+        len(results), chunks, sum(r['unknown'] for r in results), sum(r['bytes'] for r in results) / 1048576, elapsed, len(results) / elapsed, chunks / elapsed))
+    if mode == 'prune':
+        print('Pruned {} chunks inhabited for less than {} ticks: freed {:.1f} MiB, removed {} region files'.format(
+            sum(r['prunable'] for r in results), min_inhabited, sum(r['freed'] for r in results) / 1048576, sum(r['removed'] for r in results)))
+    else:
+        print('{} chunks are inhabited for less than {} ticks; every region is in {}'.format(
+            sum(r['prunable'] for r in results), min_inhabited, os.path.join(data_dir, '.mcctl_regions.tsv')))
+    return results
+
+def _snapshot_chunk_store(data_dir, snapshot_name, world_root=None):
+    # runs on the droplet (see _remote_python_command), so it has to be self-contained
+    import os
+    import json
+    import zlib
+    import struct
+    import hashlib
+
+    store_dir = os.path.join(data_dir, '.chunkstore')
+    stats = { 'files': 0, 'chunks': 0, 'objects': 0, 'object_bytes': 0, 'scanned_bytes': 0 }
+
+    def put(data, compress):
+        digest = hashlib.sha256(data).digest()
+        path = os.path.join(store_dir, 'objects', digest.hex()[:2], digest.hex()[2:])
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if compress:
+                data = zlib.compress(data)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            stats['objects'] += 1
+            stats['object_bytes'] += len(data)
+        return digest
+
+    index_path = os.path.join(data_dir, '.mcctl_chunk_index.json')
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+
+    if world_root is None:
+        world_root = data_dir
+    manifest = {}
+    world_dirs = [ e.name for e in os.scandir(world_root) if e.is_dir() and e.name.startswith('world') ]
+    for world_dir in world_dirs:
+        for root, _, files in os.walk(os.path.join(world_root, world_dir)):
+            for name in files:
+                path = os.path.join(root, name)
+                rel_path = os.path.relpath(path, world_root)
+                st = os.stat(path)
+                stats['files'] += 1
+                entry = index.get(rel_path)
+                if entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+                    manifest[rel_path] = entry['manifest']
+                    continue
+
+                with open(path, 'rb') as f:
+                    data = f.read()
+                stats['scanned_bytes'] += len(data)
+                chunks = None
+                if name.endswith('.mca') and len(data) >= 8192:
+                    # 1024 x (3 byte sector offset, 1 byte sector count) followed by 1024 timestamps;
+                    # each chunk is (4 byte length, 1 byte compression type, payload) and is already compressed
+                    try:
+                        chunks = []
+                        for location in struct.unpack('>1024I', data[:4096]):
+                            if location == 0:
+                                chunks.append(None)
+                                continue
+                            offset = (location >> 8) * 4096
+                            length = struct.unpack('>I', data[offset:offset + 4])[0]
+                            if offset + 4 + length > len(data):
+                                raise struct.error('chunk runs past the end of the file')
+                            chunks.append(data[offset + 4:offset + 4 + length])
+                    except struct.error:
+                        # a region file the server has written only partly is kept whole, like any other file
+                        chunks = None
+                if chunks is not None:
+                    table = bytearray(data[4096:8192])
+                    for chunk in chunks:
+                        digest = bytes(32)
+                        if chunk is not None:
+                            digest = put(chunk, False)
+                            stats['chunks'] += 1
+                        table += digest
+                    manifest[rel_path] = { 'type': 'region', 'table': put(bytes(table), True).hex() }
+                else:
+                    manifest[rel_path] = { 'type': 'file', 'hash': put(data, True).hex() }
+                index[rel_path] = { 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'manifest': manifest[rel_path] }
+
+    os.makedirs(os.path.join(store_dir, 'snapshots'), exist_ok=True)
+    with open(os.path.join(store_dir, 'snapshots', snapshot_name + '.json'), 'w') as f:
+        json.dump(manifest, f, sort_keys=True, indent=0)
+    index = { rel_path: entry for rel_path, entry in index.items() if rel_path in manifest }
+    with open(index_path, 'w') as f:
+        json.dump(index, f)
+
+    print('Snapshot {}: {} files, {} chunks parsed from {:.1f} MiB, {} new objects ({:.1f} MiB)'.format(
+        snapshot_name, stats['files'], stats['chunks'], stats['scanned_bytes'] / 1048576, stats['objects'], stats['object_bytes'] / 1048576))
+    return stats
+
+def _restore_chunk_store(data_dir, snapshot_name=None):
+    # runs on the droplet (see _remote_python_command), so it has to be self-contained
+    import os
+    import json
+    import zlib
+    import struct
+
+    store_dir = os.path.join(data_dir, '.chunkstore')
+
+    def get(digest_hex):
+        with open(os.path.join(store_dir, 'objects', digest_hex[:2], digest_hex[2:]), 'rb') as f:
+            return f.read()
+
+    if snapshot_name is None:
+        snapshot_name = sorted(os.listdir(os.path.join(store_dir, 'snapshots')))[-1][:-len('.json')]
+    with open(os.path.join(store_dir, 'snapshots', snapshot_name + '.json')) as f:
+        manifest = json.load(f)
+
+    for rel_path, entry in manifest.items():
+        path = os.path.join(data_dir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if entry['type'] == 'file':
+            data = zlib.decompress(get(entry['hash']))
+        else:
+            table = zlib.decompress(get(entry['table']))
+            locations = []
+            sectors = []
+            next_sector = 2
+            for i in range(1024):
+                digest = table[4096 + i * 32:4096 + (i + 1) * 32]
+                if digest == bytes(32):
+                    locations.append(0)
+                    continue
+                payload = get(digest.hex())
+                chunk = struct.pack('>I', len(payload)) + payload
+                chunk += bytes(-len(chunk) % 4096)
+                locations.append((next_sector << 8) | (len(chunk) // 4096))
+                next_sector += len(chunk) // 4096
+                sectors.append(chunk)
+            data = struct.pack('>1024I', *locations) + table[:4096] + b''.join(sectors)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    print('Restored snapshot {}: {} files'.format(snapshot_name, len(manifest)))
+
+
+def _create_droplet(public_key, world_name='', base_snapshot=None, size_slug=DROPLET_SIZE, region=DROPLET_REGION):
     droplet_name = 'minecraft-{}'.format(world_name)
-    manager = digitalocean.Manager(token=DIGITALOCEAN_API_TOKEN)
 
-    all_droplets = manager.get_all_droplets()
-    existing_droplets = filter(lambda droplet: droplet.name == droplet_name, all_droplets)
+    minecraft_droplet = _find_droplet(world_name, use_index=False)
 
-    minecraft_droplet = None
-
-    if len(existing_droplets) == 0:
-        keys = manager.get_all_sshkeys()
-        if len(filter(lambda k: k.name == key_name, keys)) == 0:
-            key = digitalocean.SSHKey(token=DIGITALOCEAN_API_TOKEN,
-                                    name=key_name,
-                                    public_key=public_key)
-            key.create()
-            keys.append(key)
+    if minecraft_droplet is None:
+        keys = _get_registered_ssh_keys(public_key)
         droplet = digitalocean.Droplet(token=DIGITALOCEAN_API_TOKEN,
                                     name=droplet_name,
-                                    region= DIGITALOCEAN_REGION_SLUG if DIGITALOCEAN_REGION_SLUG is not None else 'sgp1',
-                                    image='docker-18-04',
-                                    size_slug='2gb',
+                                    region=region,
+                                    image='docker-18-04' if base_snapshot is None else base_snapshot.id,
+                                    size_slug=size_slug,
                                     ssh_keys=keys,
-                                    backups=False)
+                                    backups=False,
+                                    tags=[DROPLET_TAG])
         droplet.create()
-        minecraft_droplet = manager.get_droplet(droplet.id)
-    else:
-        minecraft_droplet = existing_droplets[0]
+        _invalidate_droplet_index(droplet_name)
+        # keeps action_ids of the creation for _get_ip_address_of_droplet
+        minecraft_droplet = droplet
 
     return minecraft_droplet
 
-@retry(tries=10, delay=3)
+def _get_registered_ssh_keys(public_key):
+    key_name = 'hungcat-mc-ctl-' + public_key[-7:]
+    keys = _get_manager().get_all_sshkeys()
+    if not any(k.name == key_name for k in keys):
+        key = digitalocean.SSHKey(token=DIGITALOCEAN_API_TOKEN,
+                                name=key_name,
+                                public_key=public_key)
+        key.create()
+        keys.append(key)
+    return keys
+
+def bake_snapshot(mode=''):
+    base_snapshot = _find_base_snapshot()
+    if base_snapshot is not None and mode == 'status':
+        return _emoji(':information: Snapshot {} is {}'.format(base_snapshot.name, 'stale' if base_snapshot.stale else 'up to date'))
+    elif base_snapshot is None and mode == 'status':
+        return _emoji(':information: No snapshot has been baked')
+    elif base_snapshot is not None and not base_snapshot.stale and mode != 'force':
+        return _emoji(':information: Snapshot {} is up to date'.format(base_snapshot.name))
+
+    snapshot_name = '{}{}'.format(SNAPSHOT_PREFIX, datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S'))
+    private_key, public_key = _get_ssh_keys()
+    droplet = digitalocean.Droplet(token=DIGITALOCEAN_API_TOKEN,
+                                name='mc-ctl-bake',
+                                region=DROPLET_REGION,
+                                image='docker-18-04',
+                                size_slug=DROPLET_SIZE,
+                                ssh_keys=_get_registered_ssh_keys(public_key),
+                                backups=False)
+    droplet.create()
+    try:
+        ip_address = _get_ip_address_of_droplet(droplet)
+        client = _get_ssh_client(ip_address, private_key)
+        # SETUP_ONLY makes the image download the server jar and exit instead of starting it
+        status = _exec_commands(client, [
+            INSTALL_GIT_COMMAND,
+            'docker pull {}'.format(MINECRAFT_IMAGE)
+        ] + [
+            'docker run --rm -v /root/jars/{0}:/data -e EULA=TRUE -e VERSION={0} -e SETUP_ONLY=true {1} && find /root/jars/{0} -mindepth 1 -not -name "*.jar" -delete'.format(v, MINECRAFT_IMAGE) for v in BAKE_VERSIONS
+        ])
+        _close_ssh_client(ip_address)
+        if status != 0:
+            return _emoji(':cry: Failed to prepare snapshot droplet')
+
+        print('Taking snapshot {}...'.format(snapshot_name))
+        droplet.take_snapshot(snapshot_name, return_dict=False, power_off=True).wait(update_every_seconds=10, repeat=180)
+    finally:
+        droplet.destroy()
+
+    # older snapshots are not used anymore
+    for snapshot in _get_manager().get_droplet_snapshots():
+        if snapshot.name.startswith(SNAPSHOT_PREFIX) and snapshot.name != snapshot_name:
+            snapshot.destroy()
+
+    return _emoji(':bread: Baked snapshot: {}'.format(snapshot_name))
+
+def _find_base_snapshot(region=DROPLET_REGION):
+    snapshots = sorted((s for s in _get_manager().get_droplet_snapshots() if s.name.startswith(SNAPSHOT_PREFIX) and region in s.regions), key=lambda s: s.name)
+    if len(snapshots) == 0:
+        return None
+    snapshot = snapshots[-1]
+
+    baked_at = datetime.datetime.strptime(snapshot.name[len(SNAPSHOT_PREFIX):], '%Y%m%d%H%M%S').replace(tzinfo=datetime.timezone.utc)
+    snapshot.stale = datetime.datetime.now(datetime.timezone.utc) - baked_at > datetime.timedelta(days=SNAPSHOT_MAX_AGE_DAYS)
+    try:
+        with _span('http', 'image tag'), urllib.request.urlopen(urllib.request.Request(MINECRAFT_IMAGE_TAG_URL), timeout=10) as res:
+            last_updated = json.loads(res.read().decode('utf-8'))['last_updated']
+        # ex: 2020-01-01T12:34:56.789012Z
+        snapshot.stale = snapshot.stale or datetime.datetime.strptime(last_updated[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=datetime.timezone.utc) > baked_at
+    except Exception as e:
+        print(_emoji(':information: Failed to check {} for updates: {}'.format(MINECRAFT_IMAGE, e)))
+    return snapshot
+
 def _get_ip_address_of_droplet(droplet):
-    droplet.load()
-    if droplet.ip_address is None:
-        raise Exception('Failed to obtain IP address')
-    return droplet.ip_address
+    if droplet.ip_address is not None:
+        return droplet.ip_address
+
+    # a new droplet has its create action; it is active with an address once that completes
+    for action_id in droplet.action_ids:
+        _wait_for_action(action_id, DROPLET_READY_TIMEOUT)
+
+    def loaded_ip_address():
+        droplet.load()
+        return droplet.ip_address
+    return _wait_until('IP address of {}'.format(droplet.name), loaded_ip_address, DROPLET_READY_TIMEOUT, initial_delay=1)
+
+def _wait_for_action(action_id, timeout):
+    action = digitalocean.Action(token=DIGITALOCEAN_API_TOKEN, id=action_id)
+    def action_done():
+        action.load()
+        if action.status == 'errored':
+            raise Exception('Droplet action {} errored'.format(action.type))
+        return action.status == 'completed'
+    return _wait_until('droplet action {}'.format(action_id), action_done, timeout, initial_delay=1)
+
+def _wait_until(name, probe, timeout, initial_delay=0.2, max_delay=5):
+    # exponential backoff: short waits end almost as soon as the target is ready
+    started = time.time()
+    delay = initial_delay
+    last_error = None
+    with _span('wait', name, timeout=timeout) as attributes:
+        attempt = 0
+        while True:
+            attempt += 1
+            attributes['attempts'] = attempt
+            try:
+                with _span('attempt', name, attempt=attempt):
+                    result = probe()
+                if result:
+                    return result
+            except Exception as e:
+                last_error = e
+            if time.time() - started + delay > timeout:
+                raise Exception('Timed out waiting for {} after {:.0f}s (last error: {})'.format(name, time.time() - started, last_error))
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+def _wait_for_port(host, port, timeout):
+    def port_open():
+        with socket.create_connection((host, port), timeout=3):
+            return True
+    return _wait_until('port {} of {}'.format(port, host), port_open, timeout)
+
+def _wait_for_minecraft(host, timeout, port=MINECRAFT_PORT):
+    return _wait_until('minecraft on {}:{}'.format(host, port), lambda: _server_list_ping(host, port), timeout, initial_delay=1)
+
+def _server_list_ping(host, port=MINECRAFT_PORT, timeout=5):
+    # Server List Ping: handshake (next state: status), status request, then ping/pong for latency
+    # ref: https://wiki.vg/Server_List_Ping
+    def varint(n):
+        n &= 0xffffffff
+        out = b''
+        while True:
+            if n >> 7:
+                out += bytes([ (n & 0x7f) | 0x80 ])
+                n >>= 7
+            else:
+                return out + bytes([ n ])
+
+    def packet(packet_id, payload=b''):
+        body = varint(packet_id) + payload
+        return varint(len(body)) + body
+
+    def read_varint(f):
+        n = 0
+        for i in range(5):
+            b = f.read(1)
+            if len(b) == 0:
+                raise EOFError('Connection closed by {}:{}'.format(host, port))
+            n |= (b[0] & 0x7f) << (7 * i)
+            if not b[0] & 0x80:
+                return n
+        raise ValueError('Too long VarInt from {}:{}'.format(host, port))
+
+    def read_packet(f):
+        length = read_varint(f)
+        data = f.read(length)
+        if len(data) != length:
+            raise EOFError('Connection closed by {}:{}'.format(host, port))
+        body = io.BytesIO(data)
+        return read_varint(body), body
+
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        f = sock.makefile('rb')
+        host_bytes = host.encode('utf-8')
+        sock.sendall(packet(0x00, varint(-1) + varint(len(host_bytes)) + host_bytes + struct.pack('>H', port) + varint(1)) + packet(0x00))
+        _, body = read_packet(f)
+        status = json.loads(body.read(read_varint(body)).decode('utf-8'))
+
+        started = time.time()
+        sock.sendall(packet(0x01, struct.pack('>q', int(started * 1000))))
+        read_packet(f)
+        status['latency_ms'] = (time.time() - started) * 1000
+    return status
+
+class _RconClient:
+    # Source RCON: little-endian int32 length, request id and type, then the body and two NUL bytes
+    # ref: https://developer.valvesoftware.com/wiki/Source_RCON_Protocol
+    SERVERDATA_AUTH = 3
+    SERVERDATA_EXECCOMMAND = 2
+    SERVERDATA_AUTH_RESPONSE = 2
+    SERVERDATA_RESPONSE_VALUE = 0
+    # longer responses are split into packets of this many bytes with the same request id
+    MAX_FRAGMENT = 4096
+
+    def __init__(self, sock, password, window=RCON_PIPELINE_WINDOW):
+        self.sock = sock
+        self.window = window
+        self.lock = threading.Lock()
+        self._next_id = 0
+        self._buffer = b''
+        self.sock.settimeout(RCON_TIMEOUT)
+
+        request_id = self._send(self.SERVERDATA_AUTH, password)
+        while True:
+            response_id, response_type, _ = self._receive()
+            if response_type == self.SERVERDATA_AUTH_RESPONSE:
+                break
+        if response_id == -1 or response_id != request_id:
+            raise Exception('RCON authentication failed')
+
+    def command(self, command):
+        return self.commands([ command ])[0]
+
+    def commands(self, commands):
+        # up to window requests are in flight; responses are matched to them by request id
+        with self.lock, _span('rcon', 'commands', count=len(commands), window=self.window):
+            try:
+                return self._commands(commands)
+            except Exception:
+                # a response may be left half read, so the connection is of no use any more
+                self.close()
+                raise
+
+    def _commands(self, commands):
+        request_ids = []
+        responses = {}
+        markers = {}
+        in_flight = 0
+        sent = 0
+        while sent < len(commands) or in_flight > 0:
+            while sent < len(commands) and in_flight < self.window:
+                request_id = self._send(self.SERVERDATA_EXECCOMMAND, commands[sent])
+                request_ids.append(request_id)
+                responses[request_id] = []
+                in_flight += 1
+                sent += 1
+
+            response_id, _, body = self._receive()
+            if response_id in markers:
+                del markers[response_id]
+                in_flight -= 1
+            elif response_id in responses:
+                responses[response_id].append(body)
+                if response_id in markers.values():
+                    continue
+                elif len(body) < self.MAX_FRAGMENT:
+                    in_flight -= 1
+                else:
+                    # a full packet may be the last one; an empty request of another type is answered in order,
+                    # so its answer ends the response. It is sent only now that the server has read the command,
+                    # since vanilla servers drop packets which arrive in the same read
+                    markers[self._send(self.SERVERDATA_RESPONSE_VALUE, '')] = response_id
+        # decoded as a whole, fragments may split characters
+        return [ b''.join(responses[request_id]).decode('utf-8', errors='replace') for request_id in request_ids ]
+
+    def close(self):
+        self.sock.close()
+
+    def _send(self, packet_type, body):
+        self._next_id = self._next_id % 0x7fffffff + 1
+        payload = struct.pack('<ii', self._next_id, packet_type) + body.encode('utf-8') + b'\0\0'
+        self.sock.sendall(struct.pack('<i', len(payload)) + payload)
+        return self._next_id
+
+    def _receive(self):
+        length = struct.unpack('<i', self._receive_exactly(4))[0]
+        payload = self._receive_exactly(length)
+        request_id, packet_type = struct.unpack('<ii', payload[:8])
+        return request_id, packet_type, payload[8:-2]
+
+    def _receive_exactly(self, size):
+        while len(self._buffer) < size:
+            data = self.sock.recv(65536)
+            if len(data) == 0:
+                raise EOFError('RCON connection closed')
+            self._buffer += data
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+_rcon_clients = {}
+_rcon_client_locks = collections.defaultdict(threading.Lock)
+_rcon_clients_lock = threading.Lock()
+
+def _get_rcon_client(ip_address, private_key, slot=DEDICATED_SLOT):
+    # tunneled through the pooled SSH transport to the container, which does not publish the RCON port
+    key = (ip_address, slot['container'])
+    with _rcon_clients_lock:
+        lock = _rcon_client_locks[key]
+    # connecting may wait for the droplet for minutes, which must not hold up the servers of other worlds
+    with lock:
+        with _rcon_clients_lock:
+            rcon_client = _rcon_clients.get(key)
+        if rcon_client is not None and not rcon_client.sock.closed:
+            return rcon_client
+
+        client = _get_ssh_client(ip_address, private_key)
+        stream = _stream_command(client, "docker inspect -f '{{{{range .NetworkSettings.Networks}}}}{{{{.IPAddress}}}}{{{{end}}}}' {} && grep -E '^rcon\\.(port|password)=' {}/server.properties".format(slot['container'], slot['data_dir']))
+        for _ in stream:
+            pass
+        if stream.status != 0:
+            raise Exception('Failed to read RCON settings: {}'.format(stream.output().strip()))
+        lines = stream.output().splitlines()
+        settings = dict(line.split('=', 1) for line in lines[1:])
+
+        chan = client.get_transport().open_channel('direct-tcpip', (lines[0].strip(), int(settings.get('rcon.port', '25575'))), ('127.0.0.1', 0))
+        rcon_client = _RconClient(chan, settings.get('rcon.password', ''))
+        with _rcon_clients_lock:
+            _rcon_clients[key] = rcon_client
+        return rcon_client
+
+def _close_rcon_client(ip_address, slot=DEDICATED_SLOT):
+    with _rcon_clients_lock:
+        rcon_client = _rcon_clients.pop((ip_address, slot['container']), None)
+    if rcon_client is not None:
+        rcon_client.close()
+
+_manager = None
+
+def _get_manager():
+    global _manager
+    if _manager is None:
+        _manager = digitalocean.Manager(token=DIGITALOCEAN_API_TOKEN)
+    return _manager
+
+def _find_droplet(world_name, use_index=True):
+    droplet_name = 'minecraft-{}'.format(world_name)
 
-def _get_ssh_keys():
-    key_file_name = 'id_rsa'
+    if use_index:
+        entry = _load_cache(DROPLET_INDEX_PATH).get(droplet_name)
+        if entry is not None and time.time() - entry['cached_at'] < DROPLET_INDEX_TTL:
+            return digitalocean.Droplet(token=DIGITALOCEAN_API_TOKEN, id=entry['id'], name=droplet_name, ip_address=entry['ip_address'])
+
+    # tagged droplets are filtered by the API, untagged ones need the whole account listing;
+    # the tagged listing is not complete, so it must not drop the entries of untagged droplets
+    tagged_droplets = _get_manager().get_all_droplets(tag_name=DROPLET_TAG)
+    _refresh_droplet_index(tagged_droplets, replace=False)
+    for droplet in tagged_droplets:
+        if droplet.name == droplet_name:
+            return droplet
+
+    all_droplets = _get_manager().get_all_droplets()
+    _refresh_droplet_index(all_droplets)
+    for droplet in all_droplets:
+        if droplet.name == droplet_name:
+            _tag_droplet(droplet)
+            return droplet
+    return None
+
+def _find_world(world_name, use_index=True):
+    # a world runs on a droplet of its own or in a slot of a shared one (see pack_world)
+    if use_index:
+        entry = _load_cache(PACK_INDEX_PATH).get(world_name)
+        if entry is not None and time.time() - entry['cached_at'] < DROPLET_INDEX_TTL:
+            droplet = digitalocean.Droplet(token=DIGITALOCEAN_API_TOKEN, id=entry['id'], name=entry['droplet'], ip_address=entry['ip_address'])
+            return droplet, _packed_slot(world_name, entry['port'])
+    droplet = _find_droplet(world_name, use_index)
+    if droplet is not None:
+        return droplet, DEDICATED_SLOT
+    for droplet, slots in _list_packs():
+        if slots is not None and world_name in slots:
+            return droplet, slots[world_name]
+    return None, None
+
+def _packed_slot(world_name, port):
+    container = 'minecraft-{}'.format(re.sub(r'[^a-zA-Z0-9_.-]', '_', world_name))
+    return { 'world': world_name, 'container': container, 'data_dir': '{}/{}'.format(PACK_DATA_ROOT, container), 'port': port }
+
+def _list_packs():
+    # the worlds of a shared droplet are read from the labels of its containers; slots is None when it does not answer
+    droplets = [ d for d in _get_manager().get_all_droplets(tag_name=DROPLET_TAG) if d.name.startswith(PACK_DROPLET_PREFIX) and d.ip_address is not None ]
+    private_key, _ = _get_ssh_keys()
+
+    def read(droplet):
+        try:
+            status, output = _read_command_output(_get_ssh_client(droplet.ip_address, private_key), PACK_LIST_COMMAND)
+        except Exception as e:
+            status, output = -1, str(e)
+        if status != 0:
+            print(_emoji(':information: Failed to list the worlds of {}: {}'.format(droplet.name, output)))
+            return droplet, None
+        slots = {}
+        for line in output.splitlines():
+            world, port = line.rsplit('\t', 1)
+            slots[world] = _packed_slot(world, int(port))
+        return droplet, slots
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=FLEET_CONCURRENCY) as executor:
+        packs = list(executor.map(read, droplets))
+    now = time.time()
+    with _droplet_index_lock:
+        index = { world: { 'droplet': droplet.name, 'id': droplet.id, 'ip_address': droplet.ip_address, 'port': slot['port'], 'cached_at': now }
+                for droplet, slots in packs if slots is not None for world, slot in slots.items() }
+        _save_cache(PACK_INDEX_PATH, index)
+    return packs
+
+def _update_pack_index(world_name, droplet, slot):
+    with _droplet_index_lock:
+        index = _load_cache(PACK_INDEX_PATH)
+        index[world_name] = { 'droplet': droplet.name, 'id': droplet.id, 'ip_address': droplet.ip_address, 'port': slot['port'], 'cached_at': time.time() }
+        _save_cache(PACK_INDEX_PATH, index)
+
+def _invalidate_pack_index(world_name):
+    with _droplet_index_lock:
+        index = _load_cache(PACK_INDEX_PATH)
+        if index.pop(world_name, None) is not None:
+            _save_cache(PACK_INDEX_PATH, index)
+
+def _tag_droplet(droplet):
+    try:
+        tag = digitalocean.Tag(token=DIGITALOCEAN_API_TOKEN, name=DROPLET_TAG)
+        tag.create()
+        tag.add_droplets([ str(droplet.id) ])
+    except Exception as e:
+        print(_emoji(':information: Failed to tag {} with {}: {}'.format(droplet.name, DROPLET_TAG, e)))
 
-    key_file_dir = SCRIPT_DIR / 'keys'
-    private_key_file_path = key_file_dir / key_file_name
-    public_key_file_path = key_file_dir / '{}.pub'.format(key_file_name)
+_droplet_index_lock = threading.Lock()
+_log_offsets_lock = threading.Lock()
 
+def _load_cache(path):
     try:
-        private_key = RSA.import_key(private_key_file_path.read_bytes()).export_key()
-        public_key = RSA.import_key(public_key_file_path.read_bytes()).publickey().export_key()
-    except:
-        private_key, public_key = _generate_ssh_key(key_file_name)
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+def _save_cache(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name('{}.{}.tmp'.format(path.name, os.getpid()))
+    tmp_path.write_text(json.dumps(data, indent=2, sort_keys=True))
+    os.replace(str(tmp_path), str(path))
+
+def _update_droplet_index(droplet):
+    _refresh_droplet_index([ droplet ], replace=False)
+
+def _refresh_droplet_index(droplets, replace=True):
+    # replace: droplets is a complete listing, so minecraft droplets missing from it are gone
+    now = time.time()
+    with _droplet_index_lock:
+        index = _load_cache(DROPLET_INDEX_PATH)
+        if replace:
+            names = set(droplet.name for droplet in droplets)
+            index = { name: entry for name, entry in index.items() if name in names }
+        for droplet in droplets:
+            if droplet.name is None or not droplet.name.startswith('minecraft-') or droplet.ip_address is None:
+                continue
+            index[droplet.name] = { 'id': droplet.id, 'ip_address': droplet.ip_address, 'cached_at': now }
+        _save_cache(DROPLET_INDEX_PATH, index)
+
+def _invalidate_droplet_index(droplet_name):
+    with _droplet_index_lock:
+        index = _load_cache(DROPLET_INDEX_PATH)
+        if index.pop(droplet_name, None) is not None:
+            _save_cache(DROPLET_INDEX_PATH, index)
+
+_ssh_keys = None
+_ssh_keys_lock = threading.Lock()
 
-    return private_key, public_key
+def _get_ssh_keys():
+    # parsed once per process; the private key is a ready-to-use paramiko key
+    global _ssh_keys
+    with _ssh_keys_lock:
+        if _ssh_keys is not None:
+            return _ssh_keys
+
+        key_file_name = 'id_rsa'
+
+        private_key_file_path = SCRIPT_DIR / 'keys' / key_file_name
+        try:
+            private_key = paramiko.RSAKey.from_private_key_file(str(private_key_file_path))
+        except:
+            private_key, _ = _generate_ssh_key(key_file_name)
+            private_key = paramiko.RSAKey.from_private_key(io.StringIO(private_key.decode('utf-8')))
+        public_key = '{} {}'.format(private_key.get_name(), private_key.get_base64())
+
+        _ssh_keys = (private_key, public_key)
+        return _ssh_keys
 
 def _generate_ssh_key(key_file_name):
     key = RSA.generate(4096)
@@ -366,9 +3270,9 @@ def _generate_ssh_key(key_file_name):
 
 def _construct_github_url(world_name, path='', is_raw=False):
     if is_raw:
-        url = furl(GITHUB_RAW_URL)
+        url = furl.furl(GITHUB_RAW_URL)
     else:
-        url = furl(GITHUB_URL)
+        url = furl.furl(GITHUB_URL)
     #parsed.scheme = 'https'
     url.path = '{}/{}'.format(url.path, world_name)
     if path != '':
@@ -379,12 +3283,16 @@ def _construct_github_url(world_name, path='', is_raw=False):
 
 def _test_github_url(github_url):
     try:
-        git.cmd.Git().ls_remote(github_url)
+        with _span('git', 'ls-remote'):
+            git.cmd.Git().ls_remote(github_url)
     except git.GitCommandError as e:
         return False
     return True
 
 def _yes_no_input(message):
+    if _RoutedWriter.routed():
+        print('{} [y[es]/n[o]]: no (asked in the daemon)'.format(message))
+        return False
     while True:
         choice = input("{} [y[es]/n[o]]: ".format(message)).lower()
         if choice in ['y', 'ye', 'yes']:
@@ -396,5 +3304,6 @@ def _emoji(mes):
     return emoji.emojize(mes, use_aliases=True)
 
 if __name__ == '__main__':
-    command_handler(sys.argv)
+    status = _forward_to_daemon(sys.argv)
+    sys.exit(command_handler(sys.argv) if status is None else status)
 
@@ -0,0 +1,183 @@
+import io
+import os
+import sys
+import json
+import time
+import pathlib
+import tempfile
+import threading
+import contextlib
+import http.server
+import urllib.parse
+import unittest
+import unittest.mock
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+import mc_ctl
+
+
+class _FakeApi(http.server.ThreadingHTTPServer):
+    # the DigitalOcean API endpoints the lookups use; every request is recorded as (method, path, query)
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _FakeApiHandler)
+        self.droplets = {}
+        self.requests = []
+        self.next_id = 1
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+    def add_droplet(self, name, tags=[]):
+        droplet_id = self.next_id
+        self.next_id += 1
+        self.droplets[droplet_id] = {
+            'id': droplet_id,
+            'name': name,
+            'status': 'active',
+            'tags': list(tags),
+            'networks': { 'v4': [ { 'ip_address': '10.0.0.{}'.format(droplet_id), 'type': 'public' } ], 'v6': [] }
+        }
+        return self.droplets[droplet_id]
+
+    def listings(self):
+        return [ query.get('tag_name', [ '' ])[0] for method, path, query in self.requests if method == 'GET' and path == 'droplets' ]
+
+    def call(self, method, path, query, request):
+        self.requests.append((method, path, query))
+        parts = path.split('/')
+        if path == 'droplets' and method == 'GET':
+            droplets = [ d for d in self.droplets.values() if 'tag_name' not in query or query['tag_name'][0] in d['tags'] ]
+            return 200, { 'droplets': droplets, 'links': {}, 'meta': { 'total': len(droplets) } }
+        elif path == 'droplets' and method == 'POST':
+            droplet = self.add_droplet(request['name'], request.get('tags') or [])
+            return 202, { 'droplet': droplet, 'links': { 'actions': [ { 'id': droplet['id'], 'rel': 'create' } ] } }
+        elif parts[0] == 'droplets' and method == 'DELETE':
+            del self.droplets[int(parts[1])]
+            return 204, None
+        elif path == 'account/keys' and method == 'GET':
+            return 200, { 'ssh_keys': [], 'links': {}, 'meta': { 'total': 0 } }
+        elif path == 'account/keys' and method == 'POST':
+            return 201, { 'ssh_key': { 'id': 1, 'name': request['name'], 'public_key': request['public_key'], 'fingerprint': '' } }
+        elif path == 'tags':
+            return 201, { 'tag': { 'name': request['name'], 'resources': {} } }
+        elif parts[0] == 'tags' and parts[2:] == [ 'resources' ]:
+            for resource in request['resources']:
+                self.droplets[int(resource['resource_id'])]['tags'].append(parts[1])
+            return 204, None
+        return 404, { 'id': 'not_found', 'message': path }
+
+
+class _FakeApiHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        url = urllib.parse.urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        code, response = self.server.call(method, url.path[len('/v2/'):].strip('/'), urllib.parse.parse_qs(url.query), request)
+        body = b'' if response is None else json.dumps(response).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DropletIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.api = _FakeApi()
+        self.addCleanup(self.api.close)
+        root = pathlib.Path(tempfile.mkdtemp(prefix='mc_ctl_test_'))
+        self.index_path = root / 'droplets.json'
+        for patcher in [
+                unittest.mock.patch.dict(os.environ, { 'DIGITALOCEAN_END_POINT': 'http://127.0.0.1:{}/v2/'.format(self.api.server_port) }),
+                unittest.mock.patch.object(mc_ctl, 'DIGITALOCEAN_API_TOKEN', 'test'),
+                unittest.mock.patch.object(mc_ctl, 'DROPLET_INDEX_PATH', self.index_path),
+                unittest.mock.patch.object(mc_ctl, 'PACK_INDEX_PATH', root / 'packs.json'),
+                unittest.mock.patch.object(mc_ctl, '_manager', None) ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_index(self, **entries):
+        mc_ctl._save_cache(self.index_path, { 'minecraft-{}'.format(world): entry for world, entry in entries.items() })
+
+    def read_index(self):
+        return mc_ctl._load_cache(self.index_path)
+
+    def test_fresh_entry_answers_without_api(self):
+        self.write_index(cached={ 'id': 7, 'ip_address': '10.1.1.1', 'cached_at': time.time() })
+        droplet = mc_ctl._find_droplet('cached')
+        self.assertEqual((droplet.id, droplet.name, droplet.ip_address), (7, 'minecraft-cached', '10.1.1.1'))
+        self.assertEqual(self.api.requests, [])
+
+    def test_expired_entry_looks_up_tagged_droplets(self):
+        droplet = self.api.add_droplet('minecraft-tagged', [ mc_ctl.DROPLET_TAG ])
+        self.write_index(tagged={ 'id': droplet['id'], 'ip_address': '10.1.1.1', 'cached_at': time.time() - mc_ctl.DROPLET_INDEX_TTL - 1 })
+        found = mc_ctl._find_droplet('tagged')
+        self.assertEqual((found.id, found.ip_address), (droplet['id'], '10.0.0.{}'.format(droplet['id'])))
+        self.assertEqual(self.api.listings(), [ mc_ctl.DROPLET_TAG ])
+        self.assertEqual(self.read_index()['minecraft-tagged']['ip_address'], found.ip_address)
+
+        # answered from the refreshed entry
+        mc_ctl._find_droplet('tagged')
+        self.assertEqual(self.api.listings(), [ mc_ctl.DROPLET_TAG ])
+
+    def test_tagged_listing_keeps_untagged_entries(self):
+        self.api.add_droplet('minecraft-tagged', [ mc_ctl.DROPLET_TAG ])
+        untagged = self.api.add_droplet('minecraft-untagged')
+        self.write_index(untagged={ 'id': untagged['id'], 'ip_address': '10.0.0.{}'.format(untagged['id']), 'cached_at': time.time() })
+        mc_ctl._find_droplet('tagged', use_index=False)
+        self.assertIn('minecraft-untagged', self.read_index())
+
+        mc_ctl._find_droplet('untagged')
+        self.assertEqual(self.api.listings(), [ mc_ctl.DROPLET_TAG ])
+
+    def test_untagged_droplet_falls_back_and_gets_tagged(self):
+        droplet = self.api.add_droplet('minecraft-untagged')
+        found = mc_ctl._find_droplet('untagged', use_index=False)
+        self.assertEqual(found.id, droplet['id'])
+        self.assertEqual(self.api.listings(), [ mc_ctl.DROPLET_TAG, '' ])
+        self.assertIn(mc_ctl.DROPLET_TAG, droplet['tags'])
+
+        # tagged now, so the account listing is not needed any more
+        mc_ctl._find_droplet('untagged', use_index=False)
+        self.assertEqual(self.api.listings(), [ mc_ctl.DROPLET_TAG, '', mc_ctl.DROPLET_TAG ])
+
+    def test_missing_droplet(self):
+        self.assertIsNone(mc_ctl._find_droplet('missing'))
+        self.assertEqual(self.api.listings(), [ mc_ctl.DROPLET_TAG, '' ])
+        self.assertEqual(self.read_index(), {})
+
+    def test_create_and_destroy_invalidate(self):
+        # left by a droplet of the same name which is gone
+        self.write_index(world={ 'id': 99, 'ip_address': '10.9.9.9', 'cached_at': time.time() })
+        created = mc_ctl._create_droplet('ssh-rsa AAAA test', 'world')
+        self.assertIn(mc_ctl.DROPLET_TAG, self.api.droplets[created.id]['tags'])
+        self.assertNotIn('minecraft-world', self.read_index())
+
+        found = mc_ctl._find_droplet('world')
+        self.assertEqual(found.id, created.id)
+        self.assertEqual(self.read_index()['minecraft-world']['id'], created.id)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            message = mc_ctl.destroy_server('world')
+        self.assertFalse(mc_ctl._is_failure_message(message), message)
+        self.assertNotIn(created.id, self.api.droplets)
+        self.assertNotIn('minecraft-world', self.read_index())
+        self.assertIsNone(mc_ctl._find_droplet('world'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import io
+import re
+import sys
+import time
+import socket
+import logging
+import pathlib
+import threading
+import contextlib
+import subprocess
+import unittest
+import unittest.mock
+
+# paramiko
+import paramiko
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+import mc_ctl
+
+
+class _SshServer(paramiko.ServerInterface):
+    # a droplet's sshd: runs exec requests with /bin/sh and refuses sessions beyond MaxSessions like sshd does
+    def __init__(self, client_key, max_sessions):
+        self.client_key = client_key
+        self.max_sessions = max_sessions
+        self.host_key = paramiko.RSAKey.generate(1024)
+        self.lock = threading.Lock()
+        self.transports = []
+        self.sessions = 0
+        self.max_seen_sessions = 0
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(8)
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.listener.close()
+        self.close_transports()
+
+    def close_transports(self):
+        with self.lock:
+            transports = list(self.transports)
+        for transport in transports:
+            transport.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        # port probes connect and close without negotiating, they are no transport
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self.host_key)
+        try:
+            transport.start_server(server=self)
+        except (paramiko.SSHException, EOFError):
+            return
+        with self.lock:
+            self.transports.append(transport)
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL if key == self.client_key else paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind != 'session':
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        with self.lock:
+            if self.sessions >= self.max_sessions:
+                return paramiko.OPEN_FAILED_RESOURCE_SHORTAGE
+            self.sessions += 1
+            self.max_seen_sessions = max(self.max_seen_sessions, self.sessions)
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self._exec, args=(channel, command.decode('utf-8')), daemon=True).start()
+        return True
+
+    def _exec(self, channel, command):
+        proc = subprocess.run([ '/bin/sh', '-c', command ], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        channel.sendall(proc.stdout)
+        with self.lock:
+            self.sessions -= 1
+        channel.send_exit_status(proc.returncode)
+        channel.close()
+
+
+class SshPoolTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.private_key = paramiko.RSAKey.generate(1024)
+        # port probes make the server side log banner errors
+        logging.getLogger('paramiko').addHandler(logging.NullHandler())
+
+    def setUp(self):
+        self.server = _SshServer(self.private_key, mc_ctl.SSH_MAX_SESSIONS)
+        patcher = unittest.mock.patch.object(mc_ctl, 'SSH_PORT', self.server.port)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.server.close)
+        self.addCleanup(mc_ctl._close_ssh_clients)
+
+    def get_client(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return mc_ctl._get_ssh_client('127.0.0.1', self.private_key)
+
+    def test_reuses_transport(self):
+        client = self.get_client()
+        transport = client.get_transport()
+        self.assertIs(self.get_client(), client)
+        self.assertIs(self.get_client().get_transport(), transport)
+        self.assertEqual(len(self.server.transports), 1)
+
+    def test_reconnects_after_close(self):
+        client = self.get_client()
+        mc_ctl._close_ssh_client('127.0.0.1')
+        reconnected = self.get_client()
+        self.assertIsNot(reconnected, client)
+        self.assertTrue(reconnected.get_transport().is_active())
+        self.assertEqual(len(self.server.transports), 2)
+
+    def test_reconnects_after_transport_dropped(self):
+        client = self.get_client()
+        transport = client.get_transport()
+        self.server.close_transports()
+        deadline = time.time() + 10
+        while transport.is_active() and time.time() < deadline:
+            time.sleep(0.05)
+        reconnected = self.get_client()
+        self.assertIsNot(reconnected, client)
+        self.assertTrue(reconnected.get_transport().is_active())
+
+    def test_parallel_commands_share_transport(self):
+        client = self.get_client()
+        count = mc_ctl.SSH_MAX_SESSIONS * 2 + 3
+        commands = [ 'sleep 0.2; echo output {0}; exit {1}'.format(i, i % 3) for i in range(count) ]
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            ignored = mc_ctl._exec_commands(client, commands, ignore_error=True, parallel=True)
+            status = mc_ctl._exec_commands(client, commands, parallel=True)
+
+        self.assertEqual(ignored, 0)
+        # the first failing command in order decides the status
+        self.assertEqual(status, 1)
+        statuses = dict(re.findall(r'\[\[Executed (.*)\]\] status: (\d+)', output.getvalue()))
+        self.assertEqual(statuses, { command: str(i % 3) for i, command in enumerate(commands) })
+        for i in range(count):
+            self.assertIn('output {}\n'.format(i), output.getvalue())
+        self.assertEqual(len(self.server.transports), 1)
+        self.assertGreater(self.server.max_seen_sessions, 1)
+        self.assertLessEqual(self.server.max_seen_sessions, mc_ctl.SSH_MAX_SESSIONS)
+
+
+if __name__ == '__main__':
+    unittest.main()